@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for scripts/extract_pdfs.py.
+
+Generates a deterministic synthetic corpus offline (markdown stressing the
+regex fixes and the scorer, a .tex source, small PDFs made with PyMuPDF),
+then times each stage of the pipeline:
+
+1. Startup of a fresh interpreter: importing extract_pdfs, --help, and an
+   --incremental run with nothing to do
+2. apply_regex_latex_fixes and score_equation_quality on each markdown sample
+3. process_tex_file
+4. Each available extraction backend
+5. The end-to-end main() path on a raw/ tree
+
+Reports throughput (MB/s or pages/s), peak Python allocations and process
+RSS, and compares timings against a stored baseline; a benchmark slower
+than the baseline by more than --tolerance is flagged as a regression.
+
+Usage:
+    python scripts/benchmark_extract.py [--scale N] [--repeat N] [--only NAME ...]
+                                        [--baseline workspace/benchmark_baseline.json]
+                                        [--save-baseline] [--tolerance 0.25]
+                                        [--output FILE] [--keep-corpus DIR]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import extract_pdfs as ep
+
+# ─── Synthetic corpus ─────────────────────────────────────────────────
+
+PROSE = (
+    "Let the estimator be consistent under the stated regularity conditions "
+    "and suppose the moment function is continuously differentiable in a "
+    "neighbourhood of the true parameter. The proof follows from a uniform "
+    "law of large numbers together with the continuous mapping theorem."
+).split()
+
+CORPUS_SEED = 20240601
+
+
+def prose(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(PROSE) for _ in range(words))
+
+
+def markdown_dense_commands(rng: random.Random, kb: int) -> str:
+    """Prose packed with bare \\alpha, \\frac{..}{..}, \\sum ... outside math."""
+    # LATEX_COMMANDS holds regex sources (r'\\alpha'); the corpus needs the commands themselves
+    commands = sorted(source.replace("\\\\", "\\") for source in ep.LATEX_COMMANDS)
+    parts = []
+    size = 0
+    while size < kb * 1024:
+        cmd = rng.choice(commands)
+        piece = f"{prose(rng, 6)} {cmd}"
+        if rng.random() < 0.3:
+            piece += "{a}{b}" if cmd == r"\frac" else "_{i=1}^n"
+        if rng.random() < 0.15:
+            piece += f" and $x_{rng.randint(1, 9)} {cmd} y$"
+        parts.append(piece)
+        size += len(piece) + 1
+    text = "\n".join(parts)
+    assert "\\alpha" in text or "\\frac" in text, "corpus must hold bare single-backslash commands"
+    assert "\\\\" not in text, "corpus must not hold escaped (double-backslash) commands"
+    return text
+
+
+def markdown_code_fences(rng: random.Random, kb: int) -> str:
+    """Many fenced code blocks whose LaTeX-looking content must be left alone."""
+    parts = []
+    size = 0
+    while size < kb * 1024:
+        piece = (
+            f"{prose(rng, 20)}\n\n```python\nx = r'\\alpha + \\beta'  # {rng.randint(0, 999)}\n"
+            f"print(x)\n```\n\nInline `\\gamma` and \\delta in text.\n"
+        )
+        parts.append(piece)
+        size += len(piece)
+    return "\n".join(parts)
+
+
+def markdown_font_artifacts(rng: random.Random, kb: int) -> str:
+    """Text riddled with the font-encoding artifacts of FONT_ARTIFACTS."""
+    artifacts = sorted(ep.FONT_ARTIFACTS)
+    parts = []
+    size = 0
+    while size < kb * 1024:
+        piece = f"{prose(rng, 8)} {rng.choice(artifacts)}{rng.choice(PROSE)}"
+        parts.append(piece)
+        size += len(piece) + 1
+    return "\n".join(parts)
+
+
+def markdown_textbook(rng: random.Random, kb: int) -> str:
+    """Textbook-sized mix: headings, display and inline math, environments."""
+    parts = []
+    size = 0
+    chapter = 0
+    while size < kb * 1024:
+        chapter += 1
+        piece = (
+            f"## {chapter}. Asymptotic theory\n\n{prose(rng, 80)}\n\n"
+            f"**Theorem {chapter}.1.** If $\\hat\\theta_n \\to \\theta_0$ then\n\n"
+            f"$$\\sqrt{{n}}(\\hat\\theta_n - \\theta_0) \\to N(0, \\Sigma)$$\n\n"
+            f"\\begin{{equation}}\\sum_{{i=1}}^n x_i\\end{{equation}}\n\n"
+            f"{prose(rng, 60)} where \\lambda and \\sigma are fixed.\n\n"
+        )
+        parts.append(piece)
+        size += len(piece)
+    return "".join(parts)
+
+
+def tex_source(rng: random.Random, kb: int) -> str:
+    parts = ["\\documentclass{article}\n\\title{Synthetic Paper}\n\\author{A. Author}\n\\begin{document}\n"]
+    size = 0
+    while size < kb * 1024:
+        piece = (
+            f"\\begin{{theorem}}{prose(rng, 30)}\\end{{theorem}}\n"
+            f"\\begin{{proof}}{prose(rng, 60)}\n\\begin{{align}}a &= b\\end{{align}}\\end{{proof}}\n"
+        )
+        parts.append(piece)
+        size += len(piece)
+    parts.append("\\end{document}\n")
+    return "".join(parts)
+
+
+def write_pdf(path: Path, rng: random.Random, pages: int):
+    """A small text PDF with one paragraph block per page."""
+    doc = ep.import_pymupdf().open()
+    for n in range(pages):
+        page = doc.new_page()
+        lines = [f"Section {n + 1}: Asymptotic theory"]
+        lines += [prose(rng, 12) for _ in range(40)]
+        page.insert_text((56, 56), "\n".join(lines), fontsize=9)
+    doc.save(path, deflate=False)
+    doc.close()
+
+
+def generate_corpus(root: Path, scale: int = 1) -> dict:
+    """
+    Write the corpus under `root` and return its manifest. The same seed
+    and scale always produce byte-identical inputs.
+    """
+    rng = random.Random(CORPUS_SEED)
+    markdown = {
+        "dense_commands": markdown_dense_commands(rng, 256 * scale),
+        "code_fences": markdown_code_fences(rng, 256 * scale),
+        "font_artifacts": markdown_font_artifacts(rng, 256 * scale),
+        "textbook": markdown_textbook(rng, 2048 * scale),
+    }
+
+    md_dir = root / "markdown"
+    md_dir.mkdir(parents=True, exist_ok=True)
+    for name, text in markdown.items():
+        (md_dir / f"{name}.md").write_text(text, encoding="utf-8")
+
+    raw = root / "raw"
+    for sub in ("draft", "reference", "style", "objective"):
+        (raw / sub).mkdir(parents=True, exist_ok=True)
+    (raw / "draft" / "main.tex").write_text(tex_source(rng, 128 * scale), encoding="utf-8")
+
+    pdfs = []
+    if ep.PYMUPDF_AVAILABLE:
+        for sub, count, pages in (("reference", 3, 12 * scale), ("style", 2, 4 * scale),
+                                  ("objective", 1, 6 * scale)):
+            for n in range(count):
+                path = raw / sub / f"{sub}{n}.pdf"
+                write_pdf(path, rng, pages)
+                pdfs.append((path, pages))
+
+    digest = hashlib.sha256()
+    for path in sorted(p for p in root.rglob("*") if p.is_file() and p.suffix != ".pdf"):
+        digest.update(path.read_bytes())
+    return {
+        "markdown": {name: md_dir / f"{name}.md" for name in markdown},
+        "tex": raw / "draft" / "main.tex",
+        "pdfs": pdfs,
+        "raw": raw,
+        "digest": digest.hexdigest()[:16],
+    }
+
+
+# ─── Measurement ──────────────────────────────────────────────────────
+
+def measure(fn, repeat: int, memory: bool = True) -> dict:
+    """Best-of-`repeat` wall time, then one traced run for peak allocations."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    result = {"best_s": round(min(times), 4), "mean_s": round(sum(times) / len(times), 4)}
+    if memory:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_alloc_mb"] = round(peak / (1024 * 1024), 1)
+    result["peak_rss_mb"] = ep.peak_rss_mb()
+    return result
+
+
+def throughput(result: dict, amount: float, unit: str) -> dict:
+    result["throughput"] = round(amount / result["best_s"], 2) if result["best_s"] else None
+    result["unit"] = unit
+    return result
+
+
+def bench_fixes(corpus: dict, repeat: int) -> dict:
+    results = {}
+    for name, path in corpus["markdown"].items():
+        text = path.read_text(encoding="utf-8")
+        mb = len(text.encode("utf-8")) / (1024 * 1024)
+        results[f"fixes/{name}"] = throughput(
+            measure(lambda: ep.apply_regex_latex_fixes(text), repeat), mb, "MB/s"
+        )
+    return results
+
+
+def bench_scorer(corpus: dict, repeat: int) -> dict:
+    results = {}
+    for name, path in corpus["markdown"].items():
+        text, _ = ep.apply_regex_latex_fixes(path.read_text(encoding="utf-8"))
+        mb = len(text.encode("utf-8")) / (1024 * 1024)
+        results[f"score/{name}"] = throughput(
+            measure(lambda: ep.score_equation_quality(text), repeat), mb, "MB/s"
+        )
+    return results
+
+
+def bench_tex(corpus: dict, repeat: int) -> dict:
+    path = str(corpus["tex"])
+    mb = os.path.getsize(path) / (1024 * 1024)
+    return {"tex/process_tex_file": throughput(
+        measure(lambda: ep.process_tex_file(path), repeat), mb, "MB/s"
+    )}
+
+
+def bench_backends(corpus: dict, repeat: int) -> dict:
+    results = {}
+    pages = sum(n for _, n in corpus["pdfs"])
+    for method, iter_fn in ep.backend_chain():
+        if method == "marker-pdf":
+            # One model load plus GPU/CPU inference per page: too slow to repeat
+            repeat = 1
+
+        def run():
+            for path, _ in corpus["pdfs"]:
+                for _ in iter_fn(str(path)):
+                    pass
+
+        results[f"backend/{method}"] = throughput(measure(run, repeat, memory=False), pages, "pages/s")
+    return results
+
+
+def bench_main(corpus: dict, repeat: int) -> dict:
+    pages = sum(n for _, n in corpus["pdfs"])
+    work = corpus["raw"].parent / "main_run"
+
+    def run():
+        argv = sys.argv
+        sys.argv = [
+            "extract_pdfs.py",
+            "--raw-dir", str(corpus["raw"]),
+            "--cleaned-dir", str(work / "cleaned"),
+            "--quality-file", str(work / "extraction_quality.json"),
+            "--manifest", str(work / "extraction_manifest.json"),
+            "--reports-file", str(work / "extraction_reports.jsonl"),
+            "--backend-history", str(work / "backend_history.json"),
+            "--index", str(work / "cleaned_index.sqlite"),
+            "--no-cache",
+        ]
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                ep.main()
+        finally:
+            sys.argv = argv
+
+    return {"main/end_to_end": throughput(measure(run, repeat, memory=False), pages, "pages/s")}
+
+
+def bench_startup(corpus: dict, repeat: int) -> dict:
+    """Fresh-interpreter start: import, --help, and an --incremental run with nothing to do."""
+    script = str(Path(ep.__file__).resolve())
+    work = corpus["raw"].parent / "startup_run"
+    noop = [
+        sys.executable, script, "--incremental", "--no-cache",
+        "--raw-dir", str(corpus["raw"]),
+        "--cleaned-dir", str(work / "cleaned"),
+        "--quality-file", str(work / "extraction_quality.json"),
+        "--manifest", str(work / "extraction_manifest.json"),
+        "--reports-file", str(work / "extraction_reports.jsonl"),
+        "--backend-history", str(work / "backend_history.json"),
+        "--index", str(work / "cleaned_index.sqlite"),
+    ]
+    commands = {
+        "startup/import": [sys.executable, "-c", f"import sys; sys.path.insert(0, {str(Path(script).parent)!r}); "
+                                                 "import extract_pdfs"],
+        "startup/help": [sys.executable, script, "--help"],
+        "startup/noop_incremental": noop,
+    }
+    subprocess.run(noop, check=True, stdout=subprocess.DEVNULL)  # populate the manifest
+
+    results = {}
+    for name, command in commands.items():
+        def run():
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+        results[name] = throughput(measure(run, repeat, memory=False), 1, "runs/s")
+    return results
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "fixes": bench_fixes,
+    "score": bench_scorer,
+    "tex": bench_tex,
+    "backend": bench_backends,
+    "main": bench_main,
+}
+
+
+# ─── Baseline comparison ──────────────────────────────────────────────
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Names of benchmarks whose best time exceeds the baseline by > tolerance."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("best_s"):
+            result["vs_baseline"] = None
+            continue
+        ratio = result["best_s"] / base["best_s"]
+        result["vs_baseline"] = round(ratio, 2)
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the extraction pipeline on a synthetic corpus")
+    parser.add_argument("--scale", type=int, default=1, help="Corpus size multiplier")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (best is kept)")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Run only these groups")
+    parser.add_argument("--baseline", default="workspace/benchmark_baseline.json",
+                        help="Stored results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Flag benchmarks slower than baseline by more than this fraction")
+    parser.add_argument("--output", help="Also write the results JSON here")
+    parser.add_argument("--keep-corpus", metavar="DIR", help="Generate the corpus in DIR and keep it")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if args.keep_corpus:
+            root = Path(args.keep_corpus)
+        else:
+            root = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="extract_bench_")))
+
+        print(f"Generating corpus (scale {args.scale}) in {root}...")
+        corpus = generate_corpus(root, args.scale)
+        print(f"  Corpus digest: {corpus['digest']}, {len(corpus['pdfs'])} PDFs\n")
+
+        results = {}
+        for group, bench in BENCHMARKS.items():
+            if args.only and group not in args.only:
+                continue
+            if group in ("backend", "main") and not corpus["pdfs"]:
+                print(f"  Skipping {group}: PyMuPDF is not available")
+                continue
+            results.update(bench(corpus, args.repeat))
+
+    run = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": sys.version.split()[0],
+        "scale": args.scale,
+        "corpus_digest": corpus["digest"],
+        "backend_versions": {m: ep.backend_version(m) for m, _ in ep.backend_chain()},
+        "results": results,
+    }
+
+    regressions = []
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("corpus_digest") != corpus["digest"]:
+            print(f"  Baseline corpus differs (scale {baseline.get('scale')}), not comparing\n")
+            baseline = None
+        else:
+            regressions = compare_to_baseline(results, baseline, args.tolerance)
+    run["regressions"] = regressions
+
+    print(f"{'benchmark':<28} {'best s':>9} {'throughput':>16} {'alloc MB':>9} {'vs base':>8}")
+    for name, r in results.items():
+        rate = f"{r['throughput']} {r['unit']}"
+        alloc = r.get("peak_alloc_mb", "")
+        vs = r.get("vs_baseline")
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<28} {r['best_s']:>9} {rate:>16} {alloc:>9} {vs if vs is not None else '':>8}{flag}")
+    print(f"\nPeak RSS: {ep.peak_rss_mb()} MB")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved baseline: {args.baseline}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
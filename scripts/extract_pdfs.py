@@ -2,62 +2,290 @@
 """
 Full PDF extraction pipeline adapted from ta-llm.
 
-Pipeline: Marker-PDF (deep learning) -> pymupdf4llm (fallback) -> PyMuPDF raw (last resort)
+Pipeline: Marker-PDF (deep learning) -> pymupdf4llm (fallback) -> PyMuPDF raw (last resort),
+with the route chosen per PDF by default
 
-For each PDF:
-1. Extract with Marker-PDF (equation-aware, layout-aware, OCR-capable)
+For each PDF, page by page:
+1. Extract with pymupdf4llm / PyMuPDF, re-extracting weak pages with Marker-PDF
+   (equation-aware, layout-aware, OCR-capable), or with Marker on the whole
+   document first; by default a quick probe and past runs decide which
+   (--fallback auto), --fallback page/document fix the choice
 2. Apply regex LaTeX fixes (font encoding artifacts, bare math commands)
 3. Score equation quality (garbled patterns, raw math, LaTeX equations)
-4. Write cleaned markdown with YAML frontmatter
+4. Write cleaned markdown with YAML frontmatter; with --images, each page's
+   figures are stored once in cleaned/_images/ by content hash and linked
+
+With --coordinator QUEUE_DIR, files are handed out through a work queue in a
+shared directory to `--worker QUEUE_DIR` processes on any number of machines;
+their reports are merged into the usual summary.
+
+Copies of the same source in raw/ (identical files, or PDFs whose first pages
+read nearly the same) are extracted once and the others linked to that output.
 
 Usage:
     python scripts/extract_pdfs.py [--raw-dir raw/] [--cleaned-dir cleaned/] [--quality-file workspace/extraction_quality.json]
+                                  [--reports-file workspace/extraction_reports.jsonl]
+                                  [--page-ranges FILE=RANGES ...] [--fallback auto|page|document]
+                                  [--target-quality SCORE] [--backend-history FILE]
+                                  [--escalate-below SCORE] [--backend-timeout SECONDS]
+                                  [--backend-timeout-per-page SECONDS] [--incremental] [--manifest FILE]
+                                  [--no-dedup | --dedup-threshold SIMILARITY]
+                                  [--watch [--settle SECONDS] [--poll-interval SECONDS]]
+                                  [--images [--image-min-size PIXELS]]
+                                  [--font-artifacts FILE] [--index FILE | --no-index]
+                                  [--trace FILE] [--workers N [--memory-budget MB] [--shard-pages N]]
+                                  [--coordinator QUEUE_DIR | --worker QUEUE_DIR] [--lease-timeout SECONDS]
+                                  [--async-pipeline [--fix-workers N] [--prefetch N] [--writers N]]
+                                  [--cache-dir DIR] [--no-cache]
+                                  [--marker-service] [--marker-batch-pages N]
 """
 
 import argparse
+import asyncio
+import bisect
+import hashlib
+import heapq
+import importlib.metadata
+import importlib.util
+import io
 import json
+import multiprocessing
 import os
+import queue
 import re
+import resource
+import select
+import shutil
+import signal
+import socket
+import sqlite3
+import struct
 import sys
+import tempfile
+import threading
 import time
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
+from multiprocessing.connection import AuthenticationError, Client, Listener
 from pathlib import Path
 
 import yaml
 
 # ─── Extraction backends ───────────────────────────────────────────────
 
-MARKER_AVAILABLE = False
-PYMUPDF4LLM_AVAILABLE = False
-PYMUPDF_AVAILABLE = False
+# Availability is checked without importing anything: Marker pulls in torch
+# and the whole ML stack, pymupdf4llm its layout models. Each backend is
+# imported the first time it is used (import_pymupdf & co.).
+
+
+def module_available(name: str) -> bool:
+    """Whether a top-level module is installed, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+MARKER_AVAILABLE = module_available("marker")
+PYMUPDF4LLM_AVAILABLE = module_available("pymupdf4llm")
+PYMUPDF_AVAILABLE = module_available("pymupdf") or module_available("fitz")
+
+
+def import_pymupdf():
+    """PyMuPDF (fitz on old installs)."""
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf
+    return pymupdf
+
+
+def import_pymupdf4llm():
+    import pymupdf4llm
+    return pymupdf4llm
+
 
-try:
+def import_marker():
+    """Marker's (PdfConverter, create_model_dict, text_from_rendered)."""
     from marker.converters.pdf import PdfConverter
     from marker.models import create_model_dict
     from marker.output import text_from_rendered
-    MARKER_AVAILABLE = True
-except ImportError:
-    pass
+    return PdfConverter, create_model_dict, text_from_rendered
 
-try:
-    import pymupdf4llm
-    PYMUPDF4LLM_AVAILABLE = True
-except ImportError:
-    pass
-
-try:
-    import pymupdf  # fitz
-    PYMUPDF_AVAILABLE = True
-except ImportError:
+
+# ─── Document probe ───────────────────────────────────────────────────
+
+# Pages sampled for the text-layer and density estimates
+PROBE_SAMPLE_PAGES = 8
+
+# PDFs with more pages than this are treated as textbooks (page-limited)
+TEXTBOOK_MIN_PAGES = 100
+
+# Replacement character and private-use code points: glyphs whose font
+# has no usable Unicode mapping
+_UNMAPPED_GLYPH = re.compile('[\ufffd\ue000-\uf8ff]')
+
+
+class PdfProbe:
+    """
+    One open of a PDF shared by the whole pipeline.
+
+    Captures the page count, file size, document metadata (title, author,
+    creation date) and, from up to PROBE_SAMPLE_PAGES evenly spaced pages,
+    whether there is a text layer, roughly how many characters a page
+    holds, how many glyphs have no Unicode mapping (U+FFFD or private-use
+    code points, i.e. broken font encodings), raw Unicode math per page and
+    the mean page quality score of the text layer — what backend routing
+    (see route_backends) needs. The open document stays available as `doc` for the backends
+    (see open_document) until close(); `path` is kept for consumers that
+    need a file, like Marker.
+    """
+
+    def __init__(self, path: str, size_bytes: int = None):
+        self.path = str(path)
+        self.size_bytes = size_bytes if size_bytes is not None else os.path.getsize(path)
+        self.doc = import_pymupdf().open(self.path)
+        self.page_count = len(self.doc)
+
+        meta = self.doc.metadata or {}
+        self.metadata = {
+            key: meta[field].strip()
+            for key, field in (("title", "title"), ("author", "author"), ("creation_date", "creationDate"))
+            if meta.get(field) and meta[field].strip()
+        }
+
+        step = max(1, self.page_count // PROBE_SAMPLE_PAGES)
+        sample = list(range(0, self.page_count, step))[:PROBE_SAMPLE_PAGES]
+        texts = [self.doc[i].get_text().strip() for i in sample]
+        chars = [len(t) for t in texts]
+        self.text_pages_sampled = len(sample)
+        self.text_layer_pages = sum(1 for c in chars if c >= PAGE_MIN_CHARS)
+        self.chars_per_page = round(sum(chars) / len(chars)) if chars else 0
+
+        unmapped = sum(len(_UNMAPPED_GLYPH.findall(t)) for t in texts)
+        self.unmapped_glyph_ratio = round(unmapped / sum(chars), 4) if sum(chars) else 0.0
+        counts = [count_equation_patterns(t) for t in texts if len(t) >= PAGE_MIN_CHARS]
+        self.raw_math_per_page = (
+            round(sum(c["raw_math_unicode"] for c in counts) / len(counts), 1) if counts else 0.0
+        )
+        scores = [quality_from_counts(c)["quality_score"] for c in counts]
+        self.sample_quality = round(sum(scores) / len(scores)) if scores else 0
+        self.weak_page_fraction = (
+            sum(1 for c in chars if c < PAGE_MIN_CHARS) + sum(1 for q in scores if q < PAGE_ESCALATION_SCORE)
+        ) / len(chars) if chars else 1.0
+
+    @property
+    def has_text_layer(self) -> bool:
+        return self.text_layer_pages > 0
+
+    def summary(self) -> dict:
+        """Report fields (everything but the open document)."""
+        return {
+            "page_count": self.page_count,
+            "has_text_layer": self.has_text_layer,
+            "text_layer_pages_sampled": f"{self.text_layer_pages}/{self.text_pages_sampled}",
+            "chars_per_page": self.chars_per_page,
+            "unmapped_glyph_ratio": self.unmapped_glyph_ratio,
+            "raw_math_per_page": self.raw_math_per_page,
+            "sample_quality": self.sample_quality,
+            "pdf_metadata": self.metadata,
+        }
+
+    def close(self):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def pdf_path_of(pdf) -> str:
+    """File path of a path-or-PdfProbe argument."""
+    return pdf.path if isinstance(pdf, PdfProbe) else pdf
+
+
+@contextmanager
+def open_document(pdf):
+    """
+    Yield an open PyMuPDF document for a path or a PdfProbe. A probe's
+    document is shared, so it is left open; a path is opened and closed here.
+    """
+    if isinstance(pdf, PdfProbe) and pdf.doc is not None:
+        yield pdf.doc
+        return
+    with import_pymupdf().open(pdf_path_of(pdf)) as doc:
+        yield doc
+
+
+# ─── Page selection ───────────────────────────────────────────────────
+
+def parse_page_ranges(spec: str) -> list[int]:
+    """
+    Parse a 1-based page range spec like "1-40,120-160,200" into sorted,
+    unique 0-based page indices.
+    """
+    pages = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        if first < 1 or last < first:
+            raise ValueError(f"invalid page range: {part!r}")
+        pages.update(range(first - 1, last))
+    return sorted(pages)
+
+
+def format_page_ranges(pages: list[int]) -> str:
+    """Inverse of parse_page_ranges: [0, 1, 2, 9] -> "1-3,10"."""
+    runs = []
+    for p in sorted(pages):
+        if runs and p == runs[-1][1] + 1:
+            runs[-1][1] = p
+        else:
+            runs.append([p, p])
+    return ",".join(f"{a+1}-{b+1}" if a != b else f"{a+1}" for a, b in runs)
+
+
+def clamp_pages(pages: list[int], page_count: int) -> list[int]:
+    """Drop page indices past the end of a document."""
+    return [p for p in pages if p < page_count]
+
+
+@contextmanager
+def slice_pdf(pdf, pages: list[int]):
+    """
+    Yield the path of a temporary PDF holding only `pages` of `pdf` (a path
+    or PdfProbe). Pages are copied out, so a shared document is not modified.
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf", prefix="slice_")
+    os.close(fd)
     try:
-        import fitz as pymupdf
-        PYMUPDF_AVAILABLE = True
-    except ImportError:
-        pass
+        with open_document(pdf) as src, import_pymupdf().open() as doc:
+            for p in clamp_pages(pages, len(src)):
+                doc.insert_pdf(src, from_page=p, to_page=p)
+            doc.save(tmp_path)
+        yield tmp_path
+    finally:
+        os.unlink(tmp_path)
 
 
 # ─── Marker singleton ─────────────────────────────────────────────────
 
+# Marker renders "\n\n{<page_id>}------...\n\n" before each page when
+# paginate_output is set; the page ids let one conversion be split back into
+# pages (and, for batched conversions, into the documents they came from).
+MARKER_CONFIG = {"paginate_output": True}
+MARKER_PAGE_SEPARATOR = re.compile(r'\n*\{(\d+)\}-{48}\n*')
+
 _marker_converter = None
 
 def get_marker_converter():
@@ -65,516 +293,5147 @@ def get_marker_converter():
     global _marker_converter
     if _marker_converter is None:
         print("  [marker] Loading ML models (first time may download ~1-2 GB)...")
+        PdfConverter, create_model_dict, _ = import_marker()
         artifact_dict = create_model_dict()
-        _marker_converter = PdfConverter(artifact_dict=artifact_dict)
+        _marker_converter = PdfConverter(artifact_dict=artifact_dict, config=MARKER_CONFIG)
         print("  [marker] Models loaded.")
     return _marker_converter
 
 
-# ─── Extraction functions ──────────────────────────────────────────────
+def split_marker_pages(text: str) -> dict[int, str]:
+    """Split paginated Marker markdown into {page_id: page_markdown}."""
+    pages = {}
+    parts = MARKER_PAGE_SEPARATOR.split(text)
+    # parts = [preamble, id0, body0, id1, body1, ...]
+    if parts[0].strip():
+        pages[0] = parts[0].strip()
+    for page_id, body in zip(parts[1::2], parts[2::2]):
+        page_id = int(page_id)
+        pages[page_id] = (pages.get(page_id, "") + "\n\n" + body.strip()).strip()
+    return pages
 
-def extract_with_marker(pdf_path: str, max_pages: int = None) -> tuple[str, str]:
-    """Extract PDF using Marker-PDF (deep learning). Returns (markdown, method)."""
+
+def marker_page_texts(pages: dict[int, str], first: int = 0, last: int = None) -> list[str]:
+    """Markdown of pages first..last-1 (all pages if last is None) of a split conversion."""
+    if last is None:
+        last = max(pages, default=-1) + 1
+    return [pages.get(i, "") for i in range(first, last)]
+
+
+def convert_with_marker(pdf_path, pages: list[int] = None) -> str:
+    """
+    Run the process-local Marker converter and return paginated markdown.
+
+    Marker has no per-call page limit, so a page selection is applied by
+    converting a temporary PDF holding only those pages. `pdf_path` may
+    also be a PdfProbe. With --images, the pictures Marker renders go to
+    the image store.
+    """
     converter = get_marker_converter()
-    rendered = converter(pdf_path)
-    text, metadata, images = text_from_rendered(rendered)
+    _, _, text_from_rendered = import_marker()
+    if pages is None:
+        rendered = converter(pdf_path_of(pdf_path))
+        text, metadata, images = text_from_rendered(rendered)
+        return store_marker_images(text or "", images)
 
-    if max_pages and text:
-        # Marker doesn't have a native page limit; approximate by splitting on page markers
-        # Marker uses "---" or similar as page breaks in some outputs
-        pass  # Keep full extraction; page limiting handled at read time
+    with slice_pdf(pdf_path, pages) as sliced_path:
+        rendered = converter(sliced_path)
+        text, metadata, images = text_from_rendered(rendered)
+    return store_marker_images(text or "", images)
 
-    return text, "marker-pdf"
 
+# ─── Marker extraction service ────────────────────────────────────────
 
-def extract_with_pymupdf4llm(pdf_path: str, max_pages: int = None) -> tuple[str, str]:
-    """Extract PDF using pymupdf4llm (rule-based, fast). Returns (markdown, method)."""
-    kwargs = {}
-    if max_pages:
-        kwargs["pages"] = list(range(max_pages))
+# Set in the environment (so spawned pool workers inherit them) while a
+# service started by start_marker_service() is running.
+MARKER_SERVICE_ENV = "EXTRACT_PDFS_MARKER_SERVICE"
+MARKER_SERVICE_KEY_ENV = "EXTRACT_PDFS_MARKER_SERVICE_KEY"
 
-    md_text = pymupdf4llm.to_markdown(pdf_path, **kwargs)
-    return md_text, "pymupdf4llm"
 
+def marker_service_address():
+    """(host, port) of the running Marker service, or None."""
+    address = os.environ.get(MARKER_SERVICE_ENV)
+    if not address:
+        return None
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
 
-def extract_with_pymupdf(pdf_path: str, max_pages: int = None) -> tuple[str, str]:
-    """Extract PDF using raw PyMuPDF (basic text). Returns (text, method)."""
-    doc = pymupdf.open(pdf_path)
-    pages_to_extract = min(len(doc), max_pages) if max_pages else len(doc)
 
-    text_parts = []
-    for i in range(pages_to_extract):
-        page = doc[i]
-        text_parts.append(f"<!-- Page {i+1} -->\n{page.get_text()}")
+def extract_via_marker_service(pdf_path, pages: list[int] = None) -> list[str]:
+    """
+    Submit one PDF (optionally a page selection) to the Marker service;
+    returns per-page markdown. A PdfProbe's page count is sent along so
+    the service need not open the file to size its batches.
+    """
+    authkey = bytes.fromhex(os.environ[MARKER_SERVICE_KEY_ENV])
+    request = {"pdf_path": os.path.abspath(pdf_path_of(pdf_path)), "pages": pages}
+    if isinstance(pdf_path, PdfProbe):
+        request["page_count"] = pdf_path.page_count
+    with Client(marker_service_address(), authkey=authkey) as conn:
+        conn.send(request)
+        ok, payload = conn.recv()
+    if not ok:
+        raise RuntimeError(f"marker service: {payload}")
+    return payload
+
 
-    doc.close()
-    return "\n\n".join(text_parts), "pymupdf-raw"
+def _marker_request_pages(request: dict) -> int:
+    """Number of pages a service request will contribute to a batch."""
+    n = request.get("page_count")
+    if n is None:
+        if not PYMUPDF_AVAILABLE:
+            return 1
+        try:
+            with import_pymupdf().open(request["pdf_path"]) as doc:
+                n = len(doc)
+        except Exception:
+            return 1
+    return len(clamp_pages(request["pages"], n)) if request["pages"] is not None else n
+
+
+def _convert_marker_single(request: dict) -> tuple[bool, list[str]]:
+    try:
+        text = convert_with_marker(request["pdf_path"], request["pages"])
+        return True, marker_page_texts(split_marker_pages(text))
+    except Exception as e:
+        return False, f"{type(e).__name__}: {e}"
 
 
-def extract_pdf(pdf_path: str, max_pages: int = None) -> tuple[str, str, list[str]]:
+def convert_marker_batch(requests: list[dict]) -> list[tuple[bool, list[str]]]:
     """
-    Try extraction backends in order: marker -> pymupdf4llm -> pymupdf raw.
-    Returns (markdown_text, method_used, warnings).
+    Convert several PDFs in one Marker call.
+
+    The requested pages of every document are concatenated into one
+    temporary PDF, so Marker's layout/OCR/equation models see pages from all
+    documents in the same inference batches. The paginated output is then
+    split back per document. A document that cannot be merged, or a batch
+    that fails as a whole, is converted on its own so one bad PDF never
+    fails the others.
     """
-    warnings = []
+    if len(requests) == 1 or not PYMUPDF_AVAILABLE:
+        return [_convert_marker_single(r) for r in requests]
 
-    # Try Marker first (best quality)
-    if MARKER_AVAILABLE:
+    results = [None] * len(requests)
+    spans = {}
+    merged = import_pymupdf().open()
+    for i, req in enumerate(requests):
         try:
-            text, method = extract_with_marker(pdf_path, max_pages)
-            if text and len(text.strip()) > 100:
-                return text, method, warnings
-            else:
-                warnings.append("marker returned empty/short output, falling back")
+            with import_pymupdf().open(req["pdf_path"]) as src:
+                if req["pages"] is not None:
+                    src.select(clamp_pages(req["pages"], len(src)))
+                start = len(merged)
+                merged.insert_pdf(src)
+            spans[i] = (start, len(merged))
         except Exception as e:
-            warnings.append(f"marker failed: {e}")
+            results[i] = (False, f"{type(e).__name__}: {e}")
 
-    # Try pymupdf4llm (good quality, fast)
-    if PYMUPDF4LLM_AVAILABLE:
+    if spans:
+        fd, tmp_path = tempfile.mkstemp(suffix=".pdf", prefix="marker_batch_")
+        os.close(fd)
         try:
-            text, method = extract_with_pymupdf4llm(pdf_path, max_pages)
-            if text and len(text.strip()) > 100:
-                return text, method, warnings
-            else:
-                warnings.append("pymupdf4llm returned empty/short output, falling back")
-        except Exception as e:
-            warnings.append(f"pymupdf4llm failed: {e}")
+            merged.save(tmp_path)
+            merged.close()
+            pages = split_marker_pages(convert_with_marker(tmp_path))
+            for i, (first, last) in spans.items():
+                results[i] = (True, marker_page_texts(pages, first, last))
+        except Exception:
+            for i in spans:
+                results[i] = _convert_marker_single(requests[i])
+        finally:
+            os.unlink(tmp_path)
+    else:
+        merged.close()
 
-    # Last resort: raw PyMuPDF
-    if PYMUPDF_AVAILABLE:
+    return results
+
+
+def _marker_service_main(ready_conn, authkey: bytes, batch_pages: int, batch_wait: float):
+    """
+    Service process: load the models once, then convert queued requests in
+    batches of up to `batch_pages` pages, waiting at most `batch_wait`
+    seconds after the first request for others to arrive.
+    """
+    get_marker_converter()
+    listener = Listener(("127.0.0.1", 0), authkey=authkey)
+    ready_conn.send(listener.address)
+    ready_conn.close()
+
+    pending = queue.Queue()
+
+    def receive(conn):
         try:
-            text, method = extract_with_pymupdf(pdf_path, max_pages)
-            return text, method, warnings
-        except Exception as e:
-            warnings.append(f"pymupdf-raw failed: {e}")
+            pending.put((conn, conn.recv()))
+        except (EOFError, OSError):
+            conn.close()
 
-    return "", "none", warnings + ["ALL extraction methods failed"]
+    def accept_loop():
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError):
+                continue
+            threading.Thread(target=receive, args=(conn,), daemon=True).start()
 
+    threading.Thread(target=accept_loop, daemon=True).start()
 
-# ─── Regex LaTeX fixes (adapted from ta-llm) ──────────────────────────
+    while True:
+        batch = [pending.get()]
+        pages = _marker_request_pages(batch[0][1])
+        deadline = time.monotonic() + batch_wait
+        while pages < batch_pages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            pages += _marker_request_pages(item[1])
 
-# Font encoding artifact map (common PDF extraction artifacts)
-FONT_ARTIFACTS = {
-    'ð': '(',
-    'Þ': ')',
-    'þ': '+',
-    '¤': 'ff',
-    '‰': 'ffi',
-    '½': '[',
-    '¼': '=',
-    'ﬁ': 'fi',
-    'ﬂ': 'fl',
-    'ﬀ': 'ff',
-    'ﬃ': 'ffi',
-    'ﬄ': 'ffl',
-}
+        results = convert_marker_batch([req for _, req in batch])
+        for (conn, _), result in zip(batch, results):
+            try:
+                conn.send(result)
+            except OSError:
+                pass
+            finally:
+                conn.close()
 
-# LaTeX commands that should be wrapped in $...$ if found bare
-LATEX_COMMANDS = [
-    r'\\alpha', r'\\beta', r'\\gamma', r'\\delta', r'\\epsilon', r'\\varepsilon',
-    r'\\zeta', r'\\eta', r'\\theta', r'\\vartheta', r'\\iota', r'\\kappa',
-    r'\\lambda', r'\\mu', r'\\nu', r'\\xi', r'\\pi', r'\\rho', r'\\sigma',
-    r'\\tau', r'\\upsilon', r'\\phi', r'\\varphi', r'\\chi', r'\\psi', r'\\omega',
-    r'\\Gamma', r'\\Delta', r'\\Theta', r'\\Lambda', r'\\Xi', r'\\Pi',
-    r'\\Sigma', r'\\Upsilon', r'\\Phi', r'\\Psi', r'\\Omega',
-    r'\\hat', r'\\tilde', r'\\bar', r'\\vec', r'\\dot', r'\\ddot',
-    r'\\sum', r'\\prod', r'\\int', r'\\partial', r'\\nabla', r'\\infty',
-    r'\\sqrt', r'\\frac', r'\\mathbb', r'\\mathcal', r'\\mathbf', r'\\mathrm',
-    r'\\text', r'\\operatorname',
-]
 
-# Math operators that should be in math mode
-MATH_OPERATORS = [
-    r'E\s*\(', r'Var\s*\(', r'Cov\s*\(', r'Corr\s*\(',
-    r'plim', r'argmin', r'argmax', r'sup\b', r'inf\b',
-    r'log\s*\(', r'exp\s*\(', r'tr\s*\(',
-]
+class MarkerService:
+    """
+    A long-lived local process that holds the only copy of the Marker models.
 
-# Convergence arrow patterns
-CONVERGENCE_PATTERNS = [
-    (r'→d\b', r'$\\xrightarrow{d}$'),
-    (r'→p\b', r'$\\xrightarrow{p}$'),
-    (r'→a\.s\.\b', r'$\\xrightarrow{a.s.}$'),
-    (r'\+d\b(?!\w)', r'$\\xrightarrow{d}$'),
-    (r'\+p\b(?!\w)', r'$\\xrightarrow{p}$'),
-]
+    Pool workers find it through environment variables and submit PDFs over
+    an authenticated local socket, so N workers share one model load and
+    their pages are batched together instead of N converters each holding
+    1–2 GB of models.
+    """
 
+    def __init__(self, batch_pages: int = 32, batch_wait: float = 0.5):
+        self.batch_pages = batch_pages
+        self.batch_wait = batch_wait
+        self.process = None
 
-def is_in_math_mode(text: str, pos: int) -> bool:
-    """Check if position is inside $...$ or $$...$$ or \\[...\\]."""
-    # Count $ signs before position
-    before = text[:pos]
+    def start(self):
+        authkey = os.urandom(16)
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(
+            target=_marker_service_main,
+            args=(child_conn, authkey, self.batch_pages, self.batch_wait),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        try:
+            host, port = parent_conn.recv()
+        except EOFError:
+            raise RuntimeError("marker service exited during startup")
+        os.environ[MARKER_SERVICE_ENV] = f"{host}:{port}"
+        os.environ[MARKER_SERVICE_KEY_ENV] = authkey.hex()
+        return self
 
-    # Check $$...$$
-    dd_count = before.count('$$')
-    if dd_count % 2 == 1:
-        return True
+    def stop(self):
+        os.environ.pop(MARKER_SERVICE_ENV, None)
+        os.environ.pop(MARKER_SERVICE_KEY_ENV, None)
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
 
-    # Check $...$  (but not $$)
-    # Remove $$ first, then count remaining $
-    stripped = before.replace('$$', '')
-    single_count = stripped.count('$')
-    if single_count % 2 == 1:
-        return True
 
-    # Check \[...\]
-    open_brackets = len(re.findall(r'\\\[', before))
-    close_brackets = len(re.findall(r'\\\]', before))
-    if open_brackets > close_brackets:
-        return True
+# ─── Extraction cache ─────────────────────────────────────────────────
 
-    return False
+# Bump when the logic (not just the tables) of a post-processing stage changes
+FIXES_VERSION = 2
+SCORER_VERSION = 3
 
+BACKEND_PACKAGES = {
+    "marker-pdf": "marker-pdf",
+    "pymupdf4llm": "pymupdf4llm",
+    "pymupdf-raw": "pymupdf",
+}
 
-def is_in_code_block(text: str, pos: int) -> bool:
-    """Check if position is inside a fenced code block."""
-    before = text[:pos]
-    fence_count = len(re.findall(r'^```', before, re.MULTILINE))
-    return fence_count % 2 == 1
 
+def backend_version(method: str) -> str:
+    """Installed version of the package behind an extraction method."""
+    try:
+        return importlib.metadata.version(BACKEND_PACKAGES[method])
+    except (KeyError, importlib.metadata.PackageNotFoundError):
+        return "unknown"
 
-def is_in_yaml_frontmatter(text: str, pos: int) -> bool:
-    """Check if position is inside YAML frontmatter (between --- delimiters at start)."""
-    if not text.startswith('---'):
-        return False
-    end_marker = text.find('---', 3)
-    if end_marker == -1:
-        return False
-    return pos < end_marker + 3
 
+def fix_table_version() -> str:
+    """Fingerprint of the regex fix tables; changes whenever a table is edited."""
+    tables = [FIXES_VERSION, FONT_ARTIFACTS, LATEX_COMMANDS, CONVERGENCE_PATTERNS]
+    blob = json.dumps(tables, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()[:16]
 
-def apply_regex_latex_fixes(text: str) -> tuple[str, int]:
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CacheRecordWriter:
     """
-    Apply regex-based LaTeX fixes adapted from ta-llm.
-    Returns (fixed_text, fix_count).
+    Streams JSON-lines records into a cache entry.
+
+    The entry only becomes visible on commit(); as a context manager it
+    commits on a clean exit and discards on any exception (including a
+    generator being closed early).
     """
-    fix_count = 0
 
-    # 1. Fix font encoding artifacts
-    for artifact, replacement in FONT_ARTIFACTS.items():
-        if artifact in text:
-            count = text.count(artifact)
-            text = text.replace(artifact, replacement)
-            fix_count += count
+    def __init__(self, path: Path):
+        self.path = path
+        self.tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        self.f = open(self.tmp, 'w', encoding='utf-8')
 
-    # 2. Wrap bare LaTeX commands in $...$
-    for cmd in LATEX_COMMANDS:
-        # Match the command NOT already inside math mode
-        pattern = re.compile(r'(?<!\$)(' + cmd + r'(?:\{[^}]*\})?)(?!\$)')
+    def write(self, record: dict):
+        self.f.write(json.dumps(record, ensure_ascii=False))
+        self.f.write("\n")
 
-        for match in pattern.finditer(text):
-            pos = match.start()
-            if not is_in_math_mode(text, pos) and not is_in_code_block(text, pos) and not is_in_yaml_frontmatter(text, pos):
-                # Only wrap if not already in math
-                pass  # Complex replacement done below
+    def commit(self):
+        self.f.close()
+        os.replace(self.tmp, self.path)
 
-        # Simpler approach: find bare commands and wrap them
-        def wrap_if_bare(m):
-            nonlocal fix_count, text
-            start = m.start()
-            # Quick check: is there a $ immediately before?
-            if start > 0 and text[start-1] == '$':
-                return m.group(0)
-            if is_in_code_block(text, start):
-                return m.group(0)
-            fix_count += 1
-            return f'${m.group(0)}$'
+    def discard(self):
+        self.f.close()
+        try:
+            os.unlink(self.tmp)
+        except OSError:
+            pass
 
-        # Reset and apply
-        text = pattern.sub(wrap_if_bare, text)
+    def __enter__(self):
+        return self
 
-    # 3. Fix convergence arrows
-    for pattern_str, replacement in CONVERGENCE_PATTERNS:
-        matches = re.findall(pattern_str, text)
-        if matches:
-            text = re.sub(pattern_str, replacement, text)
-            fix_count += len(matches)
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
 
-    return text, fix_count
 
+class ExtractionCache:
+    """
+    Content-addressed on-disk cache for extraction and post-processing.
 
-# ─── Equation quality scoring ──────────────────────────────────────────
+    Layout under `cache_dir`:
+        raw/<key>.jsonl     raw backend pages, keyed by content hash, backend,
+                            backend version and page selection
+        fixes/<key>.jsonl   pages after apply_regex_latex_fixes plus a
+                            summary record, keyed by raw key and
+                            fix_table_version()
+        quality/<key>.json  score_equation_quality output, keyed by fixes key
+                            and SCORER_VERSION
+        tex/<key>.json      scan of one .tex file (includes, metadata,
+                            environment counts), keyed by content hash and
+                            TEX_SCAN_VERSION
 
-def score_equation_quality(text: str) -> dict:
+    Editing FONT_ARTIFACTS or LATEX_COMMANDS therefore invalidates only the
+    fixes and quality entries, never the expensive raw extraction. Page
+    entries are JSON lines so they can be written and replayed one page at a
+    time. Entries are written atomically, so concurrent workers can share
+    one cache. Hits refresh the entry's mtime, which evict() uses as the LRU
+    clock.
     """
-    Score the quality of equation extraction in the text.
-    Returns quality metrics dict.
-    """
-    # Count LaTeX equations (good)
-    display_eqs = len(re.findall(r'\$\$.+?\$\$', text, re.DOTALL))
-    inline_eqs = len(re.findall(r'(?<!\$)\$(?!\$).+?(?<!\$)\$(?!\$)', text))
-    env_eqs = len(re.findall(r'\\begin\{(equation|align|gather|multline)', text))
-    total_latex = display_eqs + inline_eqs + env_eqs
-
-    # Count garbled patterns (bad) — common PDF extraction failures
-    garbled_patterns = [
-        r'[^\x00-\x7F]{3,}',  # Long sequences of non-ASCII
-        r'(?:\?\?){2,}',  # Multiple ??
-        r'[\x00-\x08\x0b\x0c\x0e-\x1f]',  # Control characters
-        r'[□■▪▫◊◇○●]',  # Box/geometric chars (often garbled math)
-    ]
-    garbled_count = 0
-    for p in garbled_patterns:
-        garbled_count += len(re.findall(p, text))
-
-    # Count raw math patterns (mediocre — extracted but not in LaTeX)
-    raw_math_patterns = [
-        r'(?<!\$)(?:α|β|γ|δ|ε|θ|λ|μ|σ|τ|φ|ψ|ω|Γ|Δ|Θ|Λ|Σ|Φ|Ψ|Ω)(?!\$)',  # Unicode Greek not in math
-        r'(?<!\$)(?:∑|∏|∫|∂|∇|∞|√|≤|≥|≠|≈|∈|∉|⊂|⊃|∩|∪)(?!\$)',  # Unicode math operators
-        r'(?<!\$)(?:→|←|↔|⇒|⇐|⇔)(?!\$)',  # Arrows not in math
-    ]
-    raw_math_count = 0
-    for p in raw_math_patterns:
-        raw_math_count += len(re.findall(p, text))
 
-    # Score: start at 100, penalize garbled and raw
-    score = 100
-    score -= garbled_count * 5  # Heavy penalty
-    score -= raw_math_count * 2  # Light penalty
-    score = max(0, min(100, score))
+    STAGES = ("raw", "fixes", "quality", "tex")
 
-    # Bonus for having many proper LaTeX equations
-    if total_latex > 10:
-        score = min(100, score + 5)
+    def __init__(self, cache_dir: str, max_bytes: int = None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        for stage in self.STAGES:
+            (self.cache_dir / stage).mkdir(parents=True, exist_ok=True)
 
-    return {
-        "quality_score": score,
-        "latex_equations": total_latex,
-        "display_equations": display_eqs,
-        "inline_equations": inline_eqs,
-        "environment_equations": env_eqs,
-        "garbled_patterns": garbled_count,
-        "raw_math_unicode": raw_math_count,
-    }
+    @staticmethod
+    def make_key(*parts) -> str:
+        blob = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
 
+    def raw_key(self, file_hash: str, method: str, pages: list[int] = None) -> str:
+        if method == "marker-pdf" and IMAGE_STORE is not None:
+            # Marker output then links the pictures it stored
+            return self.make_key("raw", file_hash, method, backend_version(method), pages,
+                                 IMAGE_STORE.variant())
+        return self.make_key("raw", file_hash, method, backend_version(method), pages)
 
-# ─── .tex file handling ────────────────────────────────────────────────
+    def fixes_key(self, raw_key: str) -> str:
+        return self.make_key("fixes", raw_key, fix_table_version())
 
-def process_tex_file(tex_path: str) -> tuple[str, dict]:
-    """Process a .tex file — wrap in markdown with code fence."""
-    with open(tex_path, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
+    def pages_fixes_key(self, file_hash: str, method: str, pages: list[int] = None,
+                        variant: str = None) -> str:
+        """fixes_key of a backend's pages, optionally transformed by `variant`."""
+        raw_key = self.raw_key(file_hash, method, pages)
+        if variant:
+            raw_key = self.make_key(raw_key, variant)
+        return self.fixes_key(raw_key)
 
-    # Extract metadata from LaTeX
-    title_match = re.search(r'\\title\{(.+?)\}', content, re.DOTALL)
-    author_match = re.search(r'\\author\{(.+?)\}', content, re.DOTALL)
+    def quality_key(self, fixes_key: str) -> str:
+        return self.make_key("quality", fixes_key, SCORER_VERSION)
 
-    title = title_match.group(1).strip() if title_match else Path(tex_path).stem
-    authors = author_match.group(1).strip() if author_match else "Unknown"
+    def tex_key(self, file_hash: str) -> str:
+        return self.make_key("tex", file_hash, TEX_SCAN_VERSION)
 
-    # Wrap in code fence for preservation
-    markdown = f"# {title}\n\n```latex\n{content}\n```\n"
+    def _path(self, stage: str, key: str, suffix: str = ".json") -> Path:
+        return self.cache_dir / stage / f"{key}{suffix}"
 
-    line_count = content.count('\n') + 1
+    @staticmethod
+    def _touch(path: Path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
 
-    quality = {
-        "quality_score": 100,
-        "latex_equations": len(re.findall(r'\\begin\{(equation|align|theorem|proof|lemma)', content)),
-        "note": "Native LaTeX source — no extraction needed",
-    }
+    def get(self, stage: str, key: str):
+        """Return the cached value for (stage, key), or None on a miss."""
+        path = self._path(stage, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return value
 
-    return markdown, {
-        "title": title,
-        "authors": authors,
-        "page_count": line_count // 50,  # Approximate
-        "word_count": len(content.split()),
-        "line_count": line_count,
-        "extraction_method": "native-tex",
-        "quality": quality,
-    }
+    def put(self, stage: str, key: str, value):
+        """Store a JSON-serializable value atomically."""
+        path = self._path(stage, key)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
 
+    def has_records(self, stage: str, key: str) -> bool:
+        return self._path(stage, key, ".jsonl").exists()
 
-# ─── Main pipeline ─────────────────────────────────────────────────────
+    def iter_records(self, stage: str, key: str):
+        """Iterator over a JSON-lines entry's records, or None on a miss."""
+        path = self._path(stage, key, ".jsonl")
+        try:
+            f = open(path, 'r', encoding='utf-8')
+        except OSError:
+            return None
+        self._touch(path)
+        return self._read_records(f)
 
-def detect_file_type(path: str) -> str:
-    """Detect if file is a textbook (large) or paper (small)."""
-    size_mb = os.path.getsize(path) / (1024 * 1024)
-    if size_mb > 3:
-        return "textbook"
-    return "paper"
+    @staticmethod
+    def _read_records(f):
+        with f:
+            for line in f:
+                yield json.loads(line)
 
+    def record_writer(self, stage: str, key: str) -> CacheRecordWriter:
+        return CacheRecordWriter(self._path(stage, key, ".jsonl"))
 
-def process_file(
-    file_path: str,
-    source_type: str,
-    cleaned_dir: str,
-    textbook_page_limit: int = 50,
-) -> dict:
-    """
-    Process a single file through the full pipeline.
-    Returns extraction report dict.
-    """
-    fname = Path(file_path).name
-    stem = Path(file_path).stem
-    ext = Path(file_path).suffix.lower()
+    def evict(self) -> int:
+        """Delete least-recently-used entries until under max_bytes. Returns count removed."""
+        if not self.max_bytes:
+            return 0
+        entries = []
+        total = 0
+        for stage in self.STAGES:
+            for path in (self.cache_dir / stage).glob("*.json*"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
 
-    report = {
-        "source_file": file_path,
-        "source_type": source_type,
-        "filename": fname,
-        "file_size_mb": round(os.path.getsize(file_path) / (1024*1024), 2),
-    }
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
 
-    start_time = time.time()
 
-    try:
-        if ext == '.tex':
-            # .tex files — direct processing
-            markdown, meta = process_tex_file(file_path)
-            report.update(meta)
-            report["extraction_method"] = "native-tex"
-            report["extraction_time_s"] = round(time.time() - start_time, 1)
+# ─── Stage profiling ──────────────────────────────────────────────────
 
-        elif ext == '.pdf':
-            # Determine page limit for textbooks
-            file_type = detect_file_type(file_path)
-            max_pages = textbook_page_limit if file_type == "textbook" else None
-            report["file_type"] = file_type
-
-            if max_pages:
-                report["page_limit_applied"] = max_pages
-
-            # Step 1: Extract
-            print(f"  Extracting: {fname} ({report['file_size_mb']} MB, {file_type})")
-            raw_text, method, warnings = extract_pdf(file_path, max_pages)
-            report["extraction_method"] = method
-            report["extraction_warnings"] = warnings
-
-            if not raw_text or len(raw_text.strip()) < 50:
-                report["status"] = "FAILED"
-                report["error"] = "Extraction returned empty text"
-                return report
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024  # ru_maxrss: bytes on macOS, KiB on Linux
 
-            # Get page count from PyMuPDF regardless of extraction method
-            if PYMUPDF_AVAILABLE:
-                try:
-                    doc = pymupdf.open(file_path)
-                    report["page_count"] = len(doc)
-                    doc.close()
-                except:
-                    pass
 
-            report["raw_word_count"] = len(raw_text.split())
-            report["raw_char_count"] = len(raw_text)
+def peak_rss_mb() -> float:
+    """High-water resident set size of this process so far."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT / (1024 * 1024), 1)
 
-            # Step 2: Apply regex LaTeX fixes
-            fixed_text, fix_count = apply_regex_latex_fixes(raw_text)
-            report["latex_fixes_applied"] = fix_count
 
-            # Step 3: Score equation quality
-            quality = score_equation_quality(fixed_text)
-            report["quality"] = quality
+class StageProfiler:
+    """
+    Per-file wall time, CPU time and peak RSS for each pipeline stage.
 
-            markdown = fixed_text
-            report["extraction_time_s"] = round(time.time() - start_time, 1)
+    Stages run many times per file (once per page for the fix and scoring
+    stages), so calls are accumulated under the stage name. Peak RSS is the
+    process high-water mark when the stage finished; in a worker process it
+    includes earlier files. Backend attempts are recorded separately with
+    their outcome. With `trace=True` every call is also kept as a
+    Chrome-trace complete event (see write_trace).
 
-        else:
-            report["status"] = "SKIPPED"
-            report["error"] = f"Unsupported file type: {ext}"
-            return report
+    With `shared_process=True` (several files in flight in one process, as
+    in the async orchestrator) the file's CPU time is the sum of its
+    stages' rather than the whole process's; stages that ran in other
+    processes are folded in with absorb().
+    """
 
-        # Step 4: Write cleaned file with YAML frontmatter
-        out_dir = Path(cleaned_dir) / source_type
-        out_dir.mkdir(parents=True, exist_ok=True)
-        out_path = out_dir / f"{stem}.md"
-
-        # Build YAML frontmatter
-        frontmatter = {
-            "source_file": f"raw/{source_type}/{fname}",
-            "source_type": source_type,
-            "extraction_method": report.get("extraction_method", "unknown"),
-            "extraction_quality": report.get("quality", {}).get("quality_score", 0),
-        }
-        if "page_count" in report:
-            frontmatter["page_count"] = report["page_count"]
-        if "page_limit_applied" in report:
-            frontmatter["page_limit"] = report["page_limit_applied"]
+    def __init__(self, label: str = None, trace: bool = False, shared_process: bool = False):
+        self.label = label
+        self.trace = trace
+        self.shared_process = shared_process
+        self.stages = {}
+        self.attempts = []
+        self.events = []
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.absorbed_rss_mb = 0.0
 
-        frontmatter_str = yaml.dump(frontmatter, default_flow_style=False, sort_keys=False)
+    def _record(self, name: str, wall: float, cpu: float, started: float):
+        stage = self.stages.setdefault(
+            name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0}
+        )
+        stage["calls"] += 1
+        stage["wall_s"] += wall
+        stage["cpu_s"] += cpu
+        stage["peak_rss_mb"] = max(stage["peak_rss_mb"], peak_rss_mb())
+        if self.trace:
+            self.events.append({
+                "name": name, "cat": "stage", "ph": "X",
+                "ts": round(started * 1e6), "dur": round(wall * 1e6),
+                "pid": os.getpid(), "tid": 0, "args": {"file": self.label},
+            })
 
-        with open(out_path, 'w', encoding='utf-8') as f:
-            f.write(f"---\n{frontmatter_str}---\n\n{markdown}")
+    @contextmanager
+    def stage(self, name: str):
+        started = time.time()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - wall, time.process_time() - cpu, started)
 
-        report["output_file"] = str(out_path)
-        report["output_size_kb"] = round(os.path.getsize(out_path) / 1024, 1)
-        report["status"] = "OK"
+    def iterate(self, name: str, iterable):
+        """Yield from `iterable`, charging the time spent producing each item to `name`."""
+        it = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
 
-    except Exception as e:
-        report["status"] = "FAILED"
-        report["error"] = str(e)
-        report["traceback"] = traceback.format_exc()
+    def attempt(self, method: str, outcome: str, wall_s: float, error: str = None):
+        """Record one backend attempt: outcome is "ok", "short", "failed" or "timeout"."""
+        entry = {"backend": method, "outcome": outcome, "wall_s": round(wall_s, 3)}
+        if error:
+            entry["error"] = error
+        self.attempts.append(entry)
 
-    return report
+    def absorb(self, profile: dict, events: list[dict] = None):
+        """Fold in the report() of a profiler that ran in another process."""
+        for name, s in profile["stages"].items():
+            stage = self.stages.setdefault(
+                name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0}
+            )
+            stage["calls"] += s["calls"]
+            stage["wall_s"] += s["wall_s"]
+            stage["cpu_s"] += s["cpu_s"]
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"], s["peak_rss_mb"])
+        self.attempts.extend(profile["backend_attempts"])
+        self.absorbed_rss_mb = max(self.absorbed_rss_mb, profile["peak_rss_mb"])
+        if self.trace and events:
+            self.events.extend(events)
 
+    def report(self) -> dict:
+        if self.shared_process:
+            cpu = sum(s["cpu_s"] for s in self.stages.values())
+        else:
+            cpu = time.process_time() - self.cpu_start
+        return {
+            "wall_s": round(time.perf_counter() - self.start, 3),
+            "cpu_s": round(cpu, 3),
+            "peak_rss_mb": max(peak_rss_mb(), self.absorbed_rss_mb),
+            "stages": {
+                name: dict(s, wall_s=round(s["wall_s"], 4), cpu_s=round(s["cpu_s"], 4))
+                for name, s in self.stages.items()
+            },
+            "backend_attempts": self.attempts,
+        }
 
-def main():
-    parser = argparse.ArgumentParser(description="Extract PDFs using Marker-PDF pipeline")
-    parser.add_argument("--raw-dir", default="raw/", help="Raw input directory")
-    parser.add_argument("--cleaned-dir", default="cleaned/", help="Cleaned output directory")
-    parser.add_argument("--quality-file", default="workspace/extraction_quality.json", help="Quality report output")
-    parser.add_argument("--textbook-page-limit", type=int, default=50, help="Max pages for textbooks")
-    args = parser.parse_args()
 
-    raw_dir = Path(args.raw_dir)
-    cleaned_dir = Path(args.cleaned_dir)
+class ProfileAggregate:
+    """Sum the per-file "profile" sections of a batch, one report at a time."""
 
-    # Print available backends
-    print("=" * 60)
-    print("PDF Extraction Pipeline (adapted from ta-llm)")
-    print("=" * 60)
-    print(f"  Marker-PDF:  {'AVAILABLE' if MARKER_AVAILABLE else 'NOT AVAILABLE (fallback to pymupdf4llm)'}")
-    print(f"  pymupdf4llm: {'AVAILABLE' if PYMUPDF4LLM_AVAILABLE else 'NOT AVAILABLE'}")
-    print(f"  PyMuPDF raw: {'AVAILABLE' if PYMUPDF_AVAILABLE else 'NOT AVAILABLE'}")
-    print(f"  Textbook page limit: {args.textbook_page_limit}")
+    def __init__(self, slowest: int = 5):
+        self.files = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_mb = 0
+        self.stages = {}
+        self.backends = {}
+        self.slowest = slowest
+        self._slowest = []  # min-heap of (wall_s, seq, filename)
+
+    def add(self, report: dict):
+        profile = report.get("profile")
+        if not profile:
+            return
+        self.files += 1
+        self.wall_s += profile["wall_s"]
+        self.cpu_s += profile["cpu_s"]
+        self.peak_rss_mb = max(self.peak_rss_mb, profile["peak_rss_mb"])
+        for name, s in profile["stages"].items():
+            agg = self.stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0})
+            agg["calls"] += s["calls"]
+            agg["wall_s"] += s["wall_s"]
+            agg["cpu_s"] += s["cpu_s"]
+            agg["peak_rss_mb"] = max(agg["peak_rss_mb"], s["peak_rss_mb"])
+        for a in profile["backend_attempts"]:
+            agg = self.backends.setdefault(a["backend"], {"ok": 0, "short": 0, "failed": 0, "timeout": 0,
+                                                          "wall_s": 0.0})
+            agg[a["outcome"]] += 1
+            agg["wall_s"] += a["wall_s"]
+        entry = (profile["wall_s"], self.files, report["filename"])
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def result(self) -> dict:
+        def rounded(agg):
+            return {k: round(v, 3) if k in ("wall_s", "cpu_s") else v for k, v in agg.items()}
+
+        stages = {name: rounded(agg) for name, agg in self.stages.items()}
+        return {
+            "files_profiled": self.files,
+            "wall_s": round(self.wall_s, 3),
+            "cpu_s": round(self.cpu_s, 3),
+            "peak_rss_mb": self.peak_rss_mb,
+            "stages": dict(sorted(stages.items(), key=lambda kv: kv[1]["wall_s"], reverse=True)),
+            "backends": {name: rounded(agg) for name, agg in self.backends.items()},
+            "slowest_files": [{"filename": f, "wall_s": w}
+                              for w, _, f in sorted(self._slowest, reverse=True)],
+        }
+
+
+def write_trace(path: str, events: list[dict]):
+    """
+    Write trace events as JSON lines (*.jsonl) or as a Chrome trace file
+    (anything else; open in chrome://tracing or Perfetto).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith(".jsonl"):
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        else:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+# ─── Backend deadlines ────────────────────────────────────────────────
+
+class BackendTimeout(RuntimeError):
+    """A supervised backend attempt ran past its deadline and was killed."""
+
+
+class BackendDeadline:
+    """
+    Time limit for one backend attempt (--backend-timeout): `seconds`,
+    plus `per_page` seconds for each page it is asked to extract.
+    """
+
+    def __init__(self, seconds: float, per_page: float = 0.0):
+        self.seconds = seconds
+        self.per_page = per_page
+
+    def seconds_for(self, pdf, pages: list[int] = None) -> float:
+        if pages is not None:
+            n_pages = len(pages)
+        elif isinstance(pdf, PdfProbe):
+            n_pages = pdf.page_count
+        else:
+            n_pages = 0
+        return self.seconds + self.per_page * n_pages
+
+
+def _backend_worker_main(conn):
+    """
+    Supervised backend process: run (iter_fn, pdf_path, pages) requests one
+    at a time, sending ("page", idx, text) for each page and then ("done",)
+    or ("error", message).
+    """
+    while True:
+        try:
+            iter_fn, pdf_path, pages = conn.recv()
+        except EOFError:
+            return
+        try:
+            for idx, text in iter_fn(pdf_path, pages):
+                conn.send(("page", idx, text))
+            conn.send(("done",))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+_backend_worker = None
+
+
+def get_backend_worker():
+    """
+    The process-local supervised backend process, started on first use.
+    It outlives single attempts so Marker loads its models once, not per
+    PDF; it is replaced only after being killed.
+    """
+    global _backend_worker
+    if _backend_worker is None or not _backend_worker[0].is_alive():
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=_backend_worker_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        _backend_worker = (process, parent_conn)
+    return _backend_worker
+
+
+def kill_backend_worker():
+    """Hard-kill the supervised backend process, wherever it is stuck."""
+    global _backend_worker
+    if _backend_worker is not None:
+        process, conn = _backend_worker
+        process.kill()
+        process.join()
+        conn.close()
+        _backend_worker = None
+
+
+def iter_pages_supervised(iter_fn, pdf, pages: list[int] = None, deadline: BackendDeadline = None):
+    """
+    Yield iter_fn(pdf, pages) as produced in the supervised backend process.
+
+    Only time spent waiting on the backend counts against the deadline, not
+    time the consumer spends on the pages. When it runs out the process is
+    killed and BackendTimeout raised; the process is also killed if it dies
+    or the caller stops early, so it never keeps working on a stale request.
+    A PdfProbe is passed by path; the backend opens its own document.
+    """
+    seconds = deadline.seconds_for(pdf, pages)
+    process, conn = get_backend_worker()
+    conn.send((iter_fn, pdf_path_of(pdf), pages))
+    finished = False
+    waited = 0.0
+    try:
+        while True:
+            started = time.monotonic()
+            ready = conn.poll(max(seconds - waited, 0))
+            waited += time.monotonic() - started
+            if not ready:
+                raise BackendTimeout(f"timed out after {seconds:.0f}s")
+            try:
+                message = conn.recv()
+            except EOFError:
+                process.join()
+                raise RuntimeError(f"backend process died (exit code {process.exitcode})")
+            if message[0] == "page":
+                yield message[1], message[2]
+                continue
+            finished = True
+            if message[0] == "error":
+                raise RuntimeError(message[1])
+            return
+    finally:
+        if not finished:
+            kill_backend_worker()
+
+
+def supervise(iter_fn, deadline: BackendDeadline = None):
+    """`iter_fn` run under `deadline` in the supervised process; unchanged without one."""
+    if deadline is None:
+        return iter_fn
+    return lambda pdf, pages=None: iter_pages_supervised(iter_fn, pdf, pages, deadline)
+
+
+# ─── Extraction functions ──────────────────────────────────────────────
+
+# pymupdf4llm pages converted per to_markdown call when streaming
+PYMUPDF4LLM_CHUNK_PAGES = 8
+
+# Below this many non-whitespace-trimmed characters a backend's output is
+# treated as a failure and the next backend is tried
+MIN_BACKEND_CHARS = 100
+
+
+# Comment line opening each page of the cleaned markdown
+PAGE_MARKER = "<!-- Page {} -->"
+PAGE_MARKER_PATTERN = re.compile(r'^<!-- Page (\d+) -->$', re.MULTILINE)
+
+
+def join_pages(pages) -> str:
+    """Join (page_index, text) pairs into one document."""
+    return "\n\n".join(text for _, text in pages if text)
+
+
+def iter_pages_marker(pdf_path, pages: list[int] = None):
+    """
+    Yield (page_index, markdown) from Marker-PDF (deep learning). Marker
+    converts the whole selection in one call, so pages arrive once it is
+    done. Goes through the shared Marker service when one is running.
+
+    Like the other iter_pages_* backends, `pdf_path` may be a PdfProbe.
+    """
+    if marker_service_address():
+        texts = extract_via_marker_service(pdf_path, pages)
+    else:
+        if pages is not None and not PYMUPDF_AVAILABLE:
+            raise RuntimeError("page selection for Marker requires PyMuPDF")
+        texts = marker_page_texts(split_marker_pages(convert_with_marker(pdf_path, pages)))
+
+    indices = pages if pages is not None else range(len(texts))
+    yield from zip(indices, texts)
+
+
+def iter_pages_pymupdf4llm(pdf_path, pages: list[int] = None):
+    """
+    Yield (page_index, markdown) from pymupdf4llm (rule-based, fast),
+    converting PYMUPDF4LLM_CHUNK_PAGES pages per call on one open document.
+    """
+    with open_document(pdf_path) as doc:
+        selected = clamp_pages(pages, len(doc)) if pages is not None else list(range(len(doc)))
+        for start in range(0, len(selected), PYMUPDF4LLM_CHUNK_PAGES):
+            chunk = selected[start:start + PYMUPDF4LLM_CHUNK_PAGES]
+            results = import_pymupdf4llm().to_markdown(doc, pages=chunk, page_chunks=True)
+            for idx, result in zip(chunk, results):
+                yield idx, result["text"]
+
+
+def iter_pages_pymupdf(pdf_path, pages: list[int] = None):
+    """Yield (page_index, text) from raw PyMuPDF (basic text)."""
+    with open_document(pdf_path) as doc:
+        pages_to_extract = clamp_pages(pages, len(doc)) if pages is not None else range(len(doc))
+        for i in pages_to_extract:
+            yield i, f"{PAGE_MARKER.format(i + 1)}\n{doc[i].get_text()}"
+
+
+def extract_with_marker(pdf_path: str, pages: list[int] = None) -> tuple[str, str]:
+    """Extract PDF using Marker-PDF (deep learning). Returns (markdown, method)."""
+    return join_pages(iter_pages_marker(pdf_path, pages)), "marker-pdf"
+
+
+def extract_with_pymupdf4llm(pdf_path: str, pages: list[int] = None) -> tuple[str, str]:
+    """Extract PDF using pymupdf4llm (rule-based, fast). Returns (markdown, method)."""
+    return join_pages(iter_pages_pymupdf4llm(pdf_path, pages)), "pymupdf4llm"
+
+
+def extract_with_pymupdf(pdf_path: str, pages: list[int] = None) -> tuple[str, str]:
+    """Extract PDF using raw PyMuPDF (basic text). Returns (text, method)."""
+    return join_pages(iter_pages_pymupdf(pdf_path, pages)), "pymupdf-raw"
+
+
+def backend_chain() -> list[tuple[str, object]]:
+    """Available (method, page iterator) pairs: marker -> pymupdf4llm -> pymupdf raw."""
+    chain = []
+    if MARKER_AVAILABLE:
+        chain.append(("marker-pdf", iter_pages_marker))
+    if PYMUPDF4LLM_AVAILABLE:
+        chain.append(("pymupdf4llm", iter_pages_pymupdf4llm))
+    if PYMUPDF_AVAILABLE:
+        chain.append(("pymupdf-raw", iter_pages_pymupdf))
+    return chain
+
+
+def iter_backend_pages(
+    method: str,
+    iter_fn,
+    pdf_path: str,
+    pages: list[int] = None,
+    cache: ExtractionCache = None,
+    file_hash: str = None,
+):
+    """
+    Yield one backend's pages, replaying them from the cache when present.
+
+    Live pages are teed into the cache as they stream past; the entry is
+    committed only if the backend runs to completion (short output
+    included). Exceptions are not cached, since they may be transient.
+    """
+    if cache is None or file_hash is None:
+        yield from iter_fn(pdf_path, pages)
+        return
+
+    key = cache.raw_key(file_hash, method, pages)
+    records = cache.iter_records("raw", key)
+    if records is not None:
+        for record in records:
+            yield record["page"], record["text"]
+        return
+
+    with cache.record_writer("raw", key) as writer:
+        for idx, text in iter_fn(pdf_path, pages):
+            writer.write({"page": idx, "text": text})
+            yield idx, text
+
+
+def extract_pdf_pages(
+    pdf_path: str,
+    sink,
+    pages: list[int] = None,
+    cache: ExtractionCache = None,
+    file_hash: str = None,
+    chain: list = None,
+    profiler: StageProfiler = None,
+    deadline: BackendDeadline = None,
+) -> tuple[str, list[str]]:
+    """
+    Stream a PDF's pages into `sink`, trying backends in fallback order.
+    `pdf_path` may be a PdfProbe, whose open document the backends share.
+
+    Pages are held back only until a backend has produced more than
+    MIN_BACKEND_CHARS characters; from then on they go straight to the sink.
+    The sink provides begin(method) -> bool, add(page_index, text) and
+    reset(). begin() is called once a backend is committed to; if it
+    returns True the sink can reproduce that backend's output itself (e.g.
+    from cache) and no more pages are pulled. reset() is called if a
+    committed backend fails mid-document, before the next one starts.
+    `chain` defaults to backend_chain(). Time spent inside each backend and
+    the outcome of every attempt are recorded on `profiler`. With a
+    `deadline`, live backends run in the supervised process (see
+    iter_pages_supervised) and one that times out is killed and the next
+    backend tried.
+    Returns (method_used, warnings).
+    """
+    warnings = []
+    if chain is None:
+        chain = backend_chain()
+    if profiler is None:
+        profiler = StageProfiler()
+
+    for n, (method, iter_fn) in enumerate(chain):
+        last = n == len(chain) - 1
+        threshold = 0 if last else MIN_BACKEND_CHARS
+        buffered = []
+        chars = 0
+        committed = False
+        started = time.perf_counter()
+        stream = iter_backend_pages(method, supervise(iter_fn, deadline),
+                                    pdf_path, pages, cache, file_hash)
+        try:
+            for idx, text in profiler.iterate(f"extract:{method}", stream):
+                if committed:
+                    sink.add(idx, text)
+                    continue
+                buffered.append((idx, text))
+                chars += len(text.strip())
+                if chars > threshold:
+                    committed = True
+                    if sink.begin(method):
+                        break
+                    for item in buffered:
+                        sink.add(*item)
+                    buffered = []
+
+            if not committed:
+                if not last:
+                    warnings.append(f"{method} returned empty/short output, falling back")
+                    profiler.attempt(method, "short", time.perf_counter() - started)
+                    continue
+                if not sink.begin(method):
+                    for item in buffered:
+                        sink.add(*item)
+            profiler.attempt(method, "ok", time.perf_counter() - started)
+            return method, warnings
+        except BackendTimeout as e:
+            warnings.append(f"{method} {e} and was killed, falling back")
+            profiler.attempt(method, "timeout", time.perf_counter() - started, str(e))
+            if committed:
+                sink.reset()
+        except Exception as e:
+            warnings.append(f"{method} failed: {e}")
+            profiler.attempt(method, "failed", time.perf_counter() - started, str(e))
+            if committed:
+                sink.reset()
+        finally:
+            stream.close()
+
+    return "none", warnings + ["ALL extraction methods failed"]
+
+
+class _PageCollector:
+    """Minimal extract_pdf_pages sink that keeps pages in memory."""
+
+    def __init__(self):
+        self.pages = []
+
+    def begin(self, method: str, variant: str = None) -> bool:
+        return False
+
+    def add(self, idx: int, text: str, source: str = None):
+        self.pages.append((idx, text))
+
+    def reset(self):
+        self.pages = []
+
+
+def extract_pdf(
+    pdf_path: str,
+    pages: list[int] = None,
+    cache: ExtractionCache = None,
+    file_hash: str = None,
+) -> tuple[str, str, list[str]]:
+    """
+    Try extraction backends in order: marker -> pymupdf4llm -> pymupdf raw.
+    `pages` restricts extraction to those 0-based page indices. With a
+    cache and the file's content hash, each backend's output is served
+    from / stored in the cache.
+    Returns (markdown_text, method_used, warnings).
+    """
+    collector = _PageCollector()
+    method, warnings = extract_pdf_pages(pdf_path, collector, pages, cache, file_hash)
+    return join_pages(collector.pages), method, warnings
+
+
+# ─── Regex LaTeX fixes (adapted from ta-llm) ──────────────────────────
+
+# Font encoding artifact map (common PDF extraction artifacts)
+FONT_ARTIFACTS = {
+    'ð': '(',
+    'Þ': ')',
+    'þ': '+',
+    '¤': 'ff',
+    '‰': 'ffi',
+    '½': '[',
+    '¼': '=',
+    'ﬁ': 'fi',
+    'ﬂ': 'fl',
+    'ﬀ': 'ff',
+    'ﬃ': 'ffi',
+    'ﬄ': 'ffl',
+}
+
+# LaTeX commands that should be wrapped in $...$ if found bare
+LATEX_COMMANDS = [
+    r'\\alpha', r'\\beta', r'\\gamma', r'\\delta', r'\\epsilon', r'\\varepsilon',
+    r'\\zeta', r'\\eta', r'\\theta', r'\\vartheta', r'\\iota', r'\\kappa',
+    r'\\lambda', r'\\mu', r'\\nu', r'\\xi', r'\\pi', r'\\rho', r'\\sigma',
+    r'\\tau', r'\\upsilon', r'\\phi', r'\\varphi', r'\\chi', r'\\psi', r'\\omega',
+    r'\\Gamma', r'\\Delta', r'\\Theta', r'\\Lambda', r'\\Xi', r'\\Pi',
+    r'\\Sigma', r'\\Upsilon', r'\\Phi', r'\\Psi', r'\\Omega',
+    r'\\hat', r'\\tilde', r'\\bar', r'\\vec', r'\\dot', r'\\ddot',
+    r'\\sum', r'\\prod', r'\\int', r'\\partial', r'\\nabla', r'\\infty',
+    r'\\sqrt', r'\\frac', r'\\mathbb', r'\\mathcal', r'\\mathbf', r'\\mathrm',
+    r'\\text', r'\\operatorname',
+]
+
+# Math operators that should be in math mode
+MATH_OPERATORS = [
+    r'E\s*\(', r'Var\s*\(', r'Cov\s*\(', r'Corr\s*\(',
+    r'plim', r'argmin', r'argmax', r'sup\b', r'inf\b',
+    r'log\s*\(', r'exp\s*\(', r'tr\s*\(',
+]
+
+# Convergence arrow patterns
+CONVERGENCE_PATTERNS = [
+    (r'→d\b', r'$\\xrightarrow{d}$'),
+    (r'→p\b', r'$\\xrightarrow{p}$'),
+    (r'→a\.s\.\b', r'$\\xrightarrow{a.s.}$'),
+    (r'\+d\b(?!\w)', r'$\\xrightarrow{d}$'),
+    (r'\+p\b(?!\w)', r'$\\xrightarrow{p}$'),
+]
+
+
+# Combined alternation over every LaTeX command, longest first so that no
+# command can shadow a longer one sharing its prefix. The trailing
+# (?![A-Za-z]) keeps \text from matching the start of \textbf.
+LATEX_COMMAND_PATTERN = re.compile(
+    r'(?<!\$)((?:'
+    + '|'.join(sorted(LATEX_COMMANDS, key=len, reverse=True))
+    + r')(?![A-Za-z])(?:\{[^}]*\})?)(?!\$)'
+)
+
+# Compiled convergence patterns. Each keeps its own pass: with a literal
+# first character the regex engine can skip ahead with a fast substring
+# search, which a combined alternation loses. Pages without any of those
+# characters skip the stage entirely.
+_CONVERGENCE_COMPILED = [(re.compile(p), r) for p, r in CONVERGENCE_PATTERNS]
+_CONVERGENCE_FIRST_CHARS = '→+'
+
+# A YAML/JSON file of extra {artifact: replacement} pairs (see
+# load_font_artifacts); set in the environment so spawned worker processes
+# load the same table
+FONT_ARTIFACTS_ENV = "EXTRACT_PDFS_FONT_ARTIFACTS"
+
+# Up to this many distinct first characters, pages are screened for
+# artifacts with substring checks before the replacement pass
+ARTIFACT_GATE_MAX_CHARS = 64
+
+
+class ArtifactTable:
+    """
+    Compiled FONT_ARTIFACTS: a single alternation (multi-character artifacts
+    longest first, then one character class for all single characters) run
+    with one subn that counts replacements as it goes, so the cost of a
+    pass does not grow with the table. Unless the table has very many
+    distinct first characters, pages are first screened with substring
+    checks, which are far cheaper than any regex scan on the common
+    artifact-free page.
+    """
+
+    def __init__(self, artifacts: dict[str, str]):
+        self.artifacts = dict(artifacts)
+        multi = sorted((k for k in artifacts if len(k) > 1), key=len, reverse=True)
+        singles = ''.join(sorted(re.escape(k) for k in artifacts if len(k) == 1))
+        alternatives = [re.escape(k) for k in multi]
+        if singles:
+            alternatives.append(f'[{singles}]')
+        self.pattern = re.compile('|'.join(alternatives)) if alternatives else None
+        firsts = {k[0] for k in artifacts}
+        self.gate = firsts if len(firsts) <= ARTIFACT_GATE_MAX_CHARS else None
+
+    def apply(self, text: str) -> tuple[str, int]:
+        """Returns (text, number_of_artifacts_replaced)."""
+        if self.pattern is None:
+            return text, 0
+        if self.gate is not None and not any(c in text for c in self.gate):
+            return text, 0
+        return self.pattern.subn(lambda m: self.artifacts[m.group(0)], text)
+
+
+_ARTIFACT_TABLE = ArtifactTable(FONT_ARTIFACTS)
+
+
+def load_font_artifacts(path: str) -> int:
+    """
+    Add the {artifact: replacement} pairs of a YAML or JSON file to
+    FONT_ARTIFACTS (overriding built-in entries) and recompile the table.
+    Returns the number of entries loaded.
+    """
+    global _ARTIFACT_TABLE
+    with open(path, 'r', encoding='utf-8') as f:
+        extra = yaml.safe_load(f) or {}
+    if not isinstance(extra, dict) or not all(
+        isinstance(k, str) and k and isinstance(v, str) for k, v in extra.items()
+    ):
+        raise ValueError(f"{path}: expected a mapping of artifact strings to replacement strings")
+    FONT_ARTIFACTS.update(extra)
+    _ARTIFACT_TABLE = ArtifactTable(FONT_ARTIFACTS)
+    return len(extra)
+
+
+if os.environ.get(FONT_ARTIFACTS_ENV):
+    load_font_artifacts(os.environ[FONT_ARTIFACTS_ENV])
+
+# Delimiters that open or close a context region, found in one scan
+_CONTEXT_TOKEN_PATTERN = re.compile(r'^```|\\\$|\$\$|\$|\\\[|\\\]', re.MULTILINE)
+
+
+class ContextIndex:
+    """
+    Span index of code fences, math regions and YAML frontmatter.
+
+    Built by walking the text once; each lookup is a binary search over
+    sorted, non-overlapping spans. Spans are inclusive (start, end) offsets
+    of the content between the delimiters.
+
+    `state` is the end_state of the previous page when scanning a document
+    page by page; None means the text starts the document (the only place
+    frontmatter can appear). end_state is (in_code, open_display_delimiter):
+    open code fences and $$ / \\[ regions carry over to the next page, an
+    unclosed inline $ does not.
+    """
+
+    def __init__(self, text: str, state: tuple = None):
+        self.frontmatter_end = -1
+        self.code_spans = []
+        self.math_spans = []
+
+        if state is None and text.startswith('---'):
+            end_marker = text.find('---', 3)
+            if end_marker != -1:
+                self.frontmatter_end = end_marker + 3
+
+        in_code, open_display = state or (False, None)
+        code_open = 0 if in_code else None
+        math_open = 0 if open_display else None
+        math_close = open_display  # closing delimiter of the open math region
+        pos = 0
+        n = len(text)
+
+        while pos < n:
+            m = _CONTEXT_TOKEN_PATTERN.search(text, pos)
+            if not m:
+                break
+            tok = m.group(0)
+            pos = m.end()
+
+            if tok == '```':
+                # Fences win over math: an unterminated $ never swallows code
+                if code_open is None:
+                    if math_open is not None:
+                        self.math_spans.append((math_open, m.start() - 1))
+                        math_open = math_close = None
+                    code_open = m.end()
+                else:
+                    self.code_spans.append((code_open, m.start()))
+                    code_open = None
+            elif code_open is not None or tok == '\\$':
+                continue
+            elif math_open is None:
+                if tok == '\\]':
+                    continue
+                math_open = m.end()
+                math_close = '\\]' if tok == '\\[' else tok
+            elif tok == math_close or (math_close == '$' and tok == '$$'):
+                if math_close == '$' and tok == '$$':
+                    # "$a$$b$": the first $ closes, the second opens again
+                    pos = m.start() + 1
+                self.math_spans.append((math_open, m.start()))
+                math_open = math_close = None
+
+        if code_open is not None:
+            self.code_spans.append((code_open, n))
+        if math_open is not None:
+            self.math_spans.append((math_open, n))
+
+        carried = math_close if math_close in ('$$', '\\]') else None
+        self.end_state = (code_open is not None, carried)
+
+        self._code_starts = [s for s, _ in self.code_spans]
+        self._math_starts = [s for s, _ in self.math_spans]
+
+    @staticmethod
+    def _lookup(starts: list, spans: list, pos: int) -> bool:
+        i = bisect.bisect_right(starts, pos) - 1
+        return i >= 0 and pos <= spans[i][1]
+
+    def in_math(self, pos: int) -> bool:
+        return self._lookup(self._math_starts, self.math_spans, pos)
+
+    def in_code(self, pos: int) -> bool:
+        return self._lookup(self._code_starts, self.code_spans, pos)
+
+    def in_frontmatter(self, pos: int) -> bool:
+        return pos < self.frontmatter_end
+
+
+def is_in_math_mode(text: str, pos: int, index: ContextIndex = None) -> bool:
+    """Check if position is inside $...$ or $$...$$ or \\[...\\]."""
+    return (index or ContextIndex(text)).in_math(pos)
+
+
+def is_in_code_block(text: str, pos: int, index: ContextIndex = None) -> bool:
+    """Check if position is inside a fenced code block."""
+    return (index or ContextIndex(text)).in_code(pos)
+
+
+def is_in_yaml_frontmatter(text: str, pos: int, index: ContextIndex = None) -> bool:
+    """Check if position is inside YAML frontmatter (between --- delimiters at start)."""
+    return (index or ContextIndex(text)).in_frontmatter(pos)
+
+
+class LatexFixer:
+    """
+    Regex LaTeX fixes over a stream of pages.
+
+    Each page is fixed on its own, with the code-fence / display-math state
+    left open by the previous page carried into the next, so a document can
+    be fixed page by page with the same result as fixing it whole.
+    """
+
+    def __init__(self):
+        self.state = None
+
+    def fix(self, text: str) -> tuple[str, int]:
+        """Fix the next page. Returns (fixed_text, fix_count)."""
+        fix_count = 0
+
+        # 1. Fix font encoding artifacts
+        text, fix_count = _ARTIFACT_TABLE.apply(text)
+
+        # 2. Wrap bare LaTeX commands in $...$ — one pass over all commands,
+        #    with context lookups against an index built once for this text
+        index = ContextIndex(text, self.state)
+        self.state = index.end_state
+
+        def wrap_if_bare(m):
+            nonlocal fix_count
+            start = m.start()
+            if index.in_code(start) or index.in_math(start) or index.in_frontmatter(start):
+                return m.group(0)
+            fix_count += 1
+            return f'${m.group(0)}$'
+
+        text = LATEX_COMMAND_PATTERN.sub(wrap_if_bare, text)
+
+        # 3. Fix convergence arrows, counting as each pattern substitutes
+        if any(c in text for c in _CONVERGENCE_FIRST_CHARS):
+            for pattern, replacement in _CONVERGENCE_COMPILED:
+                text, count = pattern.subn(replacement, text)
+                fix_count += count
+
+        return text, fix_count
+
+
+def apply_regex_latex_fixes(text: str) -> tuple[str, int]:
+    """
+    Apply regex-based LaTeX fixes adapted from ta-llm.
+    Returns (fixed_text, fix_count).
+    """
+    return LatexFixer().fix(text)
+
+
+# ─── Equation quality scoring ──────────────────────────────────────────
+
+# Scoring patterns, compiled once, with the counter each feeds. Each is
+# counted by its own scan over the text, as the scorer's findall calls
+# always counted it, so one character can count in several (e.g. "α" in a run of
+# non-ASCII is both garbled and raw math). The patterns are written to
+# start with a literal or a character class rather than a lookbehind,
+# which lets the re engine search for candidate positions instead of
+# trying each one; separate scans measured faster than any alternation.
+_SCORE_SCANS = (
+    (re.compile(r'\$\$.+?\$\$', re.DOTALL), "display_equations"),
+    # (?<!\$)\$ written as \$(?<!\$\$)
+    (re.compile(r'\$(?<!\$\$)(?!\$).+?(?<!\$)\$(?!\$)'), "inline_equations"),
+    (re.compile(r'\\begin\{(?:equation|align|gather|multline)'), "environment_equations"),
+    # Long sequences of non-ASCII
+    (re.compile(r'[^\x00-\x7F][^\x00-\x7F][^\x00-\x7F]+'), "garbled_patterns"),
+    # Multiple ?? ((?:\?\?){2,})
+    (re.compile(r'\?\?\?\?(?:\?\?)*'), "garbled_patterns"),
+    # Control characters
+    (re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]'), "garbled_patterns"),
+    # Box/geometric chars (often garbled math)
+    (re.compile(r'[□■▪▫◊◇○●]'), "garbled_patterns"),
+    # Unicode Greek, math operators and arrows not next to a $
+    (re.compile(r'[αβγδεθλμστφψωΓΔΘΛΣΦΨΩ∑∏∫∂∇∞√≤≥≠≈∈∉⊂⊃∩∪→←↔⇒⇐⇔](?<!\$.)(?!\$)'), "raw_math_unicode"),
+)
+
+# Markdown headings open the sections of the breakdown
+_SCORE_HEADING_PATTERN = re.compile(r'^#{1,6}[ \t][^\n]*', re.MULTILINE)
+
+_COUNT_KEYS = (
+    "display_equations", "inline_equations", "environment_equations",
+    "garbled_patterns", "raw_math_unicode",
+)
+
+
+def _empty_counts() -> dict:
+    return dict.fromkeys(_COUNT_KEYS, 0)
+
+
+def count_equation_patterns(text: str) -> dict:
+    """Raw pattern counts behind score_equation_quality (additive across pages)."""
+    counts = _empty_counts()
+    for pattern, key in _SCORE_SCANS:
+        counts[key] += sum(1 for _ in pattern.finditer(text))
+    return counts
+
+
+def quality_from_counts(counts: dict) -> dict:
+    """Turn pattern counts into the quality metrics dict."""
+    total_latex = (
+        counts["display_equations"] + counts["inline_equations"] + counts["environment_equations"]
+    )
+
+    # Score: start at 100, penalize garbled and raw
+    score = 100
+    score -= counts["garbled_patterns"] * 5  # Heavy penalty
+    score -= counts["raw_math_unicode"] * 2  # Light penalty
+    score = max(0, min(100, score))
+
+    # Bonus for having many proper LaTeX equations
+    if total_latex > 10:
+        score = min(100, score + 5)
+
+    return {
+        "quality_score": score,
+        "latex_equations": total_latex,
+        "display_equations": counts["display_equations"],
+        "inline_equations": counts["inline_equations"],
+        "environment_equations": counts["environment_equations"],
+        "garbled_patterns": counts["garbled_patterns"],
+        "raw_math_unicode": counts["raw_math_unicode"],
+    }
+
+
+def _breakdown_entry(counts: dict) -> dict:
+    q = quality_from_counts(counts)
+    return {
+        "quality_score": q["quality_score"],
+        "latex_equations": q["latex_equations"],
+        "garbled_patterns": q["garbled_patterns"],
+        "raw_math_unicode": q["raw_math_unicode"],
+    }
+
+
+class EquationScorer:
+    """
+    Equation quality scorer with per-page and per-section breakdowns.
+
+    Feed it a document whole or page by page; each add() runs each of the
+    precompiled scans of _SCORE_SCANS once over the text, counting the
+    matches without collecting them. Counts are summed into document totals, into the
+    page passed to add(), and into the section opened by the most recent
+    markdown heading (sections may span pages).
+    """
+
+    def __init__(self):
+        self.totals = _empty_counts()
+        self.pages = []
+        self.sections = []
+
+    def _open_section(self, heading: str, page: int):
+        self.sections.append({"heading": heading, "page": page, "counts": _empty_counts()})
+
+    def add(self, text: str, page: int = None):
+        """Score the next chunk of text; `page` is its 1-based page number."""
+        if not self.sections:
+            self._open_section(None, page)
+        sections = [self.sections[-1]["counts"]]
+        starts = [0]
+        for m in _SCORE_HEADING_PATTERN.finditer(text):
+            self._open_section(m.group(0).lstrip("#").strip()[:120], page)
+            sections.append(self.sections[-1]["counts"])
+            starts.append(m.start())
+
+        if len(starts) == 1:
+            page_counts = count_equation_patterns(text)
+            for k, v in page_counts.items():
+                sections[0][k] += v
+        else:
+            # Matches count in the section their start falls in
+            page_counts = _empty_counts()
+            for pattern, key in _SCORE_SCANS:
+                for m in pattern.finditer(text):
+                    page_counts[key] += 1
+                    sections[bisect.bisect_right(starts, m.start()) - 1][key] += 1
+
+        for k, v in page_counts.items():
+            self.totals[k] += v
+        if page is not None:
+            self.pages.append(dict(page=page, **_breakdown_entry(page_counts)))
+
+    def result(self) -> dict:
+        quality = quality_from_counts(self.totals)
+        if self.pages:
+            quality["pages"] = self.pages
+        sections = [
+            dict(heading=s["heading"], page=s["page"], **_breakdown_entry(s["counts"]))
+            for s in self.sections
+            if s["heading"] is not None or any(s["counts"].values())
+        ]
+        if sections:
+            quality["sections"] = sections
+        return quality
+
+
+def score_equation_quality(text: str) -> dict:
+    """
+    Score the quality of equation extraction in the text.
+    Returns quality metrics dict, with a per-section breakdown.
+    """
+    scorer = EquationScorer()
+    scorer.add(text)
+    return scorer.result()
+
+
+# ─── Figure extraction ────────────────────────────────────────────────
+
+# With --images, figures go to a content-addressed store in cleaned/_images/
+# and are linked from the page they appear on. Files are named by the SHA-256
+# of their encoded bytes, so a logo or journal header repeated across pages
+# and papers is stored once. Cleaned files sit one level below cleaned/,
+# which fixes the relative link.
+IMAGE_STORE_DIR = "_images"
+IMAGE_LINK_PREFIX = f"../{IMAGE_STORE_DIR}/"
+_STORE_LINK_PATTERN = re.compile(r'!\[[^\]]*\]\(' + re.escape(IMAGE_LINK_PREFIX) + r'([^)\s]+)\)')
+_MARKER_IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\(([^)\s]+)\)')
+
+# Images narrower or shorter than this many pixels (rules, bullets, icons)
+# are not stored
+IMAGE_MIN_SIZE = 64
+
+# Set (JSON {"store", "min_size"}) while --images is on, so spawned workers,
+# the supervised backend process and the Marker service store figures too
+IMAGES_ENV = "EXTRACT_PDFS_IMAGES"
+
+
+class ImageStore:
+    """
+    Content-addressed image files, <root>/<hash[:2]>/<hash>.<ext>. put()
+    writes an image only if its hash is not stored yet, through a temporary
+    file, so concurrent writers of the same image are harmless.
+    """
+
+    def __init__(self, root: str, min_size: int = IMAGE_MIN_SIZE):
+        self.root = Path(root)
+        self.min_size = min_size
+
+    def variant(self) -> str:
+        """Cache-key and manifest component for output linking this store."""
+        return f"images:{self.min_size}"
+
+    def too_small(self, width: int, height: int) -> bool:
+        return width < self.min_size or height < self.min_size
+
+    def put(self, data: bytes, ext: str) -> tuple[str, bool]:
+        """Store encoded image bytes; returns (markdown link target, newly written)."""
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"{digest[:2]}/{digest}.{ext}"
+        path = self.root / name
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            return IMAGE_LINK_PREFIX + name, True
+        return IMAGE_LINK_PREFIX + name, False
+
+    def exists(self, name: str) -> bool:
+        return (self.root / name).exists()
+
+
+IMAGE_STORE = None
+
+
+def configure_images(cleaned_dir: str, min_size: int = IMAGE_MIN_SIZE):
+    """Turn on figure extraction into `cleaned_dir`'s store, here and in child processes."""
+    global IMAGE_STORE
+    IMAGE_STORE = ImageStore(Path(cleaned_dir) / IMAGE_STORE_DIR, min_size)
+    os.environ[IMAGES_ENV] = json.dumps({"store": os.path.abspath(IMAGE_STORE.root),
+                                         "min_size": min_size})
+
+
+def disable_images():
+    """Turn figure extraction off again (see configure_images)."""
+    global IMAGE_STORE
+    IMAGE_STORE = None
+    os.environ.pop(IMAGES_ENV, None)
+
+
+if os.environ.get(IMAGES_ENV):
+    _images = json.loads(os.environ[IMAGES_ENV])
+    IMAGE_STORE = ImageStore(_images["store"], _images["min_size"])
+
+
+def store_marker_images(text: str, images: dict) -> str:
+    """
+    Move the pictures Marker rendered ({name: PIL image}) into the image
+    store one at a time, releasing each once written, and point their
+    references in `text` at the store. References to pictures below the
+    size threshold are dropped. Without --images, `text` is returned as is.
+    """
+    if IMAGE_STORE is None or not images:
+        return text
+    links = {}
+    for name in list(images):
+        image = images.pop(name)
+        if IMAGE_STORE.too_small(*image.size):
+            links[name] = None
+            continue
+        ext = Path(name).suffix.lstrip(".").lower() or "png"
+        image_format = "JPEG" if ext in ("jpg", "jpeg") else ext.upper()
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        buf = io.BytesIO()
+        image.save(buf, format=image_format)
+        links[name], _ = IMAGE_STORE.put(buf.getvalue(), ext)
+
+    def relink(match):
+        if match.group(2) not in links:
+            return match.group(0)
+        link = links[match.group(2)]
+        return f"![{match.group(1)}]({link})" if link else ""
+
+    return _MARKER_IMAGE_PATTERN.sub(relink, text)
+
+
+class PageFigures:
+    """
+    PagePipeline stage that links each page's figures.
+
+    Images embedded in pages from the PyMuPDF-based backends are extracted
+    with PyMuPDF one at a time and put in the store; an image shared by
+    several pages (running header, logo) is extracted once per document
+    and looked up by xref after that. Pages from Marker already link the
+    pictures Marker rendered (see store_marker_images); those links are
+    only counted, and checked to still be in the store.
+    """
+
+    def __init__(self, pdf, store: ImageStore):
+        self.pdf = pdf
+        self.store = store
+        self._documents = ExitStack()
+        self._doc = None
+        self._xref_links = {}
+        self.reset()
+
+    def reset(self):
+        self.stats = {"linked": 0, "stored": 0, "too_small": 0, "missing": 0}
+
+    def _document(self):
+        if self._doc is None:
+            self._doc = self._documents.enter_context(open_document(self.pdf))
+        return self._doc
+
+    def _store_xref(self, doc, xref: int, width: int, height: int) -> str | None:
+        if self.store.too_small(width, height):
+            self.stats["too_small"] += 1
+            return None
+        try:
+            extracted = doc.extract_image(xref)
+        except Exception:
+            return None
+        if not extracted or not extracted.get("image"):
+            return None
+        link, written = self.store.put(extracted["image"], extracted["ext"])
+        self.stats["stored"] += written
+        return link
+
+    def links(self, idx: int, text: str, source: str) -> list[str]:
+        """Markdown image links to append to page `idx`."""
+        if source == "marker-pdf":
+            for match in _STORE_LINK_PATTERN.finditer(text):
+                self.stats["linked"] += 1
+                if not self.store.exists(match.group(1)):
+                    self.stats["missing"] += 1
+            return []
+        if not PYMUPDF_AVAILABLE:
+            return []
+
+        doc = self._document()
+        if idx >= len(doc):
+            return []
+        links = []
+        for info in doc[idx].get_images(full=True):
+            xref, width, height = info[0], info[2], info[3]
+            if xref not in self._xref_links:
+                self._xref_links[xref] = self._store_xref(doc, xref, width, height)
+            link = self._xref_links[xref]
+            if link and link not in links:
+                links.append(link)
+        self.stats["linked"] += len(links)
+        return [f"![]({link})" for link in links]
+
+    def close(self) -> dict:
+        self._documents.close()
+        self._doc = None
+        return dict(self.stats)
+
+
+# ─── Page pipeline ─────────────────────────────────────────────────────
+
+class PagePipeline:
+    """
+    extract_pdf_pages sink that fixes, scores and writes one page at a time.
+
+    The markdown body is appended to `body_path` (the output path plus
+    ".partial") as pages arrive, so memory stays flat regardless of document
+    size and a crash mid-book leaves the finished pages on disk. Only the
+    state the stages need crosses page boundaries: the LatexFixer's open
+    code/math context and the quality counts. With a cache, fixed pages are
+    teed into the "fixes" stage; if that stage already holds this backend's
+    output, begin() asks for a replay instead of re-running the fixes.
+    With --images, each page written is followed by links to its figures
+    in `pdf` (see PageFigures). Each stage's time is charged to `profiler`.
+    """
+
+    def __init__(self, body_path: Path, cache: ExtractionCache = None,
+                 file_hash: str = None, pages: list[int] = None,
+                 profiler: StageProfiler = None, pdf=None):
+        self.body_path = body_path
+        self.profiler = profiler or StageProfiler()
+        self.cache = cache if file_hash else None
+        self.file_hash = file_hash
+        self.pages = pages
+        self.figures = PageFigures(pdf, IMAGE_STORE) if pdf is not None and IMAGE_STORE else None
+        self.out = None
+        self.fixes_writer = None
+        self._start()
+
+    def _start(self):
+        if self.out:
+            self.out.close()
+        self.out = open(self.body_path, 'w', encoding='utf-8')
+        if self.figures:
+            self.figures.reset()
+        self.fixer = LatexFixer()
+        self.quality = EquationScorer()
+        self.method = None
+        self.fixes_key = None
+        self.replay = False
+        self.cacheable = True
+        self.pages_written = 0
+        self.stats = {"raw_word_count": 0, "raw_char_count": 0, "raw_text_chars": 0,
+                      "latex_fixes_applied": 0, "escalated_pages": []}
+
+    def begin(self, method: str, variant: str = None) -> bool:
+        """
+        `variant` names any transformation applied on top of the backend's
+        raw pages (e.g. page escalation) and becomes part of the cache key.
+        """
+        self.method = method
+        if self.cache:
+            self.fixes_key = self.cache.pages_fixes_key(self.file_hash, method, self.pages, variant)
+            if self.cache.has_records("fixes", self.fixes_key):
+                self.replay = True
+                return True
+            self.fixes_writer = self.cache.record_writer("fixes", self.fixes_key)
+        return False
+
+    def add(self, idx: int, text: str, source: str = None):
+        """Process the next page; `source` names the backend if not the committed one."""
+        if source and source != self.method:
+            self.stats["escalated_pages"].append(idx)
+        if text:
+            self.stats["raw_word_count"] += len(text.split())
+            self.stats["raw_char_count"] += len(text) + (2 if self.stats["raw_char_count"] else 0)
+            self.stats["raw_text_chars"] += len(text.strip())
+
+        with self.profiler.stage("latex_fixes"):
+            fixed, fix_count = self.fixer.fix(text)
+        self.stats["latex_fixes_applied"] += fix_count
+        with self.profiler.stage("quality_score"):
+            self.quality.add(fixed, page=idx + 1)
+        self._write(fixed, idx, source)
+        if self.fixes_writer:
+            with self.profiler.stage("cache_write"):
+                record = {"page": idx, "text": fixed}
+                if source and source != self.method:
+                    record["source"] = source
+                self.fixes_writer.write(record)
+
+    def _write(self, text: str, idx: int, source: str = None):
+        """
+        Append a page, opened with a page marker unless the backend wrote
+        one, and followed by its figure links.
+        """
+        links = []
+        if self.figures:
+            with self.profiler.stage("images"):
+                links = self.figures.links(idx, text, source or self.method)
+        if not text and not links:
+            return
+        with self.profiler.stage("write_body"):
+            if self.pages_written:
+                self.out.write("\n\n")
+            if not PAGE_MARKER_PATTERN.match(text):
+                self.out.write(PAGE_MARKER.format(idx + 1) + "\n")
+            self.out.write(text)
+            if links:
+                self.out.write(("\n\n" if text else "") + "\n\n".join(links))
+            self.out.flush()
+        self.pages_written += 1
+
+    def reset(self):
+        if self.fixes_writer:
+            self.fixes_writer.discard()
+            self.fixes_writer = None
+        self._start()
+
+    def uncacheable(self):
+        """
+        Keep this output out of the fixes and quality caches, e.g. because
+        a page escalation failed, so the next run tries again.
+        """
+        self.cacheable = False
+
+    def finish(self) -> dict:
+        """Close the body file; returns the raw counts, fix count and quality."""
+        quality_key = None
+        if self.fixes_key and (self.replay or self.cacheable):
+            quality_key = self.cache.quality_key(self.fixes_key)
+        quality = self.cache.get("quality", quality_key) if quality_key else None
+
+        if self.replay:
+            for record in self.cache.iter_records("fixes", self.fixes_key):
+                if "summary" in record:
+                    self.stats = record["summary"]
+                    continue
+                self._write(record["text"], record["page"], record.get("source"))
+                if quality is None:
+                    with self.profiler.stage("quality_score"):
+                        self.quality.add(record["text"], page=record["page"] + 1)
+        elif self.fixes_writer and not self.cacheable:
+            self.fixes_writer.discard()
+            self.fixes_writer = None
+        elif self.fixes_writer:
+            self.fixes_writer.write({"summary": self.stats})
+            self.fixes_writer.commit()
+            self.fixes_writer = None
+
+        if quality is None:
+            with self.profiler.stage("quality_score"):
+                quality = self.quality.result()
+            if quality_key:
+                self.cache.put("quality", quality_key, quality)
+
+        self.out.close()
+        stats = dict(self.stats, quality=quality)
+        if self.figures:
+            stats["images"] = self.figures.close()
+        return stats
+
+    def abort(self):
+        """Stop without committing anything to the cache; keeps the body file."""
+        if self.fixes_writer:
+            self.fixes_writer.discard()
+            self.fixes_writer = None
+        if self.out:
+            self.out.close()
+        if self.figures:
+            self.figures.close()
+
+
+def write_cleaned_file(out_path: Path, frontmatter: dict, markdown: str = None,
+                       body_path: Path = None, body_file=None):
+    """
+    Write a cleaned markdown file with YAML frontmatter. The body is either
+    `markdown`, streamed from `body_path`, which is removed afterwards, or
+    copied from the open `body_file`.
+    """
+    frontmatter_str = yaml.dump(frontmatter, default_flow_style=False, sort_keys=False)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f"---\n{frontmatter_str}---\n\n")
+        if body_file is not None:
+            shutil.copyfileobj(body_file, f)
+        elif body_path is None:
+            f.write(markdown)
+        else:
+            with open(body_path, 'r', encoding='utf-8') as body:
+                shutil.copyfileobj(body, f)
+
+    os.replace(tmp_path, out_path)
+    if body_path is not None:
+        os.unlink(body_path)
+
+
+# ─── Page-level fallback ──────────────────────────────────────────────
+
+# Pages from a fast backend scoring below this (or with almost no text,
+# e.g. scanned pages without a text layer) are re-extracted with Marker
+PAGE_ESCALATION_SCORE = 80
+PAGE_MIN_CHARS = 50
+
+# Fast-backend pages buffered per Marker escalation call
+ESCALATION_WINDOW_PAGES = 16
+
+
+def page_quality_score(text: str) -> int:
+    """Quick score_equation_quality check for a single page."""
+    if len(text.strip()) < PAGE_MIN_CHARS:
+        return 0
+    return quality_from_counts(count_equation_patterns(text))["quality_score"]
+
+
+class PageEscalator:
+    """
+    extract_pdf_pages sink that sits in front of a PagePipeline and sends
+    only weak pages to Marker.
+
+    Pages from the fast backend are buffered in windows of
+    ESCALATION_WINDOW_PAGES. Each window's pages scoring below `threshold`
+    go to Marker in one call (pages sliced out of the PDF, cached like any
+    other extraction), and the Marker version of a page replaces the fast
+    one when it scores at least as well. The window is then passed on in
+    page order, so memory stays bounded by the window size. If an
+    escalation fails, the fast pages are passed on and the sink is told to
+    keep the document out of the fixes cache, so the next run retries
+    Marker instead of replaying them.
+    """
+
+    def __init__(self, sink, pdf_path: str, cache: ExtractionCache = None,
+                 file_hash: str = None, threshold: int = PAGE_ESCALATION_SCORE,
+                 profiler: StageProfiler = None, deadline: BackendDeadline = None):
+        self.sink = sink
+        self.deadline = deadline
+        self.profiler = profiler or StageProfiler()
+        self.pdf_path = pdf_path
+        self.cache = cache
+        self.file_hash = file_hash
+        self.threshold = threshold
+        self.window = []
+        self.warnings = []
+        self.replaying = False
+
+    def begin(self, method: str) -> bool:
+        self.window = []
+        # Escalated Marker pages link the pictures stored with the image settings
+        images = IMAGE_STORE.variant() if IMAGE_STORE is not None else None
+        variant = f"escalate<{self.threshold}:{backend_version('marker-pdf')}:{images}"
+        self.replaying = self.sink.begin(method, variant)
+        return self.replaying
+
+    def add(self, idx: int, text: str):
+        self.window.append((idx, text))
+        if len(self.window) >= ESCALATION_WINDOW_PAGES:
+            self._flush()
+
+    def reset(self):
+        self.window = []
+        self.sink.reset()
+
+    def finish(self):
+        """Pass on the last partial window."""
+        if not self.replaying:
+            self._flush()
+
+    def _flush(self):
+        with self.profiler.stage("page_scores"):
+            scores = {idx: page_quality_score(text) for idx, text in self.window}
+        weak = [idx for idx, _ in self.window if scores[idx] < self.threshold]
+
+        replacements = {}
+        if weak:
+            started = time.perf_counter()
+            try:
+                stream = iter_backend_pages(
+                    "marker-pdf", supervise(iter_pages_marker, self.deadline),
+                    self.pdf_path, weak, self.cache, self.file_hash,
+                )
+                for idx, text in self.profiler.iterate("escalate:marker-pdf", stream):
+                    if text.strip() and page_quality_score(text) >= scores[idx]:
+                        replacements[idx] = text
+                self.profiler.attempt("marker-pdf", "ok", time.perf_counter() - started)
+            except BackendTimeout as e:
+                self.warnings.append(
+                    f"marker-pdf escalation of pages {format_page_ranges(weak)} {e} and was killed"
+                )
+                self.profiler.attempt("marker-pdf", "timeout", time.perf_counter() - started, str(e))
+                self.sink.uncacheable()
+            except Exception as e:
+                self.warnings.append(
+                    f"marker-pdf escalation of pages {format_page_ranges(weak)} failed: {e}"
+                )
+                self.profiler.attempt("marker-pdf", "failed", time.perf_counter() - started, str(e))
+                self.sink.uncacheable()
+
+        for idx, text in self.window:
+            if idx in replacements:
+                self.sink.add(idx, replacements[idx], source="marker-pdf")
+            else:
+                self.sink.add(idx, text)
+        self.window = []
+
+
+# ─── Backend routing ──────────────────────────────────────────────────
+
+# Routes, cheapest first: fast backends only, fast backends with weak
+# pages re-extracted by Marker (see PageEscalator), Marker on the whole
+# document with the fast backends as fallback
+ROUTES = ("fast", "page", "document")
+
+# Quality and seconds per page assumed for a route with no history yet
+ROUTE_PRIOR_MARKER_SCORE = 90
+ROUTE_PRIOR_SECONDS_PER_PAGE = {"fast": 0.05, "marker": 2.0}
+
+# Runs of a route on a document class before its history replaces the prior
+ROUTE_MIN_RUNS = 2
+
+# Weight of the newest run in the history's moving averages (at least)
+ROUTE_HISTORY_ALPHA = 0.2
+
+# Document class thresholds: raw Unicode math symbols per sampled page for
+# "math", share of unmapped glyphs for "garbled"
+ROUTE_MATH_PER_PAGE = 10
+ROUTE_GARBLED_GLYPHS = 0.01
+
+# Fast-backend quality assumed for a document with broken font encodings
+# (the scorer does not see unmapped glyphs)
+ROUTE_GARBLED_FAST_SCORE = 50
+
+HISTORY_VERSION = 1
+
+
+def document_class(probe: PdfProbe) -> str:
+    """
+    Coarse class of a probed PDF that backend history is kept per:
+    text layer (full/partial/none), math density (math/prose) and font
+    encoding (clean/garbled), e.g. "full/math/clean".
+    """
+    if probe.text_layer_pages == 0:
+        text = "none"
+    elif probe.text_layer_pages < probe.text_pages_sampled:
+        text = "partial"
+    else:
+        text = "full"
+    math = "math" if probe.raw_math_per_page >= ROUTE_MATH_PER_PAGE else "prose"
+    glyphs = "garbled" if probe.unmapped_glyph_ratio >= ROUTE_GARBLED_GLYPHS else "clean"
+    return f"{text}/{math}/{glyphs}"
+
+
+class BackendHistory:
+    """
+    Quality scores and extraction seconds per page of past runs, as moving
+    averages per document class and route, kept in a JSON file across runs.
+    Workers get a read-only copy; the batch driver add_report()s each
+    finished file, and those count from save() at the end of the batch, so
+    routes chosen during a batch are predicted from past runs only.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.classes = {}
+        self.pending = []
+        if path:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") == HISTORY_VERSION:
+                    self.classes = data["classes"]
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def get(self, doc_class: str, route: str) -> dict | None:
+        """{"runs", "score", "seconds_per_page"} once the route has enough runs."""
+        entry = self.classes.get(doc_class, {}).get(route)
+        if entry is None or entry["runs"] < ROUTE_MIN_RUNS:
+            return None
+        return entry
+
+    def add(self, doc_class: str, route: str, score: float, seconds_per_page: float = None):
+        entry = self.classes.setdefault(doc_class, {}).setdefault(
+            route, {"runs": 0, "score": None, "seconds_per_page": None}
+        )
+        entry["runs"] += 1
+        alpha = max(1 / entry["runs"], ROUTE_HISTORY_ALPHA)
+        for key, value in (("score", score), ("seconds_per_page", seconds_per_page)):
+            if value is None:
+                continue
+            old = entry[key]
+            entry[key] = round(value if old is None else old + alpha * (value - old), 4)
+
+    def add_report(self, report: dict):
+        """Learn from a finished file's report (its "backend_route" decision) on save()."""
+        route = report.get("backend_route")
+        if not route or report.get("status") != "OK" or not route.get("pages"):
+            return
+        seconds = None
+        if not route.get("cached"):
+            stages = report.get("profile", {}).get("stages", {})
+            seconds = sum(s["wall_s"] for name, s in stages.items()
+                          if name.startswith(("extract:", "escalate:"))) / route["pages"]
+        self.pending.append((route["doc_class"], route["route"], report["quality"]["quality_score"], seconds))
+
+    def save(self):
+        for run in self.pending:
+            self.add(*run)
+        self.pending = []
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"version": HISTORY_VERSION, "classes": self.classes}, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def probe_fast_score(probe: PdfProbe, doc_class: str) -> float:
+    """Fast-backend quality predicted from the probe alone."""
+    score = probe.sample_quality * probe.text_layer_pages / max(1, probe.text_pages_sampled)
+    if doc_class.endswith("/garbled"):
+        score = min(score, ROUTE_GARBLED_FAST_SCORE)
+    return score
+
+
+def route_prior(route: str, probe: PdfProbe, doc_class: str, fast_score: float) -> tuple[float, float]:
+    """
+    (predicted quality score, seconds per page) of a route without history
+    of its own, given the fast route's predicted score. Page escalation
+    can't see unmapped glyphs, so it is not expected to repair a garbled
+    document.
+    """
+    fast_s, marker_s = ROUTE_PRIOR_SECONDS_PER_PAGE["fast"], ROUTE_PRIOR_SECONDS_PER_PAGE["marker"]
+    if route == "fast":
+        return fast_score, fast_s
+    if route == "page":
+        if doc_class.endswith("/garbled"):
+            return fast_score, fast_s + probe.weak_page_fraction * marker_s
+        return max(fast_score, ROUTE_PRIOR_MARKER_SCORE), fast_s + probe.weak_page_fraction * marker_s
+    return ROUTE_PRIOR_MARKER_SCORE, marker_s
+
+
+def route_backends(
+    probe: PdfProbe,
+    n_pages: int,
+    target_score: int,
+    history: BackendHistory = None,
+    marker: bool = MARKER_AVAILABLE,
+) -> dict:
+    """
+    Pick the cheapest route predicted to reach `target_score` for a probed
+    PDF, from the document class's history where there is enough of it and
+    from the probe otherwise; if no route is predicted to reach the
+    target, the best-scoring one. Returns the decision for the report.
+    """
+    doc_class = document_class(probe)
+    routes = ROUTES if marker else ("fast",)
+    fast_score = probe_fast_score(probe, doc_class)
+    predictions = {}
+    for route in routes:
+        score, per_page = route_prior(route, probe, doc_class, fast_score)
+        basis = "probe"
+        past = history.get(doc_class, route) if history else None
+        if past:
+            score = past["score"]
+            per_page = past["seconds_per_page"] if past["seconds_per_page"] is not None else per_page
+            basis = f"{past['runs']} past runs"
+        if route == "fast":
+            fast_score = score
+        predictions[route] = {"score": round(score), "seconds": round(per_page * n_pages, 2), "basis": basis}
+
+    if not marker:
+        route, why = "fast", "Marker-PDF not available"
+    else:
+        reaching = [r for r in routes if predictions[r]["score"] >= target_score]
+        if reaching:
+            route = min(reaching, key=lambda r: predictions[r]["seconds"])
+            why = f"cheapest route predicted to reach {target_score}"
+        else:
+            route = max(routes, key=lambda r: (predictions[r]["score"], -predictions[r]["seconds"]))
+            why = f"no route predicted to reach {target_score}, best predicted score"
+
+    p = predictions[route]
+    return {
+        "route": route,
+        "doc_class": doc_class,
+        "pages": n_pages,
+        "predicted_score": p["score"],
+        "predicted_seconds": p["seconds"],
+        "reason": f"{doc_class}, {why}: score {p['score']} in {p['seconds']}s from {p['basis']}",
+        "predictions": predictions,
+    }
+
+
+def run_backends(
+    source,
+    sink,
+    route: str,
+    pages: list[int] = None,
+    cache: ExtractionCache = None,
+    file_hash: str = None,
+    escalate_below: int = PAGE_ESCALATION_SCORE,
+    profiler: StageProfiler = None,
+    deadline: BackendDeadline = None,
+) -> tuple[str, list[str]]:
+    """
+    Extract `source` into `sink` along a route: "fast" (fast backends
+    only), "page" (fast backends, weak pages escalated to Marker) or
+    "document" (Marker first, whole-document fallback). Falls back to
+    "document" when there is nothing to escalate to or from. Every backend
+    attempt is held to `deadline`.
+    Returns (method_used, warnings).
+    """
+    fast_chain = [b for b in backend_chain() if b[0] != "marker-pdf"]
+    if route == "fast" and fast_chain:
+        return extract_pdf_pages(source, sink, pages, cache, file_hash, fast_chain, profiler, deadline)
+    if route == "page" and MARKER_AVAILABLE and fast_chain:
+        escalator = PageEscalator(sink, source, cache, file_hash, escalate_below, profiler, deadline)
+        method, warnings = extract_pdf_pages(source, escalator, pages, cache, file_hash, fast_chain,
+                                             profiler, deadline)
+        escalator.finish()
+        return method, warnings + escalator.warnings
+    return extract_pdf_pages(source, sink, pages, cache, file_hash, profiler=profiler, deadline=deadline)
+
+
+def choose_route(
+    report: dict,
+    probe: PdfProbe,
+    pages: list[int],
+    fallback: str,
+    target_quality: int,
+    history: BackendHistory = None,
+    cache: ExtractionCache = None,
+    file_hash: str = None,
+    decision: dict = None,
+) -> str:
+    """
+    The extraction route for a PDF: fixed by --fallback page/document, or
+    routed (fallback="auto", needs a probe), recording the decision in
+    report["backend_route"]. A `decision` already made for the whole
+    document (the shards of one PDF share it) is taken as is.
+    """
+    if fallback != "auto":
+        return fallback
+    if decision is not None:
+        decision = dict(decision)
+    elif probe is None:
+        return "page"
+    else:
+        n_pages = len(clamp_pages(pages, probe.page_count)) if pages is not None else probe.page_count
+        decision = route_backends(probe, n_pages, target_quality, history)
+    if cache is not None and file_hash:
+        first = "marker-pdf" if decision["route"] == "document" else next(
+            (m for m, _ in backend_chain() if m != "marker-pdf"), "marker-pdf")
+        decision["cached"] = cache.has_records("raw", cache.raw_key(file_hash, first, pages))
+    report["backend_route"] = decision
+    return decision["route"]
+
+
+# ─── .tex file handling ────────────────────────────────────────────────
+
+# Bump when scan_tex_source's output changes (invalidates cached scans)
+TEX_SCAN_VERSION = 1
+
+# Words per typeset page, for the page count estimate of a .tex source
+TEX_WORDS_PER_PAGE = 450
+
+TEX_MATH_ENVIRONMENTS = ("equation", "align", "alignat", "gather", "multline", "eqnarray", "flalign")
+TEX_THEOREM_ENVIRONMENTS = ("theorem", "lemma", "proposition", "corollary", "definition",
+                            "assumption", "remark", "example", "condition", "proof")
+
+# One pass over each line finds file inclusions, \title/\author and
+# \begin{...}; \includegraphics and the like don't match
+_TEX_EVENT = re.compile(
+    r'\\(?P<include>input|include)(?![A-Za-z])\s*(?:\{(?P<target>[^{}]+)\}|(?P<bare>[^\s{}%\\]+))'
+    r'|\\(?P<meta>title|author)(?![A-Za-z])\s*(?:\[[^\]]*\])?\s*\{'
+    r'|\\begin\s*\{(?P<env>[A-Za-z]+)\*?\}'
+)
+_TEX_COMMENT = re.compile(r'(?<!\\)%')
+
+
+def _take_braced(text: str, depth: int) -> tuple[str, int]:
+    """
+    Consume `text` up to the brace closing an argument opened `depth`
+    levels up. Returns (consumed text, remaining depth; 0 if closed).
+    """
+    for i, ch in enumerate(text):
+        if ch == '{' and (i == 0 or text[i - 1] != '\\'):
+            depth += 1
+        elif ch == '}' and (i == 0 or text[i - 1] != '\\'):
+            depth -= 1
+            if depth == 0:
+                return text[:i], 0
+    return text, depth
+
+
+def scan_tex_source(tex_path: str) -> dict:
+    """
+    One streaming pass over a single .tex file (includes not followed).
+    Returns its line count, environment counts and, in source order, the
+    events the project walk needs: \\input/\\include (with line and
+    column span), \\title/\\author values, and \\begin{document}. Each
+    event carries the words counted since the previous one, so a walk can
+    tell preamble words from body words. Comments are ignored.
+    """
+    events = []
+    environments = {}
+    words = 0
+    lines = 0
+    pending = None  # [kind, parts, depth] of a multi-line \title{...}/\author{...}
+
+    with open(tex_path, 'r', encoding='utf-8', errors='replace') as f:
+        for lines, line in enumerate(f, 1):
+            comment = _TEX_COMMENT.search(line)
+            code = line[:comment.start()] if comment else line
+            words += len(code.split())
+
+            pos = 0
+            if pending is not None:
+                part, pending[2] = _take_braced(code, pending[2])
+                pending[1].append(part)
+                if pending[2]:
+                    continue
+                events.append({"kind": pending[0], "value": " ".join(" ".join(pending[1]).split()),
+                               "words": 0})
+                pos = len(part) + 1
+                pending = None
+
+            for m in _TEX_EVENT.finditer(code, pos):
+                if m.group("include"):
+                    events.append({"kind": "include", "target": (m.group("target") or m.group("bare")).strip(),
+                                   "line": lines, "start": m.start(), "end": m.end(), "words": words})
+                    words = 0
+                elif m.group("meta"):
+                    part, depth = _take_braced(code[m.end():], 1)
+                    if depth:
+                        pending = [m.group("meta"), [part], depth]
+                        break
+                    events.append({"kind": m.group("meta"), "value": " ".join(part.split()), "words": 0})
+                elif m.group("env") == "document":
+                    events.append({"kind": "begin_document", "words": words})
+                    words = 0
+                else:
+                    env = m.group("env")
+                    environments[env] = environments.get(env, 0) + 1
+
+    return {"version": TEX_SCAN_VERSION, "lines": lines, "events": events,
+            "tail_words": words, "environments": environments}
+
+
+def resolve_tex_include(target: str, including_file: str, root_dir: Path) -> Path | None:
+    """
+    File named by \\input{target}: relative to the main file's directory
+    (where LaTeX runs) or else to the including file, ".tex" added when the
+    name has no extension. None if there is no such file.
+    """
+    names = [target] if Path(target).suffix else [f"{target}.tex", target]
+    for base in (root_dir, Path(including_file).parent):
+        for name in names:
+            path = base / name
+            if path.is_file():
+                return path
+    return None
+
+
+class TexProject:
+    """
+    A .tex file and, recursively, everything it \\input/\\includes.
+
+    Each file is scanned once (scan_tex_source); with a cache, scans are
+    stored by content hash, so re-processing a multi-file draft rescans
+    only the files that changed. The walk follows inclusions in document
+    order with cycle detection, takes \\title/\\author only from the
+    preamble (the walk stops looking once \\begin{document} is reached),
+    counts body words and sums environment counts. write() then streams
+    the concatenated source, included files inlined between comment
+    markers, without holding it in memory.
+    """
+
+    def __init__(self, tex_path: str, cache: ExtractionCache = None):
+        self.path = Path(tex_path)
+        self.root_dir = self.path.parent
+        self.cache = cache
+        self.scans = {}
+        self.hashes = {}
+        self.warnings = []
+        self.title = None
+        self.author = None
+        self.lines = 0
+        self.body_words = 0
+        self.preamble_words = 0
+        self.environments = {}
+        self.cached_scans = 0
+        self._in_document = False
+        self._walk(self.path, [])
+
+    def scan(self, path: Path) -> dict:
+        if path in self.scans:
+            return self.scans[path]
+        scan = None
+        if self.cache is not None:
+            self.hashes[path] = hash_file(str(path))
+            key = self.cache.tex_key(self.hashes[path])
+            scan = self.cache.get("tex", key)
+            if scan is not None:
+                self.cached_scans += 1
+        if scan is None:
+            scan = scan_tex_source(str(path))
+            if self.cache is not None:
+                self.cache.put("tex", key, scan)
+        self.scans[path] = scan
+        return scan
+
+    def include_target(self, path: Path, event: dict, stack: list[Path]) -> Path | None:
+        target = resolve_tex_include(event["target"], str(path), self.root_dir)
+        if target is None or target.resolve() in stack:
+            return None
+        return target
+
+    def _count_words(self, n: int):
+        if self._in_document:
+            self.body_words += n
+        else:
+            self.preamble_words += n
+
+    def _walk(self, path: Path, stack: list[Path]):
+        scan = self.scan(path)
+        stack = stack + [path.resolve()]
+        self.lines += scan["lines"]
+        for env, n in scan["environments"].items():
+            self.environments[env] = self.environments.get(env, 0) + n
+
+        for event in scan["events"]:
+            self._count_words(event["words"])
+            kind = event["kind"]
+            if kind == "include":
+                target = resolve_tex_include(event["target"], str(path), self.root_dir)
+                if target is None:
+                    self.warnings.append(f"{path.name}:{event['line']}: included file "
+                                         f"{event['target']!r} not found, left as is")
+                elif target.resolve() in stack:
+                    self.warnings.append(f"{path.name}:{event['line']}: {event['target']!r} "
+                                         f"includes itself (cycle), left as is")
+                else:
+                    self._walk(target, stack)
+            elif kind == "begin_document":
+                self._in_document = True
+            elif kind == "title" and self.title is None and not self._in_document:
+                self.title = event["value"]
+            elif kind == "author" and self.author is None and not self._in_document:
+                self.author = event["value"]
+        self._count_words(scan["tail_words"])
+
+    @property
+    def files(self) -> list[Path]:
+        return list(self.scans)
+
+    def dependencies(self) -> dict[str, str]:
+        """Content hashes of the included files (not the main file)."""
+        return {str(path): self.hashes.get(path) or hash_file(str(path))
+                for path in self.scans if path != self.path}
+
+    def write(self, out, path: Path = None, stack: list[Path] = None):
+        """Stream the source with included files inlined into text file `out`."""
+        path = path or self.path
+        stack = (stack or []) + [path.resolve()]
+        includes = {}
+        for event in self.scans[path]["events"]:
+            if event["kind"] == "include":
+                includes.setdefault(event["line"], []).append(event)
+
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for n, line in enumerate(f, 1):
+                pos = 0
+                for event in includes.get(n, ()):
+                    target = self.include_target(path, event, stack)
+                    if target is None:
+                        continue
+                    out.write(line[pos:event["start"]])
+                    out.write(f"\n% >>> {target.name}\n")
+                    self.write(out, target, stack)
+                    out.write(f"\n% <<< {target.name}\n")
+                    pos = event["end"]
+                out.write(line[pos:])
+
+    def metadata(self) -> dict:
+        math = sum(self.environments.get(env, 0) for env in TEX_MATH_ENVIRONMENTS)
+        theorems = sum(self.environments.get(env, 0) for env in TEX_THEOREM_ENVIRONMENTS)
+        meta = {
+            "title": self.title or self.path.stem,
+            "authors": self.author or "Unknown",
+            "page_count": max(1, round(self.body_words / TEX_WORDS_PER_PAGE)),
+            "page_count_estimated": True,
+            "word_count": self.preamble_words + self.body_words,
+            "line_count": self.lines,
+            "extraction_method": "native-tex",
+            "quality": {
+                "quality_score": 100,
+                "latex_equations": math,
+                "theorem_environments": theorems,
+                "environments": dict(sorted(self.environments.items())),
+                "note": "Native LaTeX source — no extraction needed",
+            },
+        }
+        if len(self.scans) > 1:
+            meta["included_files"] = [str(p) for p in self.files if p != self.path]
+        if self.cache is not None:
+            meta["tex_scans_cached"] = f"{self.cached_scans}/{len(self.scans)}"
+        if self.warnings:
+            meta["extraction_warnings"] = list(dict.fromkeys(self.warnings))
+        return meta
+
+
+def write_tex_body(tex_path: str, body_path: Path, cache: ExtractionCache = None) -> dict:
+    """
+    Write a .tex source (included files inlined) into `body_path` as a
+    markdown code fence under its title. Returns the report metadata.
+    """
+    project = TexProject(tex_path, cache)
+    meta = project.metadata()
+    with open(body_path, 'w', encoding='utf-8') as out:
+        out.write(f"# {meta['title']}\n\n```latex\n")
+        project.write(out)
+        out.write("\n```\n")
+    return meta
+
+
+def process_tex_file(tex_path: str, cache: ExtractionCache = None) -> tuple[str, dict]:
+    """Process a .tex file in memory — wrap in markdown with code fence."""
+    project = TexProject(tex_path, cache)
+    meta = project.metadata()
+    out = io.StringIO()
+    out.write(f"# {meta['title']}\n\n```latex\n")
+    project.write(out)
+    out.write("\n```\n")
+    return out.getvalue(), meta
+
+
+# ─── Main pipeline ─────────────────────────────────────────────────────
+
+def lookup_page_ranges(file_path: str, source_type: str, page_ranges: dict[str, str] = None):
+    """Page range spec for a file, matched by "category/name", name, or stem."""
+    if not page_ranges:
+        return None
+    p = Path(file_path)
+    for key in (f"{source_type}/{p.name}", p.name, p.stem):
+        if key in page_ranges:
+            return page_ranges[key]
+    return None
+
+
+def parse_page_ranges_args(values: list[str]) -> dict[str, str]:
+    """Parse repeated --page-ranges FILE=RANGES options into a dict."""
+    page_ranges = {}
+    for value in values or []:
+        name, sep, spec = value.partition("=")
+        if not sep or not name or not spec:
+            raise ValueError(f"expected FILE=RANGES, got {value!r}")
+        parse_page_ranges(spec)  # validate early
+        page_ranges[name] = spec
+    return page_ranges
+
+
+def detect_file_type(path: str, probe: PdfProbe = None, page_count: int = None) -> str:
+    """
+    Detect if file is a textbook (long) or paper (short): by page count when
+    the PDF has been probed or its page count is known, by file size otherwise.
+    """
+    if probe is not None:
+        page_count = probe.page_count
+    if page_count is not None:
+        return "textbook" if page_count > TEXTBOOK_MIN_PAGES else "paper"
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    if size_mb > 3:
+        return "textbook"
+    return "paper"
+
+
+def plan_pdf_pages(
+    report: dict,
+    file_path: str,
+    source_type: str,
+    probe: PdfProbe = None,
+    textbook_page_limit: int = 50,
+    page_ranges: dict[str, str] = None,
+    page_count: int = None,
+) -> list[int]:
+    """
+    Classify a PDF and choose the pages to extract (None = all): explicit
+    page ranges win, textbooks are cut to `textbook_page_limit`. Records the
+    decision in `report`.
+    """
+    file_type = detect_file_type(file_path, probe, page_count)
+    report["file_type"] = file_type
+    page_spec = lookup_page_ranges(file_path, source_type, page_ranges)
+    if page_spec:
+        pages = parse_page_ranges(page_spec)
+        report["page_ranges"] = format_page_ranges(pages)
+        return pages
+    if file_type == "textbook":
+        report["page_limit_applied"] = textbook_page_limit
+        return list(range(textbook_page_limit))
+    return None
+
+
+def apply_pipeline_stats(report: dict, stats: dict, method: str, warnings: list[str]) -> bool:
+    """
+    Fold PagePipeline.finish() stats into `report`. Returns False (and marks
+    the report FAILED) when the extraction produced no usable text.
+    """
+    escalated = stats.pop("escalated_pages")
+    if escalated:
+        method = f"{method}+marker-pdf"
+        report["escalated_pages"] = format_page_ranges(escalated)
+    images = stats.pop("images", None)
+    if images is not None:
+        report["images"] = images
+        if images["missing"]:
+            warnings = warnings + [f"{images['missing']} image(s) linked from cached Marker output "
+                                   f"are missing from the image store; re-run with --no-cache"]
+    report["extraction_method"] = method
+    report["extraction_warnings"] = warnings
+
+    if stats.pop("raw_text_chars") < 50:
+        report["status"] = "FAILED"
+        report["error"] = "Extraction returned empty text"
+        return False
+
+    report["raw_word_count"] = stats["raw_word_count"]
+    report["raw_char_count"] = stats["raw_char_count"]
+    report["latex_fixes_applied"] = stats["latex_fixes_applied"]
+    report["quality"] = stats["quality"]
+    return True
+
+
+def cleaned_frontmatter(report: dict) -> dict:
+    """YAML frontmatter for a cleaned file, from its report."""
+    frontmatter = {
+        "source_file": f"raw/{report['source_type']}/{report['filename']}",
+        "source_type": report["source_type"],
+        "extraction_method": report.get("extraction_method", "unknown"),
+        "extraction_quality": report.get("quality", {}).get("quality_score", 0),
+    }
+    if "page_count" in report:
+        frontmatter["page_count"] = report["page_count"]
+    if "page_limit_applied" in report:
+        frontmatter["page_limit"] = report["page_limit_applied"]
+    if "page_ranges" in report:
+        frontmatter["page_ranges"] = report["page_ranges"]
+    if "escalated_pages" in report:
+        frontmatter["marker_pages"] = report["escalated_pages"]
+    if report.get("images", {}).get("linked"):
+        frontmatter["images_linked"] = report["images"]["linked"]
+    if "duplicate_of" in report:
+        duplicate = report["duplicate_of"]
+        frontmatter["duplicate_of"] = (f"raw/{Path(duplicate['source_file']).parent.name}/"
+                                       f"{Path(duplicate['source_file']).name}")
+        frontmatter["duplicate_match"] = duplicate["match"]
+        if duplicate["match"] == "near":
+            frontmatter["duplicate_similarity"] = duplicate["similarity"]
+    frontmatter.update(report.get("pdf_metadata", {}))
+    return frontmatter
+
+
+def process_file(
+    file_path: str,
+    source_type: str,
+    cleaned_dir: str,
+    textbook_page_limit: int = 50,
+    cache: ExtractionCache = None,
+    page_ranges: dict[str, str] = None,
+    fallback: str = "auto",
+    escalate_below: int = PAGE_ESCALATION_SCORE,
+    trace: bool = False,
+    target_quality: int = PAGE_ESCALATION_SCORE,
+    history: BackendHistory = None,
+    backend_deadline: BackendDeadline = None,
+) -> dict:
+    """
+    Process a single file through the full pipeline. PDFs are processed
+    page by page and written incrementally (see PagePipeline). With a cache, unchanged PDFs skip extraction and unchanged fix tables
+    skip the regex and scoring stages. `page_ranges` maps file names to
+    page range specs (see lookup_page_ranges). With fallback="page" the
+    fast backends run first and only pages scoring below `escalate_below`
+    are re-extracted with Marker (see PageEscalator); fallback="auto" picks
+    the cheapest route predicted to reach `target_quality` from the probe
+    and `history` (see route_backends). Each backend attempt is held to
+    `backend_deadline` (see BackendDeadline). Per-stage timings go
+    in the report's "profile" (see StageProfiler); with `trace` the raw
+    trace events are returned under "trace_events".
+    Returns extraction report dict.
+    """
+    fname = Path(file_path).name
+    stem = Path(file_path).stem
+    ext = Path(file_path).suffix.lower()
+    size_bytes = os.path.getsize(file_path)
+
+    report = {
+        "source_file": file_path,
+        "source_type": source_type,
+        "filename": fname,
+        "file_size_mb": round(size_bytes / (1024*1024), 2),
+    }
+
+    out_dir = Path(cleaned_dir) / source_type
+    out_path = out_dir / f"{stem}.md"
+    body_path = None
+    markdown = None
+    probe = None
+
+    start_time = time.time()
+    profiler = StageProfiler(f"{source_type}/{fname}", trace)
+
+    try:
+        if ext == '.tex':
+            # .tex files — direct processing, included files inlined
+            out_dir.mkdir(parents=True, exist_ok=True)
+            body_path = out_path.with_name(out_path.name + ".partial")
+            with profiler.stage("tex"):
+                meta = write_tex_body(file_path, body_path, cache)
+            report.update(meta)
+            report["extraction_method"] = "native-tex"
+            report["extraction_time_s"] = round(time.time() - start_time, 1)
+
+        elif ext == '.pdf':
+            # Open the PDF once: page count, metadata and text layer for the
+            # report, and a document handle the backends share
+            probe_warnings = []
+            if PYMUPDF_AVAILABLE:
+                try:
+                    with profiler.stage("probe"):
+                        probe = PdfProbe(file_path, size_bytes)
+                    report.update(probe.summary())
+                except Exception as e:
+                    probe_warnings.append(f"PDF probe failed, backends open the file themselves: {e}")
+            source = probe or file_path
+
+            # Determine page limit for textbooks; explicit page ranges win
+            pages = plan_pdf_pages(report, file_path, source_type, probe,
+                                   textbook_page_limit, page_ranges)
+
+            # Steps 1-3, page by page: extract, apply regex LaTeX fixes,
+            # score equation quality; the body streams to <out>.partial
+            print(f"  Extracting: {fname} ({report['file_size_mb']} MB, {report['file_type']})")
+            with profiler.stage("hash"):
+                file_hash = hash_file(file_path) if cache else None
+            if file_hash:
+                report["content_hash"] = file_hash
+
+            out_dir.mkdir(parents=True, exist_ok=True)
+            body_path = out_path.with_name(out_path.name + ".partial")
+            route = choose_route(report, probe, pages, fallback, target_quality,
+                                 history, cache, file_hash)
+            pipeline = PagePipeline(body_path, cache, file_hash, pages, profiler, source)
+            try:
+                method, warnings = run_backends(
+                    source, pipeline, route, pages, cache, file_hash, escalate_below, profiler,
+                    backend_deadline,
+                )
+                stats = pipeline.finish()
+            except BaseException:
+                pipeline.abort()
+                raise
+
+            if not apply_pipeline_stats(report, stats, method, probe_warnings + warnings):
+                os.unlink(body_path)
+                return report
+            report["extraction_time_s"] = round(time.time() - start_time, 1)
+
+        else:
+            report["status"] = "SKIPPED"
+            report["error"] = f"Unsupported file type: {ext}"
+            return report
+
+        # Step 4: Write cleaned file with YAML frontmatter
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with profiler.stage("write_cleaned"):
+            write_cleaned_file(out_path, cleaned_frontmatter(report), markdown, body_path)
+
+        report["output_file"] = str(out_path)
+        report["output_size_kb"] = round(os.path.getsize(out_path) / 1024, 1)
+        report["status"] = "OK"
+
+    except Exception as e:
+        report["status"] = "FAILED"
+        report["error"] = str(e)
+        report["traceback"] = traceback.format_exc()
+        if body_path is not None and body_path.exists():
+            report["partial_output_file"] = str(body_path)
+    finally:
+        if probe is not None:
+            probe.close()
+        report["profile"] = profiler.report()
+        if trace:
+            report["trace_events"] = profiler.events
+
+    return report
+
+
+# ─── Incremental runs ─────────────────────────────────────────────────
+
+MANIFEST_VERSION = 1
+
+
+def source_stat(path: str) -> dict:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def pipeline_settings(file_path: str, source_type: str, file_options: dict) -> dict:
+    """
+    Everything besides the file's contents that determines its output:
+    stage versions, backend versions and the options that apply to it.
+    A change here invalidates the file's manifest entry.
+    """
+    settings = {"manifest_version": MANIFEST_VERSION}
+    if Path(file_path).suffix.lower() == '.pdf':
+        settings.update({
+            "backends": {m: backend_version(m) for m, _ in backend_chain()},
+            "fix_table_version": fix_table_version(),
+            "scorer_version": SCORER_VERSION,
+            "textbook_page_limit": file_options.get("textbook_page_limit"),
+            "page_ranges": lookup_page_ranges(
+                file_path, source_type, file_options.get("page_ranges")
+            ),
+            "fallback": file_options.get("fallback"),
+            "escalate_below": file_options.get("escalate_below"),
+        })
+        if file_options.get("fallback") == "auto":
+            settings["target_quality"] = file_options.get("target_quality")
+        if IMAGE_STORE is not None:
+            settings["images"] = IMAGE_STORE.variant()
+    elif Path(file_path).suffix.lower() == '.tex':
+        # Included files are part of the source
+        settings["tex_scan_version"] = TEX_SCAN_VERSION
+        settings["included"] = TexProject(file_path, file_options.get("cache")).dependencies()
+    # Normalize through JSON so it compares equal to what was loaded
+    return json.loads(json.dumps(settings))
+
+
+def load_manifest(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"version": MANIFEST_VERSION, "files": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "files": {}}
+    return manifest
+
+
+def save_manifest(path: str, manifest: dict):
+    """Write the manifest atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def manifest_entry(file_path: str, settings: dict, report: dict) -> dict:
+    entry = source_stat(file_path)
+    entry["sha256"] = report.get("content_hash") or hash_file(file_path)
+    entry["settings"] = settings
+    entry["report"] = report
+    return entry
+
+
+def plan_incremental(
+    all_files: list[tuple[str, str]],
+    manifest: dict,
+    settings: list[dict],
+) -> tuple[list[int], dict[int, dict], dict[str, int]]:
+    """
+    Decide which files need processing.
+
+    A file is reused when its manifest entry succeeded (OK/SKIPPED), its
+    settings are unchanged, its output still exists, and either size+mtime
+    match or — after a touch or copy — its content hash does.
+    Returns (indices_to_process, {index: prior_report}, reason_counts).
+    """
+    todo = []
+    reused = {}
+    reasons = {"new": 0, "changed": 0, "invalidated": 0, "retry": 0}
+    entries = manifest["files"]
+
+    for idx, (fpath, _) in enumerate(all_files):
+        entry = entries.get(fpath)
+        if entry is None:
+            reason = "new"
+        elif entry["report"].get("status") not in ("OK", "SKIPPED"):
+            reason = "retry"
+        elif entry["settings"] != settings[idx]:
+            reason = "invalidated"
+        elif entry["report"].get("output_file") and not os.path.exists(entry["report"]["output_file"]):
+            reason = "invalidated"
+        elif source_stat(fpath) == {"size": entry["size"], "mtime_ns": entry["mtime_ns"]}:
+            reason = None
+        elif hash_file(fpath) == entry["sha256"]:
+            entry.update(source_stat(fpath))
+            reason = None
+        else:
+            reason = "changed"
+
+        if reason is None:
+            reused[idx] = entry["report"]
+        else:
+            todo.append(idx)
+            reasons[reason] += 1
+
+    return todo, reused, reasons
+
+
+def prune_deleted_sources(manifest: dict, current: set[str]) -> list[str]:
+    """Drop manifest entries whose source is gone and delete their outputs."""
+    removed = []
+    for fpath in [p for p in manifest["files"] if p not in current]:
+        entry = manifest["files"].pop(fpath)
+        out = entry["report"].get("output_file")
+        if out and os.path.exists(out):
+            os.unlink(out)
+            removed.append(out)
+    return removed
+
+
+# ─── Duplicate sources ────────────────────────────────────────────────
+
+# The same paper often sits in several raw/ categories, or as an arXiv and
+# a journal version. Copies are found before extraction (exact ones by
+# content hash, near ones by a MinHash of the start of the text layer);
+# only the first copy in scan order is extracted and the others are
+# written from its output.
+DEDUP_VERSION = 1
+DEDUP_SAMPLE_WORDS = 1000
+DEDUP_MAX_PAGES = 6
+DEDUP_SHINGLE_WORDS = 4
+DEDUP_MIN_SHINGLES = 50
+DEDUP_THRESHOLD = 0.8
+
+# 64 MinHash permutations banded 16 x 4 for candidate lookup: two samples
+# with Jaccard similarity 0.8 share a band with probability > 0.999
+MINHASH_BANDS = 16
+MINHASH_ROWS = 4
+_MERSENNE_61 = (1 << 61) - 1
+_MINHASH_PARAMS = [
+    tuple(int.from_bytes(hashlib.blake2b(f"minhash:{i}:{part}".encode(), digest_size=8).digest(), "big")
+          % (_MERSENNE_61 - 1) + 1 for part in "ab")
+    for i in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
+
+def sample_words(pdf_path: str) -> list[str]:
+    """The first DEDUP_SAMPLE_WORDS words of a PDF's text layer, lowercased."""
+    words = []
+    with import_pymupdf().open(pdf_path) as doc:
+        for i in range(min(len(doc), DEDUP_MAX_PAGES)):
+            words.extend(re.findall(r'\w+', doc[i].get_text().lower()))
+            if len(words) >= DEDUP_SAMPLE_WORDS:
+                break
+    return words[:DEDUP_SAMPLE_WORDS]
+
+
+def minhash_signature(words: list[str]) -> list[int] | None:
+    """MinHash of the word shingles, or None if the sample is too short to compare."""
+    shingles = {" ".join(words[i:i + DEDUP_SHINGLE_WORDS])
+                for i in range(len(words) - DEDUP_SHINGLE_WORDS + 1)}
+    if len(shingles) < DEDUP_MIN_SHINGLES:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(sh.encode(), digest_size=8).digest(), "big")
+              for sh in shingles]
+    return [min((a * h + b) % _MERSENNE_61 for h in hashes) for a, b in _MINHASH_PARAMS]
+
+
+def minhash_similarity(a: list[int], b: list[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class SourceSignatures:
+    """
+    Content hash and MinHash of each source, kept in a JSON file and reused
+    while the file's size and mtime are unchanged, so only new or changed
+    sources are read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}
+        self.seen = set()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == DEDUP_VERSION:
+                self.files = data["files"]
+        except (OSError, ValueError):
+            pass
+
+    def get(self, file_path: str) -> dict:
+        self.seen.add(file_path)
+        stat = source_stat(file_path)
+        entry = self.files.get(file_path)
+        if entry is None or {"size": entry["size"], "mtime_ns": entry["mtime_ns"]} != stat:
+            minhash = None
+            if Path(file_path).suffix.lower() == '.pdf' and PYMUPDF_AVAILABLE:
+                try:
+                    minhash = minhash_signature(sample_words(file_path))
+                except Exception:
+                    pass
+            entry = dict(stat, sha256=hash_file(file_path), minhash=minhash)
+            self.files[file_path] = entry
+        return entry
+
+    def save(self):
+        """Write the signatures of the sources seen this run, atomically."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"version": DEDUP_VERSION,
+                       "files": {p: e for p, e in self.files.items() if p in self.seen}}, f)
+        os.replace(tmp, self.path)
+
+
+def find_duplicates(
+    all_files: list[tuple[str, str]],
+    settings: list[dict],
+    signatures: SourceSignatures,
+    threshold: float = DEDUP_THRESHOLD,
+) -> dict[int, dict]:
+    """
+    Map each duplicate source to the earlier copy that is extracted in its
+    place: {index: {"index", "source_file", "match": "exact"|"near",
+    "similarity"}}. Only files with the same pipeline settings are
+    compared, and a near copy must reach `threshold` against the
+    canonical copy itself, so matches never chain.
+    """
+    duplicates = {}
+    exact = {}
+    sketches = {}
+    buckets = {}
+    for idx, (fpath, _) in enumerate(all_files):
+        sig = signatures.get(fpath)
+        key = json.dumps(settings[idx], sort_keys=True)
+        canonical = exact.setdefault((key, sig["sha256"]), idx)
+        if canonical != idx:
+            duplicates[idx] = {"index": canonical, "source_file": all_files[canonical][0],
+                               "match": "exact", "similarity": 1.0}
+            continue
+        minhash = sig["minhash"]
+        if minhash is None:
+            continue
+
+        bands = [(key, b, tuple(minhash[b * MINHASH_ROWS:(b + 1) * MINHASH_ROWS]))
+                 for b in range(MINHASH_BANDS)]
+        candidates = sorted({c for band in bands for c in buckets.get(band, ())})
+        scored = [(minhash_similarity(minhash, sketches[c]), -c) for c in candidates]
+        best = max(scored, default=None)
+        if best is not None and best[0] >= threshold:
+            canonical = -best[1]
+            duplicates[idx] = {"index": canonical, "source_file": all_files[canonical][0],
+                               "match": "near", "similarity": round(best[0], 3)}
+            continue
+        sketches[idx] = minhash
+        for band in bands:
+            buckets.setdefault(band, []).append(idx)
+    return duplicates
+
+
+@contextmanager
+def open_cleaned_body(md_path: str):
+    """Open a cleaned markdown file positioned just past its frontmatter."""
+    with open(md_path, 'r', encoding='utf-8') as f:
+        if f.readline() == "---\n":
+            line = f.readline()
+            while line and line != "---\n":
+                line = f.readline()
+            position = f.tell()
+            if f.readline() != "\n":
+                f.seek(position)
+        else:
+            f.seek(0)
+        yield f
+
+
+def link_duplicate(file_path: str, source_type: str, cleaned_dir: str,
+                   canonical: dict, duplicate: dict) -> dict:
+    """
+    Write a duplicate source's cleaned file from its canonical copy's
+    output instead of extracting it again. The report carries over the
+    canonical copy's extraction results and records the relationship
+    under "duplicate_of".
+    """
+    start_time = time.time()
+    out_path = Path(cleaned_dir) / source_type / f"{Path(file_path).stem}.md"
+    own = {"source_file", "source_type", "filename", "file_size_mb", "content_hash",
+           "output_file", "output_size_kb", "extraction_time_s", "backend_route", "profile"}
+    report = {
+        "source_file": file_path,
+        "source_type": source_type,
+        "filename": Path(file_path).name,
+        "file_size_mb": round(os.path.getsize(file_path) / (1024*1024), 2),
+        **{k: v for k, v in canonical.items() if k not in own},
+        "duplicate_of": {
+            "source_file": canonical["source_file"],
+            "output_file": canonical["output_file"],
+            "match": duplicate["match"],
+            "similarity": duplicate["similarity"],
+        },
+    }
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open_cleaned_body(canonical["output_file"]) as body:
+        write_cleaned_file(out_path, cleaned_frontmatter(report), body_file=body)
+    report["extraction_time_s"] = round(time.time() - start_time, 1)
+    report["output_file"] = str(out_path)
+    report["output_size_kb"] = round(os.path.getsize(out_path) / 1024, 1)
+    return report
+
+
+# ─── Report store ─────────────────────────────────────────────────────
+
+REPORT_INDEX_VERSION = 1
+
+
+class ReportStore:
+    """
+    Per-file reports as append-only JSON lines, one record per finished
+    file, plus an offset index so one file's record can be read without
+    parsing the others:
+
+        with ReportStore("workspace/extraction_reports.jsonl") as store:
+            report = store.get("raw/reference/book.pdf")
+
+    Every record is flushed as it is written, so a crash mid-batch keeps
+    all reports finished so far. The index (<name>.idx.json) maps each
+    source file to the [offset, length] of its latest record and is
+    written on close(); records past the byte offset it covers (left by a
+    run that died before close()) are indexed on open by scanning only
+    that tail, and a torn last line is cut off. An index whose first and
+    last records are not where it says (the file was replaced) is rebuilt
+    by scanning the whole file. A later record for the
+    same source supersedes the earlier one; close() compacts the file
+    once superseded records outnumber live ones.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.index_path = self.path.with_suffix(".idx.json")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.records = {}
+        self.stale = 0
+        self.dirty = False
+        self._out = None
+        self._load_index()
+
+    def _load_index(self):
+        end = 0
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("version") == REPORT_INDEX_VERSION:
+                self.records = {src: tuple(loc) for src, loc in index["records"].items()}
+                self.stale = index["stale"]
+                end = index["end"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if end > size or not self._indexed_correctly():
+            # Index of some other (since truncated or replaced) file
+            self.records, self.stale, end = {}, 0, 0
+        if end < size:
+            self._scan(end)
+
+    def _indexed_correctly(self) -> bool:
+        """Spot check: the first and last indexed records are where the index says."""
+        if not self.records:
+            return True
+        by_offset = sorted(self.records.items(), key=lambda kv: kv[1])
+        try:
+            with open(self.path, 'rb') as f:
+                for source_file, (offset, length) in {by_offset[0], by_offset[-1]}:
+                    f.seek(offset)
+                    line = f.read(length)
+                    if not line.endswith(b"\n") or json.loads(line)["source_file"] != source_file:
+                        return False
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def _scan(self, offset: int):
+        self.dirty = True
+        with open(self.path, 'r+b') as f:
+            f.seek(offset)
+            for line in iter(f.readline, b""):
+                if not line.endswith(b"\n"):
+                    f.truncate(offset)
+                    break
+                try:
+                    self._note(json.loads(line)["source_file"], offset, len(line))
+                except (ValueError, KeyError, TypeError):
+                    self.stale += 1
+                offset += len(line)
+
+    def _note(self, source_file: str, offset: int, length: int):
+        if source_file in self.records:
+            self.stale += 1
+        self.records[source_file] = (offset, length)
+
+    def __contains__(self, source_file: str) -> bool:
+        return source_file in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def append(self, report: dict):
+        line = (json.dumps(report, ensure_ascii=False) + "\n").encode('utf-8')
+        if self._out is None:
+            self._out = open(self.path, 'ab')
+        offset = self._out.tell()
+        self._out.write(line)
+        self._out.flush()
+        self._note(report["source_file"], offset, len(line))
+        self.dirty = True
+
+    def discard(self, source_file: str):
+        """Drop a file's record from the index (e.g. its source was deleted)."""
+        if self.records.pop(source_file, None) is not None:
+            self.stale += 1
+            self.dirty = True
+
+    def get(self, source_file: str) -> dict | None:
+        loc = self.records.get(source_file)
+        if loc is None:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(loc[0])
+            return json.loads(f.read(loc[1]))
+
+    def __iter__(self):
+        """Latest record of every file, in file order."""
+        if not self.records:
+            return
+        with open(self.path, 'rb') as f:
+            for offset, length in sorted(self.records.values()):
+                f.seek(offset)
+                yield json.loads(f.read(length))
+
+    def compact(self):
+        """Rewrite the file with only the latest record of each source."""
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        records = {}
+        with open(self.path, 'rb') as src, open(tmp, 'wb') as dst:
+            for source_file, (offset, length) in sorted(self.records.items(), key=lambda kv: kv[1]):
+                src.seek(offset)
+                records[source_file] = (dst.tell(), length)
+                dst.write(src.read(length))
+        os.replace(tmp, self.path)
+        self.records, self.stale, self.dirty = records, 0, True
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        if self.stale > len(self.records):
+            self.compact()
+        if not self.dirty:
+            return
+        index = {
+            "version": REPORT_INDEX_VERSION,
+            "end": self.path.stat().st_size,
+            "stale": self.stale,
+            "records": {src: list(loc) for src, loc in self.records.items()},
+        }
+        tmp = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+        self.dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ReportSummary:
+    """Batch totals and distributions, accumulated one report at a time."""
+
+    def __init__(self):
+        self.counts = {"total_files": 0, "successful": 0, "failed": 0, "skipped": 0,
+                       "total_pages": 0, "total_words": 0}
+        self.methods_used = {}
+        self.quality_distribution = {"excellent_90_100": 0, "good_70_89": 0,
+                                     "fair_50_69": 0, "poor_below_50": 0}
+        self._review = []  # (order, filename)
+        self.images = None
+
+    def add(self, report: dict, order: int = 0):
+        """Count one report; `order` sorts files_needing_review (e.g. the scan order)."""
+        status_keys = {"OK": "successful", "FAILED": "failed", "SKIPPED": "skipped"}
+        self.counts["total_files"] += 1
+        if report.get("status") in status_keys:
+            self.counts[status_keys[report["status"]]] += 1
+        self.counts["total_pages"] += report.get("page_count", 0)
+        self.counts["total_words"] += report.get("raw_word_count", 0)
+
+        method = report.get("extraction_method", "unknown")
+        self.methods_used[method] = self.methods_used.get(method, 0) + 1
+        if report.get("images"):
+            if self.images is None:
+                self.images = dict.fromkeys(report["images"], 0)
+            for key, value in report["images"].items():
+                self.images[key] = self.images.get(key, 0) + value
+
+        quality = report.get("quality", {})
+        score = quality.get("quality_score", 0)
+        if score >= 90:
+            self.quality_distribution["excellent_90_100"] += 1
+        elif score >= 70:
+            self.quality_distribution["good_70_89"] += 1
+        elif score >= 50:
+            self.quality_distribution["fair_50_69"] += 1
+        elif score > 0:
+            self.quality_distribution["poor_below_50"] += 1
+        if quality.get("quality_score", 100) < 80:
+            self._review.append((order, report["filename"]))
+
+    def result(self) -> dict:
+        result = {
+            **self.counts,
+            "methods_used": dict(self.methods_used),
+            "quality_distribution": dict(self.quality_distribution),
+            "files_needing_review": [name for _, name in sorted(self._review)],
+        }
+        if self.images is not None:
+            result["images"] = dict(self.images)
+        return result
+
+
+# ─── Search index over cleaned/ ───────────────────────────────────────
+
+INDEX_VERSION = 1
+
+# Roughly this many characters per indexed chunk when a file has no page
+# markers (e.g. .tex sources)
+INDEX_CHUNK_CHARS = 8000
+
+# Display and environment equations; inline $...$ comes from ContextIndex
+_EQUATION_ENV_PATTERN = re.compile(
+    r'\\begin\{(equation|align|gather|multline|eqnarray)\*?\}(.*?)\\end\{\1\*?\}', re.DOTALL
+)
+
+# Theorem-like headings: "**Theorem 2.1** (Name).", "### Lemma A.3.", "LEMMA 4."
+_HEADING_PATTERN = re.compile(
+    r'^[#>*_\s]*(theorem|lemma|proposition|corollary|definition|assumption|remark|example|condition)'
+    r'\s+([A-Z]?\d+(?:\.\d+)*[a-z]?)\b[.*_:\s]*(?:\(([^)\n]{1,120})\))?',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# The same environments in LaTeX sources (numbered by LaTeX, so no number)
+_TEX_HEADING_PATTERN = re.compile(
+    r'\\begin\{(theorem|lemma|proposition|corollary|definition|assumption|remark|example|condition)\*?\}'
+    r'(?:\[([^\]\n]{1,120})\])?'
+)
+
+_LATEX_TOKEN = re.compile(r'\\[A-Za-z]+|\\.|\S')
+_LATEX_IGNORED = {r'\left', r'\right', r'\big', r'\Big', r'\bigg', r'\Bigg',
+                  r'\,', r'\;', r'\:', r'\!', '\\ '}
+
+
+def _is_latex_command(token: str) -> bool:
+    return token.startswith('\\') and token[1:].isalpha()
+
+
+def normalize_latex(latex: str) -> str:
+    """
+    Canonical form of a LaTeX snippet for matching: no whitespace, spacing
+    commands or \\left/\\right, \\dfrac/\\tfrac as \\frac, and braces around
+    a single token after _, ^ or a command dropped (x_{0} -> x_0,
+    \\sqrt{n} -> \\sqrt n).
+    """
+    tokens = [r'\frac' if t in (r'\dfrac', r'\tfrac') else t
+              for t in _LATEX_TOKEN.findall(latex) if t not in _LATEX_IGNORED]
+    out = []
+    i = 0
+    while i < len(tokens):
+        if (tokens[i] == '{' and i + 2 < len(tokens) and tokens[i + 2] == '}'
+                and out and (out[-1] in ('_', '^') or _is_latex_command(out[-1]))):
+            out.append(tokens[i + 1])
+            i += 3
+        else:
+            out.append(tokens[i])
+            i += 1
+
+    parts = []
+    for prev, token in zip([''] + out, out):
+        if _is_latex_command(prev) and token[0].isalpha():
+            parts.append(' ')
+        parts.append(token)
+    return ''.join(parts)
+
+
+def split_indexed_pages(text: str) -> list[tuple[int, int, str]]:
+    """
+    Split cleaned markdown into (page, start_offset, text) chunks at its
+    page markers. Without markers the body is cut into paragraph-aligned
+    chunks of about INDEX_CHUNK_CHARS with page None.
+    """
+    body_start = 0
+    if text.startswith('---'):
+        end = text.find('\n---', 3)
+        if end != -1:
+            body_start = end + 4
+
+    markers = list(PAGE_MARKER_PATTERN.finditer(text, body_start))
+    if markers:
+        chunks = []
+        for m, nxt in zip(markers, markers[1:] + [None]):
+            end = nxt.start() if nxt else len(text)
+            chunks.append((int(m.group(1)), m.start(), text[m.start():end]))
+        return chunks
+
+    chunks = []
+    start = body_start
+    while start < len(text):
+        end = text.find('\n\n', start + INDEX_CHUNK_CHARS)
+        end = len(text) if end == -1 else end + 2
+        chunks.append((None, start, text[start:end]))
+        start = end
+    return chunks
+
+
+class CleanedIndex:
+    """
+    On-disk (SQLite) index of the cleaned markdown: a full-text word index
+    of page-sized chunks (FTS5), the normalized LaTeX of every equation and
+    the theorem/lemma/... headings, all keyed by file, page and character
+    offset. sync() re-indexes only files whose content changed (size and
+    mtime first, then a hash, since a full run rewrites identical outputs)
+    and drops files that are gone, so it is cheap to run after every
+    extraction.
+    Without FTS5 in the local SQLite, word search falls back to a scan.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, INDEX_VERSION):
+            self.db.close()
+            os.unlink(path)
+            self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, source_type TEXT,
+                size INTEGER, mtime_ns INTEGER, sha256 TEXT);
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY, file_id INTEGER, page INTEGER, start INTEGER, text TEXT);
+            CREATE TABLE IF NOT EXISTS equations (
+                file_id INTEGER, page INTEGER, offset INTEGER, latex TEXT, norm TEXT);
+            CREATE TABLE IF NOT EXISTS headings (
+                file_id INTEGER, page INTEGER, offset INTEGER, kind TEXT, number TEXT, title TEXT);
+            CREATE INDEX IF NOT EXISTS chunks_file ON chunks(file_id);
+            CREATE INDEX IF NOT EXISTS equations_file ON equations(file_id);
+            CREATE INDEX IF NOT EXISTS headings_file ON headings(file_id);
+            CREATE INDEX IF NOT EXISTS headings_number ON headings(number);
+        """)
+        try:
+            self.db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING "
+                "fts5(text, content='chunks', content_rowid='id')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self.db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ── maintenance ──
+
+    def _remove(self, file_id: int):
+        if self.fts:
+            self.db.execute(
+                "INSERT INTO chunks_fts(chunks_fts, rowid, text) "
+                "SELECT 'delete', id, text FROM chunks WHERE file_id = ?", (file_id,)
+            )
+        for table in ("chunks", "equations", "headings"):
+            self.db.execute(f"DELETE FROM {table} WHERE file_id = ?", (file_id,))
+        self.db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def index_file(self, md_path: str, source_type: str = None):
+        """(Re-)index one cleaned markdown file."""
+        md_path = str(md_path)
+        row = self.db.execute("SELECT id FROM files WHERE path = ?", (md_path,)).fetchone()
+        if row:
+            self._remove(row[0])
+
+        with open(md_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        st = os.stat(md_path)
+        file_id = self.db.execute(
+            "INSERT INTO files (path, source_type, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+            (md_path, source_type, st.st_size, st.st_mtime_ns,
+             hashlib.sha256(text.encode('utf-8')).hexdigest()),
+        ).lastrowid
+
+        state = (False, None)
+        for page, start, chunk in split_indexed_pages(text):
+            chunk_id = self.db.execute(
+                "INSERT INTO chunks (file_id, page, start, text) VALUES (?, ?, ?, ?)",
+                (file_id, page, start, chunk),
+            ).lastrowid
+            if self.fts:
+                self.db.execute("INSERT INTO chunks_fts(rowid, text) VALUES (?, ?)", (chunk_id, chunk))
+
+            context = ContextIndex(chunk, state)
+            state = context.end_state
+            spans = list(context.math_spans)
+            spans += [(m.start(2), m.end(2)) for m in _EQUATION_ENV_PATTERN.finditer(chunk)]
+            self.db.executemany(
+                "INSERT INTO equations VALUES (?, ?, ?, ?, ?)",
+                [(file_id, page, start + s, chunk[s:e].strip(), normalize_latex(chunk[s:e]))
+                 for s, e in spans if chunk[s:e].strip()],
+            )
+            self.db.executemany(
+                "INSERT INTO headings VALUES (?, ?, ?, ?, ?, ?)",
+                [(file_id, page, start + m.start(1), m.group(1).capitalize(), m.group(2),
+                  (m.group(3) or "").strip())
+                 for m in _HEADING_PATTERN.finditer(chunk)]
+                + [(file_id, page, start + m.start(), m.group(1).capitalize(), None,
+                    (m.group(2) or "").strip())
+                   for m in _TEX_HEADING_PATTERN.finditer(chunk)],
+            )
+
+    def sync(self, cleaned_dir: str) -> tuple[int, int]:
+        """
+        Bring the index up to date with `cleaned_dir` (files are expected at
+        <cleaned_dir>/<source_type>/<name>.md). Returns (indexed, removed).
+        """
+        current = {}
+        for md in Path(cleaned_dir).glob("*/*.md"):
+            current[str(md)] = md
+        known = {path: (fid, size, mtime, sha) for fid, path, size, mtime, sha in
+                 self.db.execute("SELECT id, path, size, mtime_ns, sha256 FROM files")}
+
+        removed = 0
+        for path, (fid, *_) in known.items():
+            if path not in current:
+                self._remove(fid)
+                removed += 1
+
+        indexed = 0
+        for path, md in sorted(current.items()):
+            st = md.stat()
+            if path in known:
+                fid, size, mtime, sha = known[path]
+                if (size, mtime) == (st.st_size, st.st_mtime_ns):
+                    continue
+                if size == st.st_size and hash_file(path) == sha:
+                    self.db.execute("UPDATE files SET mtime_ns = ? WHERE id = ?", (st.st_mtime_ns, fid))
+                    continue
+            self.index_file(path, md.parent.name)
+            indexed += 1
+
+        self.db.commit()
+        return indexed, removed
+
+    # ── queries ──
+
+    def _hit(self, path: str, page, offset: int, **extra) -> dict:
+        return dict({"file": path, "page": page, "offset": offset}, **extra)
+
+    def search_words(self, query: str, limit: int = 20) -> list[dict]:
+        """
+        Chunks containing all words of `query` (FTS5 query syntax, e.g.
+        quoted phrases, is accepted). Each hit points at the first word's
+        first occurrence in the chunk.
+        """
+        words = re.findall(r'\w+', query.lower())
+        if not words:
+            return []
+        if self.fts:
+            fts_query = query if '"' in query else " ".join(f'"{w}"' for w in words)
+            rows = self.db.execute(
+                "SELECT f.path, c.page, c.start, c.text FROM chunks_fts "
+                "JOIN chunks c ON c.id = chunks_fts.rowid JOIN files f ON f.id = c.file_id "
+                "WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?", (fts_query, limit),
+            ).fetchall()
+        else:
+            where = " AND ".join("lower(c.text) LIKE ?" for _ in words)
+            rows = self.db.execute(
+                "SELECT f.path, c.page, c.start, c.text FROM chunks c JOIN files f ON f.id = c.file_id "
+                f"WHERE {where} LIMIT ?", [f"%{w}%" for w in words] + [limit],
+            ).fetchall()
+
+        hits = []
+        for path, page, start, text in rows:
+            m = re.search(rf'\b{re.escape(words[0])}', text, re.IGNORECASE)
+            pos = m.start() if m else 0
+            snippet = " ".join(text[max(0, pos - 80):pos + 120].split())
+            hits.append(self._hit(path, page, start + pos, snippet=snippet))
+        return hits
+
+    def search_equations(self, latex: str, limit: int = 20) -> list[dict]:
+        """Equations whose normalized LaTeX contains the normalized `latex`."""
+        norm = normalize_latex(latex)
+        rows = self.db.execute(
+            "SELECT f.path, e.page, e.offset, e.latex FROM equations e JOIN files f ON f.id = e.file_id "
+            "WHERE instr(e.norm, ?) > 0 ORDER BY f.path, e.offset LIMIT ?", (norm, limit),
+        ).fetchall()
+        return [self._hit(path, page, offset, latex=eq) for path, page, offset, eq in rows]
+
+    def find_headings(self, number: str = None, kind: str = None, title: str = None,
+                      limit: int = 50) -> list[dict]:
+        """Theorem-like headings by number ("2.1"), kind ("Lemma") and/or title substring."""
+        clauses, params = [], []
+        if number:
+            clauses.append("h.number = ?")
+            params.append(number)
+        if kind:
+            clauses.append("h.kind = ?")
+            params.append(kind.capitalize())
+        if title:
+            clauses.append("lower(h.title) LIKE ?")
+            params.append(f"%{title.lower()}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.db.execute(
+            "SELECT f.path, h.page, h.offset, h.kind, h.number, h.title FROM headings h "
+            f"JOIN files f ON f.id = h.file_id {where} ORDER BY f.path, h.offset LIMIT ?",
+            params + [limit],
+        ).fetchall()
+        return [self._hit(path, page, offset, kind=k, number=n, title=t)
+                for path, page, offset, k, n, t in rows]
+
+
+# ─── Scheduling ───────────────────────────────────────────────────────
+
+# Memory assumed for one extraction task: a base, a per-page share for the
+# open document and page buffers, and the Marker models when the task is
+# expected to load them (not with --marker-service, which holds them once)
+JOB_BASE_MB = 300
+JOB_MB_PER_PAGE = 2
+MARKER_MODEL_MB = 4000
+
+# Fixed per-file work assumed on top of extraction (probe, fixes, writes)
+JOB_OVERHEAD_S = 0.2
+
+# Default pages per shard when a long PDF is split across workers
+SHARD_PAGES = 25
+
+
+def job_memory_mb(n_pages: int, marker: bool) -> int:
+    return JOB_BASE_MB + n_pages * JOB_MB_PER_PAGE + (MARKER_MODEL_MB if marker else 0)
+
+
+def estimate_job(
+    file_path: str,
+    source_type: str,
+    file_options: dict,
+    previous: dict = None,
+    marker_shared: bool = False,
+) -> dict:
+    """
+    Predicted cost of one file, for scheduling: {"seconds": work,
+    "pages": the 0-based pages a PDF will extract (None if not known),
+    "marker": whether Marker is expected to run in the worker}.
+
+    A previous report of the same-sized file supplies the page count and
+    the measured work; otherwise the PDF is probed and the routing
+    predictions (see route_backends) give the time for its route.
+    """
+    if Path(file_path).suffix.lower() != '.pdf':
+        return {"seconds": JOB_OVERHEAD_S, "pages": None, "marker": False}
+
+    size_mb = round(os.path.getsize(file_path) / (1024*1024), 2)
+    limit = file_options.get("textbook_page_limit", 50)
+    page_ranges = file_options.get("page_ranges")
+    fallback = file_options.get("fallback", "auto")
+
+    if (previous and previous.get("status") == "OK" and previous.get("file_size_mb") == size_mb
+            and "page_count" in previous and previous.get("profile")):
+        page_count = previous["page_count"]
+        pages = plan_pdf_pages({}, file_path, source_type, None, limit, page_ranges, page_count)
+        pages = clamp_pages(pages, page_count) if pages is not None else list(range(page_count))
+        seconds = previous.get("shards", {}).get("work_s") or previous["profile"]["wall_s"]
+        marker = "marker-pdf" in previous.get("extraction_method", "")
+        return {"seconds": seconds, "pages": pages, "marker": marker and not marker_shared}
+
+    if not PYMUPDF_AVAILABLE:
+        return {"seconds": JOB_OVERHEAD_S + size_mb, "pages": None,
+                "marker": MARKER_AVAILABLE and not marker_shared}
+
+    with PdfProbe(file_path) as probe:
+        pages = plan_pdf_pages({}, file_path, source_type, probe, limit, page_ranges)
+        pages = clamp_pages(pages, probe.page_count) if pages is not None else list(range(probe.page_count))
+        decision = route_backends(probe, len(pages), file_options.get("target_quality", PAGE_ESCALATION_SCORE),
+                                  file_options.get("history"))
+        route = decision["route"] if fallback == "auto" else fallback
+        prediction = decision["predictions"].get(route, decision["predictions"]["fast"])
+        marker = MARKER_AVAILABLE and (route == "document" or (route == "page" and probe.weak_page_fraction > 0))
+    return {"seconds": JOB_OVERHEAD_S + prediction["seconds"], "pages": pages,
+            "marker": marker and not marker_shared}
+
+
+def plan_shards(pages: list[int], workers: int, shard_pages: int = SHARD_PAGES) -> list[list[int]] | None:
+    """
+    Split a long PDF's pages into consecutive shards of at least
+    `shard_pages` pages, at most one per worker. None when it is not worth
+    splitting.
+    """
+    if not pages or shard_pages <= 0 or workers < 2 or len(pages) < 2 * shard_pages:
+        return None
+    count = min(workers, len(pages) // shard_pages)
+    size = -(-len(pages) // count)
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+
+def shard_spool_path(cleaned_dir: str, source_type: str, file_path: str, shard: int) -> Path:
+    return Path(cleaned_dir) / source_type / f"{Path(file_path).stem}.md.shard{shard}.jsonl"
+
+
+def extract_shard(
+    file_path: str,
+    source_type: str,
+    shard: int,
+    pages: list[int],
+    cleaned_dir: str,
+    textbook_page_limit: int = 50,
+    cache: ExtractionCache = None,
+    page_ranges: dict[str, str] = None,
+    fallback: str = "auto",
+    escalate_below: int = PAGE_ESCALATION_SCORE,
+    trace: bool = False,
+    target_quality: int = PAGE_ESCALATION_SCORE,
+    history: BackendHistory = None,
+    backend_deadline: BackendDeadline = None,
+    route_decision: dict = None,
+) -> dict:
+    """
+    Extract one page-range shard of a PDF into a page spool (runs in a
+    worker). The pages are fixed and scored when the shards are stitched,
+    in page order, so the fixer's code/math context carries across shard
+    boundaries (see stitch_shards). Takes process_file's options, plus the
+    document's `route_decision` (see choose_route). Returns the report
+    fields, backend, variant and warnings of the shard.
+    """
+    spool_path = shard_spool_path(cleaned_dir, source_type, file_path, shard)
+    spool_path.parent.mkdir(parents=True, exist_ok=True)
+    profiler = StageProfiler(f"{source_type}/{Path(file_path).name}#{shard}", trace)
+    report = {}
+    warnings = []
+    probe = None
+    try:
+        if PYMUPDF_AVAILABLE:
+            try:
+                with profiler.stage("probe"):
+                    probe = PdfProbe(file_path)
+                report.update(probe.summary())
+            except Exception as e:
+                warnings.append(f"PDF probe failed, backends open the file themselves: {e}")
+        plan_pdf_pages(report, file_path, source_type, probe, textbook_page_limit, page_ranges)
+        with profiler.stage("hash"):
+            file_hash = hash_file(file_path) if cache else None
+        if file_hash:
+            report["content_hash"] = file_hash
+
+        route = choose_route(report, probe, pages, fallback, target_quality, history, cache, file_hash,
+                             route_decision)
+        # No cache on the spool: the shard always hands over its pages
+        spool = PageChannel(None, None, spool_path, pages=pages)
+        try:
+            method, extract_warnings = run_backends(
+                probe or file_path, spool, route, pages, cache, file_hash, escalate_below, profiler,
+                backend_deadline,
+            )
+        finally:
+            spool.close()
+    finally:
+        if probe is not None:
+            probe.close()
+
+    return {"report": report, "method": method, "variant": spool.variant,
+            "warnings": warnings + extract_warnings,
+            "profile": profiler.report(), "trace_events": profiler.events}
+
+
+def _shard_records(spool_path: Path):
+    """
+    The page records of a shard spool from the last extraction attempt on;
+    a reset discarded the attempts before it.
+    """
+    with open(spool_path, 'r', encoding='utf-8') as f:
+        last = 0
+        for n, line in enumerate(f):
+            if line.startswith(('{"start"', '{"reset"')):
+                last = n
+        f.seek(0)
+        for n, line in enumerate(f):
+            if n > last:
+                yield json.loads(line)
+
+
+def stitch_shards(
+    file_path: str,
+    source_type: str,
+    cleaned_dir: str,
+    shards: list[list[int]],
+    results: list,
+    profiler: StageProfiler,
+    started: float,
+    cache: ExtractionCache = None,
+) -> dict:
+    """
+    Assemble a PDF extracted as page-range shards: run the shards' pages,
+    in page order, through one PagePipeline into the cleaned file, so the
+    output is the same as an unsharded run's, and merge their reports.
+    If all shards used the same backend, the fixes cache holds the whole
+    document. `results` holds each shard's extract_shard() result, or an
+    error message if it failed, which fails the file. Shard profiles are
+    folded into `profiler`.
+    """
+    p = Path(file_path)
+    report = {
+        "source_file": file_path,
+        "source_type": source_type,
+        "filename": p.name,
+        "file_size_mb": round(os.path.getsize(file_path) / (1024*1024), 2),
+    }
+    out_path = Path(cleaned_dir) / source_type / f"{p.stem}.md"
+    body_path = out_path.with_name(out_path.name + ".partial")
+    spool_paths = [shard_spool_path(cleaned_dir, source_type, file_path, k) for k in range(len(shards))]
+
+    for result in results:
+        if isinstance(result, dict):
+            profiler.absorb(result["profile"], result["trace_events"])
+    try:
+        errors = [f"pages {format_page_ranges(pages)}: {result}"
+                  for pages, result in zip(shards, results) if not isinstance(result, dict)]
+        if errors:
+            report["status"] = "FAILED"
+            report["error"] = "shard failed: " + "; ".join(errors)
+            return report
+
+        report.update(results[0]["report"])
+        methods = list(dict.fromkeys(r["method"] for r in results))
+        warnings = [w for r in results for w in r["warnings"]]
+        if len(methods) > 1:
+            warnings.append(f"shards used different backends: {', '.join(methods)}")
+        if "backend_route" in report:
+            report["backend_route"]["pages"] = sum(len(pages) for pages in shards)
+            report["backend_route"]["cached"] = all(
+                r["report"].get("backend_route", {}).get("cached") for r in results)
+        report["shards"] = {
+            "pages": [format_page_ranges(pages) for pages in shards],
+            "work_s": round(sum(r["profile"]["wall_s"] for r in results), 3),
+        }
+
+        # Mixed backends have no single cache key; each shard then only
+        # names the backend its pages came from
+        uniform = len({(r["method"], r["variant"]) for r in results}) == 1
+        all_pages = [idx for pages in shards for idx in pages]
+        pipeline = PagePipeline(body_path, cache if uniform else None, report.get("content_hash"),
+                                all_pages, profiler, file_path)
+        try:
+            replaying = False
+            for k, (result, path) in enumerate(zip(results, spool_paths)):
+                if result["method"] != "none" and (k == 0 or not uniform):
+                    replaying = pipeline.begin(result["method"], result["variant"])
+                if replaying:
+                    continue
+                for record in _shard_records(path):
+                    if "page" in record:
+                        pipeline.add(record["page"], record["text"], record.get("source"))
+                    elif "uncacheable" in record:
+                        pipeline.uncacheable()
+            stats = pipeline.finish()
+        except BaseException:
+            pipeline.abort()
+            raise
+        if not apply_pipeline_stats(report, stats, methods[0], warnings):
+            os.unlink(body_path)
+            return report
+
+        with profiler.stage("write_cleaned"):
+            write_cleaned_file(out_path, cleaned_frontmatter(report), body_path=body_path)
+        report["extraction_time_s"] = round(time.time() - started, 1)
+        report["output_file"] = str(out_path)
+        report["output_size_kb"] = round(os.path.getsize(out_path) / 1024, 1)
+        report["status"] = "OK"
+    except Exception as e:
+        report["status"] = "FAILED"
+        report["error"] = str(e)
+        report["traceback"] = traceback.format_exc()
+    finally:
+        for path in spool_paths:
+            if path.exists():
+                os.unlink(path)
+        report["profile"] = profiler.report()
+        if profiler.trace:
+            report["trace_events"] = profiler.events
+
+    return report
+
+
+# ─── Parallel batch execution ──────────────────────────────────────────
+
+def print_file_result(report: dict):
+    """Print the one-line status summary (and warnings) for a finished file."""
+    status = report.get("status", "UNKNOWN")
+    method = report.get("extraction_method", "?")
+    quality = report.get("quality", {}).get("quality_score", "N/A")
+    fixes = report.get("latex_fixes_applied", 0)
+    time_s = report.get("extraction_time_s", "?")
+
+    print(f"  -> {status} | method={method} | quality={quality} | fixes={fixes} | {time_s}s")
+    if report.get("backend_route"):
+        print(f"  route: {report['backend_route']['route']} ({report['backend_route']['reason']})")
+    if report.get("duplicate_of"):
+        duplicate = report["duplicate_of"]
+        print(f"  linked: {duplicate['match']} duplicate of {duplicate['source_file']}")
+    if report.get("images"):
+        images = report["images"]
+        print(f"  images: {images['linked']} linked, {images['stored']} new in store, "
+              f"{images['too_small']} below --image-min-size")
+    if report.get("extraction_warnings"):
+        for w in report["extraction_warnings"]:
+            print(f"  ⚠  {w}")
     print()
 
-    # Scan raw/ directories
-    categories = ["draft", "style", "objective", "reference"]
-    all_files = []
 
-    for cat in categories:
+def crashed_worker_report(file_path: str, source_type: str, error: str) -> dict:
+    """Report for a file whose worker process died before returning."""
+    return {
+        "source_file": file_path,
+        "source_type": source_type,
+        "filename": Path(file_path).name,
+        "status": "FAILED",
+        "error": error,
+    }
+
+
+def process_files_parallel(
+    jobs: list[tuple[str, str]],
+    workers: int,
+    on_report=None,
+    estimates: list[dict] = None,
+    memory_budget_mb: int = 0,
+    shard_pages: int = 0,
+    **file_options,
+) -> list[dict] | None:
+    """
+    Fan process_file out over a process pool. `file_options` are passed to
+    every process_file call.
+
+    Progress is printed as each file finishes, and each report goes to
+    on_report(idx, report) right away; without on_report the reports are
+    returned in the order of `jobs`.
+
+    With `estimates` (see estimate_job), the longest predicted work starts
+    first, and a task starts only while the predicted memory of everything
+    running stays within `memory_budget_mb`. A smaller task that fits may
+    start ahead of a bigger one that doesn't; a task that alone exceeds
+    the budget runs alone. Without a budget there is no memory limit. With
+    `shard_pages`, long PDFs are split into page-range shards (see
+    plan_shards) that share one route and run as separate tasks; their
+    pages are fixed and scored in page order once the last one finishes.
+
+    A worker that dies outright (segfault, OOM kill) breaks the pool. The
+    pool is replaced and every task that was in flight is retried alone in
+    a fresh single-worker pool at the end, so only the task that actually
+    crashes fails.
+    """
+    total = len(jobs)
+    reports = [None] * total if on_report is None else None
+    done = 0
+
+    def finish(idx: int, report: dict):
+        nonlocal done
+        done += 1
+        fpath, cat = jobs[idx]
+        print(f"[{done}/{total}] {cat}/{Path(fpath).name}")
+        print_file_result(report)
+        sys.stdout.flush()
+        if on_report is None:
+            reports[idx] = report
+        else:
+            on_report(idx, report)
+
+    def shard_route(fpath: str, pages: list[int]) -> dict | None:
+        """Route a sharded PDF once, so that all its shards use the same backends."""
+        if file_options.get("fallback", "auto") != "auto" or not PYMUPDF_AVAILABLE:
+            return None
+        report = {}
+        try:
+            with PdfProbe(fpath) as probe:
+                choose_route(report, probe, pages, "auto",
+                             file_options.get("target_quality", PAGE_ESCALATION_SCORE),
+                             file_options.get("history"))
+        except Exception:
+            return None
+        return report.get("backend_route")
+
+    tasks = []
+    sharded = {}
+    for idx, (fpath, cat) in enumerate(jobs):
+        est = estimates[idx] if estimates else {"seconds": 0, "pages": None, "marker": False}
+        shards = plan_shards(est["pages"], workers, shard_pages)
+        if shards is None:
+            n_pages = len(est["pages"]) if est["pages"] else 0
+            tasks.append({"idx": idx, "shard": None, "seconds": est["seconds"],
+                          "memory_mb": job_memory_mb(n_pages, est["marker"])})
+            continue
+        print(f"  Sharding {cat}/{Path(fpath).name}: pages "
+              f"{', '.join(format_page_ranges(pages) for pages in shards)}")
+        sharded[idx] = {"shards": shards, "results": [None] * len(shards), "left": len(shards),
+                        "profiler": None, "started": None, "route": shard_route(fpath, est["pages"])}
+        for k, pages in enumerate(shards):
+            tasks.append({"idx": idx, "shard": k, "pages": pages,
+                          "seconds": est["seconds"] * len(pages) / len(est["pages"]),
+                          "memory_mb": job_memory_mb(len(pages), est["marker"])})
+    pending = sorted(tasks, key=lambda t: t["seconds"], reverse=True)
+
+    def submit(pool: ProcessPoolExecutor, task: dict):
+        fpath, cat = jobs[task["idx"]]
+        if task["shard"] is None:
+            return pool.submit(process_file, fpath, cat, **file_options)
+        state = sharded[task["idx"]]
+        if state["profiler"] is None:
+            state["profiler"] = StageProfiler(f"{cat}/{Path(fpath).name}", file_options.get("trace", False),
+                                              shared_process=True)
+            state["started"] = time.time()
+        return pool.submit(extract_shard, fpath, cat, task["shard"], task["pages"],
+                           route_decision=state["route"], **file_options)
+
+    def complete(task: dict, result):
+        fpath, cat = jobs[task["idx"]]
+        if task["shard"] is None:
+            if not isinstance(result, dict):
+                result = crashed_worker_report(fpath, cat, str(result))
+            finish(task["idx"], result)
+            return
+        state = sharded[task["idx"]]
+        state["results"][task["shard"]] = result if isinstance(result, dict) else str(result)
+        state["left"] -= 1
+        if state["left"] == 0:
+            finish(task["idx"], stitch_shards(fpath, cat, file_options["cleaned_dir"], state["shards"],
+                                              state["results"], state["profiler"], state["started"],
+                                              file_options.get("cache")))
+
+    orphaned = []
+    running = {}  # future -> (task, pool)
+    in_use = 0
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while pending or running:
+            i = 0
+            while i < len(pending) and len(running) < workers:
+                task = pending[i]
+                if running and memory_budget_mb and in_use + task["memory_mb"] > memory_budget_mb:
+                    i += 1
+                    continue
+                pending.pop(i)
+                try:
+                    future = submit(pool, task)
+                except BrokenProcessPool:
+                    pool.shutdown(wait=False)
+                    pool = ProcessPoolExecutor(max_workers=workers)
+                    future = submit(pool, task)
+                running[future] = (task, pool)
+                in_use += task["memory_mb"]
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task, task_pool = running.pop(future)
+                in_use -= task["memory_mb"]
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    orphaned.append(task)
+                    if task_pool is pool:
+                        pool.shutdown(wait=False)
+                        pool = ProcessPoolExecutor(max_workers=workers)
+                    continue
+                except Exception as e:
+                    result = f"{type(e).__name__}: {e}"
+                complete(task, result)
+    finally:
+        pool.shutdown(wait=True)
+
+    for task in sorted(orphaned, key=lambda t: t["seconds"], reverse=True):
+        try:
+            with ProcessPoolExecutor(max_workers=1) as solo:
+                result = submit(solo, task).result()
+        except BrokenProcessPool as e:
+            result = f"worker process crashed: {e}"
+        except Exception as e:
+            result = f"{type(e).__name__}: {e}"
+        complete(task, result)
+
+    return reports
+
+
+# ─── Async staged pipeline ────────────────────────────────────────────
+
+# Pages in flight between the extract and fix/score stages of one file
+STREAM_PAGES = 32
+
+
+def send_page_record(stream, detached, record: dict, poll: float = 1.0):
+    """
+    Put `record` on a page stream, waiting while it is full, unless the
+    fix/score stage has stopped reading it (`detached` is set).
+    """
+    while not detached.is_set():
+        try:
+            stream.put(record, timeout=poll)
+            return
+        except queue.Full:
+            continue
+
+
+class PageChannel:
+    """
+    extract_pdf_pages sink on the extract side of the async orchestrator.
+    Each begin/add/reset is handed to the fix/score stage through `stream`
+    (a bounded manager queue) as the backend produces it, and logged to a
+    JSON-lines spool from which a fix/score task retried after a worker
+    crash replays the file. begin() reports a replay when the fixes cache
+    already holds this output, so no pages are sent. Without a stream the
+    records only go to the spool (see extract_shard).
+    """
+
+    def __init__(self, stream, detached, spool_path: Path, cache: ExtractionCache = None,
+                 file_hash: str = None, pages: list[int] = None):
+        self.stream = stream
+        self.detached = detached
+        self.cache = cache if file_hash else None
+        self.file_hash = file_hash
+        self.pages = pages
+        self.method = None
+        self.variant = None
+        self.spool = open(spool_path, 'w', encoding='utf-8')
+        self._send({"start": True, "pages": pages})
+
+    def _send(self, record: dict):
+        self.spool.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if self.stream is not None:
+            send_page_record(self.stream, self.detached, record)
+
+    def begin(self, method: str, variant: str = None) -> bool:
+        self.method = method
+        self.variant = variant
+        self._send({"begin": method, "variant": variant})
+        if self.cache:
+            key = self.cache.pages_fixes_key(self.file_hash, method, self.pages, variant)
+            return self.cache.has_records("fixes", key)
+        return False
+
+    def add(self, idx: int, text: str, source: str = None):
+        record = {"page": idx, "text": text}
+        if source:
+            record["source"] = source
+        self._send(record)
+
+    def reset(self):
+        self._send({"reset": True})
+
+    def uncacheable(self):
+        self._send({"uncacheable": True})
+
+    def close(self):
+        self.spool.close()
+
+
+def run_extract_stage(job: dict) -> dict:
+    """
+    Extract stage of the async orchestrator (runs in an extract worker):
+    probe the PDF, choose its pages and hand the backend's pages to the
+    fix/score stage through job["stream"] (see PageChannel). Returns the
+    report fields gathered so far plus the committed method and variant.
+    """
+    report = {}
+    profiler = StageProfiler(job["label"], job["trace"])
+    probe = None
+    warnings = []
+    try:
+        if PYMUPDF_AVAILABLE:
+            try:
+                with profiler.stage("probe"):
+                    probe = PdfProbe(job["file_path"], job["size_bytes"])
+                report.update(probe.summary())
+            except Exception as e:
+                warnings.append(f"PDF probe failed, backends open the file themselves: {e}")
+        source = probe or job["file_path"]
+        pages = plan_pdf_pages(report, job["file_path"], job["source_type"], probe,
+                               job["textbook_page_limit"], job["page_ranges"])
+
+        cache, file_hash = job["cache"], job["file_hash"]
+        route = choose_route(report, probe, pages, job["fallback"], job["target_quality"],
+                             job["history"], cache, file_hash)
+        channel = PageChannel(job["stream"], job["detached"], Path(job["spool_path"]),
+                              cache, file_hash, pages)
+        try:
+            method, extract_warnings = run_backends(
+                source, channel, route, pages, cache, file_hash, job["escalate_below"], profiler,
+                job["backend_deadline"],
+            )
+        finally:
+            channel.close()
+        warnings += extract_warnings
+        stage = {"pages": pages, "method": method, "variant": channel.variant}
+    finally:
+        if probe is not None:
+            probe.close()
+
+    return {"report": report, "stage": stage, "warnings": warnings,
+            "profile": profiler.report(), "trace_events": profiler.events}
+
+
+def _streamed_records(stream):
+    """Records from a page stream up to and including the end marker."""
+    while True:
+        record = stream.get()
+        yield record
+        if "end" in record:
+            return
+
+
+def _spooled_records(spool_path: str, stage: dict):
+    """A PageChannel spool's records, closed by an end marker for `stage`."""
+    try:
+        with open(spool_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+    except FileNotFoundError:
+        pass
+    yield {"end": stage}
+
+
+def run_fix_stage(job: dict) -> dict:
+    """
+    Fix/score stage of the async orchestrator (runs in a fix worker): feed
+    a PDF's pages through PagePipeline into job["body_path"] as they arrive
+    on job["stream"] (or, with no stream, from the spool of a finished
+    extraction), or render a .tex file there. The end marker carries the
+    extract stage's result, or None if it failed. Returns the report
+    fields it adds.
+    """
+    report = {}
+    profiler = StageProfiler(job["label"], job["trace"])
+    body_path = Path(job["body_path"])
+
+    if job["ext"] == ".tex":
+        with profiler.stage("tex"):
+            meta = write_tex_body(job["file_path"], body_path, job["cache"])
+        report.update(meta)
+        report["extraction_method"] = "native-tex"
+        return {"report": report, "ok": True,
+                "profile": profiler.report(), "trace_events": profiler.events}
+
+    if job["stream"] is not None:
+        records = _streamed_records(job["stream"])
+    else:
+        records = _spooled_records(job["spool_path"], job["stage"])
+    pipeline = None
+    replaying = False
+    try:
+        for record in records:
+            if "end" in record:
+                stage = record["end"]
+            elif "start" in record:
+                # Once per extraction attempt, with the pages it planned
+                if pipeline is not None:
+                    pipeline.abort()
+                pipeline = PagePipeline(body_path, job["cache"], job["file_hash"],
+                                        record["pages"], profiler, job["file_path"])
+                replaying = False
+            elif "page" in record:
+                if not replaying:
+                    pipeline.add(record["page"], record["text"], record.get("source"))
+            elif "begin" in record:
+                replaying = pipeline.begin(record["begin"], record["variant"])
+            elif "uncacheable" in record:
+                pipeline.uncacheable()
+            else:
+                pipeline.reset()
+                replaying = False
+        if stage is None:
+            if pipeline is not None:
+                pipeline.abort()
+            body_path.unlink(missing_ok=True)
+            return {"report": report, "ok": False,
+                    "profile": profiler.report(), "trace_events": profiler.events}
+        if pipeline is None:
+            pipeline = PagePipeline(body_path, job["cache"], job["file_hash"], stage["pages"],
+                                    profiler, job["file_path"])
+        stats = pipeline.finish()
+    except BaseException:
+        if pipeline is not None:
+            pipeline.abort()
+        raise
+
+    ok = apply_pipeline_stats(report, stats, stage["method"], stage["warnings"])
+    if not ok:
+        os.unlink(body_path)
+    return {"report": report, "ok": ok,
+            "profile": profiler.report(), "trace_events": profiler.events}
+
+
+class RestartingPool:
+    """
+    Process pool for one orchestrator stage that survives worker crashes.
+    A crash breaks the pool for every in-flight task, so the pool is
+    replaced and each affected task is retried alone; only a task that
+    crashes its solo worker too is reported as crashed (BrokenProcessPool).
+    Tasks run in the order they were submitted.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    async def run(self, fn, arg, retry=None):
+        """`retry`, if given, is awaited for the solo retry's argument."""
+        pool = self.pool
+        try:
+            return await asyncio.wrap_future(pool.submit(fn, arg))
+        except BrokenProcessPool:
+            if self.pool is pool:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                pool.shutdown(wait=False)
+        if retry is not None:
+            arg = await retry()
+        solo = ProcessPoolExecutor(max_workers=1)
+        try:
+            return await asyncio.wrap_future(solo.submit(fn, arg))
+        finally:
+            solo.shutdown(wait=False)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+_STAGE_DONE = object()
+
+
+async def run_stage(fn, inbox: asyncio.Queue, outbox: asyncio.Queue, concurrency: int):
+    """
+    Run `concurrency` workers applying coroutine `fn` to items from `inbox`
+    until the end marker arrives, then pass the marker on. Bounded queues
+    give backpressure: a full `outbox` stalls this stage's workers.
+    """
+    async def worker():
+        while (item := await inbox.get()) is not _STAGE_DONE:
+            await outbox.put(await fn(item))
+        await inbox.put(_STAGE_DONE)  # let sibling workers see it
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    await outbox.put(_STAGE_DONE)
+
+
+async def process_files_async(
+    jobs: list[tuple[str, str]],
+    limits: dict[str, int],
+    cleaned_dir: str,
+    textbook_page_limit: int = 50,
+    cache: ExtractionCache = None,
+    page_ranges: dict[str, str] = None,
+    fallback: str = "auto",
+    escalate_below: int = PAGE_ESCALATION_SCORE,
+    trace: bool = False,
+    target_quality: int = PAGE_ESCALATION_SCORE,
+    history: BackendHistory = None,
+    backend_deadline: BackendDeadline = None,
+    on_report=None,
+) -> list[dict] | None:
+    """
+    Run files through a bounded pipeline of stages so the backends never
+    wait on post-processing or disk I/O:
+
+    1. prefetch: stat and hash the file (threads; also warms the OS cache)
+    2. extract: probe + backend extraction (process pool)
+    3. fix/score: regex fixes and quality scoring into the body file
+       (a separate process pool)
+    4. write: frontmatter + body into the cleaned file (threads)
+
+    A PDF's fix/score task is started with its extraction and takes the
+    pages as the backend produces them, through a stream holding at most
+    STREAM_PAGES pages (see PageChannel); both pools run files in the same
+    order, so every extraction's reader gets a worker. `limits` gives each
+    stage's concurrency ("prefetch", "extract", "fix", "write"); the queue
+    in front of a stage holds at most twice its concurrency, so a slow
+    stage stalls the ones upstream instead of letting work pile up. As in
+    process_files_parallel, each report goes to on_report(idx, report)
+    when its file is written, or is returned in the order of `jobs`
+    without on_report.
+    """
+    spool_dir = Path(tempfile.mkdtemp(prefix="extract_spool_"))
+    # Manager queues, unlike multiprocessing.Queue, can be handed to pool workers
+    manager = multiprocessing.Manager()
+    extract_pool = RestartingPool(limits["extract"])
+    fix_pool = RestartingPool(limits["fix"])
+    reports = [None] * len(jobs) if on_report is None else None
+    done = 0
+
+    def fail(item: dict, error: str, tb: str = None):
+        item["report"]["status"] = "FAILED"
+        item["report"]["error"] = error
+        if tb:
+            item["report"]["traceback"] = tb
+
+    async def prefetch(item: dict) -> dict:
+        report = item["report"]
+        if item["ext"] not in (".pdf", ".tex"):
+            report["status"] = "SKIPPED"
+            report["error"] = f"Unsupported file type: {item['ext']}"
+            return item
+        try:
+            with item["profiler"].stage("hash"):
+                item["file_hash"] = await asyncio.to_thread(hash_file, item["file_path"])
+            if cache and item["ext"] == ".pdf":
+                report["content_hash"] = item["file_hash"]
+        except Exception as e:
+            fail(item, str(e), traceback.format_exc())
+        return item
+
+    def stage_job(item: dict) -> dict:
+        return {
+            "label": item["profiler"].label, "trace": trace,
+            "file_path": item["file_path"], "source_type": item["source_type"],
+            "ext": item["ext"], "size_bytes": item["size_bytes"],
+            "cache": cache, "file_hash": item["file_hash"] if cache else None,
+            "textbook_page_limit": textbook_page_limit, "page_ranges": page_ranges,
+            "fallback": fallback, "escalate_below": escalate_below,
+            "target_quality": target_quality, "history": history,
+            "backend_deadline": backend_deadline,
+            "spool_path": str(item["spool_path"]), "body_path": str(item["body_path"]),
+            "stream": item.get("stream"), "detached": item.get("detached"),
+            "stage": item.get("stage"),
+        }
+
+    async def in_pool(item: dict, pool: RestartingPool, fn, retry=None) -> dict:
+        try:
+            result = await pool.run(fn, stage_job(item), retry)
+        except BrokenProcessPool as e:
+            fail(item, f"worker process crashed: {e}")
+            return None
+        except Exception as e:
+            fail(item, str(e), traceback.format_exc())
+            return None
+        item["profiler"].absorb(result["profile"], result["trace_events"])
+        item["report"].update(result["report"])
+        return result
+
+    async def read_spool(item: dict) -> dict:
+        """Solo retry of a crashed fix/score task: replay the spool once extracted."""
+        await asyncio.to_thread(item["detached"].set)
+        await item["extracted"].wait()
+        return dict(stage_job(item), stream=None)
+
+    async def stream_fix(item: dict) -> dict:
+        try:
+            return await in_pool(item, fix_pool, run_fix_stage, retry=lambda: read_spool(item))
+        finally:
+            # A reader that gave up must not leave the extraction blocked on the stream
+            await asyncio.to_thread(item["detached"].set)
+
+    async def extract(item: dict) -> dict:
+        if item["ext"] == ".pdf" and "status" not in item["report"]:
+            print(f"  Extracting: {item['report']['filename']} ({item['report']['file_size_mb']} MB)")
+            item["body_path"].parent.mkdir(parents=True, exist_ok=True)
+            item["stream"] = manager.Queue(STREAM_PAGES)
+            item["detached"] = manager.Event()
+            item["extracted"] = asyncio.Event()
+            item["fixing"] = asyncio.ensure_future(stream_fix(item))
+            try:
+                result = await in_pool(item, extract_pool, run_extract_stage)
+                if result:
+                    item["stage"] = dict(result["stage"], warnings=result["warnings"])
+            finally:
+                await asyncio.to_thread(send_page_record, item["stream"], item["detached"],
+                                        {"end": item.get("stage")})
+                item["extracted"].set()
+        return item
+
+    async def fix(item: dict) -> dict:
+        if "fixing" in item:
+            result = await item.pop("fixing")
+            if result and not result["ok"] and "status" not in item["report"]:
+                item["report"]["status"] = "FAILED"
+        elif "status" not in item["report"]:
+            item["body_path"].parent.mkdir(parents=True, exist_ok=True)
+            result = await in_pool(item, fix_pool, run_fix_stage)
+            if result and not result["ok"]:
+                item["report"]["status"] = "FAILED"
+        if item["spool_path"].exists():
+            item["spool_path"].unlink()
+        return item
+
+    async def write(item: dict) -> dict:
+        report = item["report"]
+        if "status" not in report:
+            try:
+                with item["profiler"].stage("write_cleaned"):
+                    await asyncio.to_thread(
+                        write_cleaned_file, item["out_path"], cleaned_frontmatter(report),
+                        None, item["body_path"],
+                    )
+                report["extraction_time_s"] = round(time.time() - item["start_time"], 1)
+                report["output_file"] = str(item["out_path"])
+                report["output_size_kb"] = round(os.path.getsize(item["out_path"]) / 1024, 1)
+                report["status"] = "OK"
+            except Exception as e:
+                fail(item, str(e), traceback.format_exc())
+        if report.get("status") == "FAILED" and item["body_path"].exists():
+            report["partial_output_file"] = str(item["body_path"])
+
+        nonlocal done
+        done += 1
+        report["profile"] = item["profiler"].report()
+        if trace:
+            report["trace_events"] = item["profiler"].events
+        print(f"[{done}/{len(jobs)}] {item['source_type']}/{report['filename']}")
+        print_file_result(report)
+        sys.stdout.flush()
+        if on_report is None:
+            reports[item["idx"]] = report
+        else:
+            on_report(item["idx"], report)
+        return item
+
+    queues = [asyncio.Queue(maxsize=2 * limits[name]) for name in ("prefetch", "extract", "fix", "write")]
+    queues.append(asyncio.Queue())
+
+    async def feed():
+        for idx, (fpath, cat) in enumerate(jobs):
+            p = Path(fpath)
+            size_bytes = os.path.getsize(fpath)
+            out_path = Path(cleaned_dir) / cat / f"{p.stem}.md"
+            await queues[0].put({
+                "idx": idx, "file_path": fpath, "source_type": cat, "ext": p.suffix.lower(),
+                "size_bytes": size_bytes, "start_time": time.time(),
+                "out_path": out_path, "body_path": out_path.with_name(out_path.name + ".partial"),
+                "spool_path": spool_dir / f"{idx}.jsonl",
+                "profiler": StageProfiler(f"{cat}/{p.name}", trace, shared_process=True),
+                "report": {
+                    "source_file": fpath, "source_type": cat, "filename": p.name,
+                    "file_size_mb": round(size_bytes / (1024*1024), 2),
+                },
+            })
+        await queues[0].put(_STAGE_DONE)
+
+    try:
+        await asyncio.gather(
+            feed(),
+            run_stage(prefetch, queues[0], queues[1], limits["prefetch"]),
+            run_stage(extract, queues[1], queues[2], limits["extract"]),
+            run_stage(fix, queues[2], queues[3], limits["fix"]),
+            run_stage(write, queues[3], queues[4], limits["write"]),
+        )
+    finally:
+        manager.shutdown()  # first, so no worker is left waiting on a stream
+        extract_pool.shutdown()
+        fix_pool.shutdown()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    return reports
+
+
+# ─── Distributed work queue ───────────────────────────────────────────
+
+# A queue directory on a filesystem shared by several hosts:
+#   items/<id>.json    one file to process, with the options and the pipeline
+#                      settings (fix tables, --images) to process it with
+#   leases/<id>.lease  held by the worker processing the item, under a token
+#                      only that claim knows; its mtime is the heartbeat
+#   results/<id>.json  the finished report
+#   clock/             one file per process, touched to read the shared clock
+#   closed             the coordinator is done; idle workers exit
+LEASE_TIMEOUT_S = 120
+QUEUE_POLL_S = 1.0
+# A file whose lease expires this many times (its worker keeps dying) fails
+MAX_LEASE_EXPIRIES = 3
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Work items in a shared directory, claimed through lease files.
+
+    A lease is created with O_EXCL, so exactly one worker gets each item.
+    Its holder touches it every lease_timeout / 4 seconds; the coordinator
+    deletes leases that have not been touched for `lease_timeout` seconds,
+    which puts their items back in the queue. Each claim writes a random
+    token into its lease, and a worker renews or completes an item only
+    while the lease still holds its token, so a worker that stalled past
+    its lease cannot publish over the item's new holder. Lease ages are
+    measured against the shared filesystem's clock, not the local one, so
+    clock skew between hosts does not matter.
+    """
+
+    def __init__(self, path: str, lease_timeout: float = LEASE_TIMEOUT_S):
+        self.path = Path(path)
+        self.lease_timeout = lease_timeout
+        self.items_dir = self.path / "items"
+        self.leases_dir = self.path / "leases"
+        self.results_dir = self.path / "results"
+        self.clock_dir = self.path / "clock"
+        self.closed_path = self.path / "closed"
+
+    def reset(self):
+        """Start a new run: drop every item, lease and result."""
+        for d in (self.items_dir, self.leases_dir, self.results_dir, self.clock_dir):
+            shutil.rmtree(d, ignore_errors=True)
+            d.mkdir(parents=True)
+        if self.closed_path.exists():
+            self.closed_path.unlink()
+
+    def close(self):
+        self.closed_path.touch()
+
+    @property
+    def closed(self) -> bool:
+        return self.closed_path.exists()
+
+    def now(self) -> float:
+        """Current time on the shared filesystem."""
+        self.clock_dir.mkdir(parents=True, exist_ok=True)
+        clock = self.clock_dir / worker_id().replace(":", "-")
+        clock.touch()
+        return clock.stat().st_mtime
+
+    @staticmethod
+    def _write_json(path: Path, value: dict):
+        tmp = path.with_name(f"{path.name}.{worker_id().replace(':', '-')}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def lease_path(self, item_id: str) -> Path:
+        return self.leases_dir / f"{item_id}.lease"
+
+    def result_path(self, item_id: str) -> Path:
+        return self.results_dir / f"{item_id}.json"
+
+    def put(self, item_id: str, item: dict):
+        self._write_json(self.items_dir / f"{item_id}.json", dict(item, id=item_id))
+
+    def claim(self, holder: str) -> dict | None:
+        """
+        Lease the first item that is neither leased nor finished; returns
+        the item with its lease token under "lease", or None.
+        """
+        if not self.items_dir.is_dir():
+            return None
+        finished = {p.stem for p in self.results_dir.glob("*.json")}
+        for item_path in sorted(self.items_dir.glob("*.json")):
+            item_id = item_path.stem
+            if item_id in finished:
+                continue
+            try:
+                fd = os.open(self.lease_path(item_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            token = os.urandom(8).hex()
+            with os.fdopen(fd, 'w') as f:
+                json.dump({"worker": holder, "token": token}, f)
+            if self.result_path(item_id).exists():  # finished while we looked
+                self.release(item_id, token)
+                continue
+            with open(item_path, 'r', encoding='utf-8') as f:
+                return dict(json.load(f), lease=token)
+        return None
+
+    def holds(self, item_id: str, token: str) -> bool:
+        """True while the item's lease is the one taken with `token`."""
+        try:
+            with open(self.lease_path(item_id), 'r', encoding='utf-8') as f:
+                return json.load(f).get("token") == token
+        except (OSError, ValueError):
+            return False
+
+    @contextmanager
+    def heartbeat(self, item_id: str, token: str):
+        """
+        Keep an item's lease alive while the body runs. Renewal stops for
+        good once the lease has expired and is no longer ours.
+        """
+        stop = threading.Event()
+        lease = self.lease_path(item_id)
+
+        def beat():
+            while not stop.wait(self.lease_timeout / 4):
+                if not self.holds(item_id, token):
+                    return
+                try:
+                    os.utime(lease)
+                except FileNotFoundError:
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, item_id: str, token: str):
+        if not self.holds(item_id, token):
+            return
+        try:
+            self.lease_path(item_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def complete(self, item_id: str, report: dict, token: str = None) -> bool:
+        """
+        Publish an item's report. A worker passes its lease token and the
+        report is dropped (returns False) if the lease is no longer its own;
+        the coordinator, failing an item itself, passes none.
+        """
+        if token is not None and not self.holds(item_id, token):
+            return False
+        self._write_json(self.result_path(item_id), report)
+        if token is not None:
+            self.release(item_id, token)
+        return True
+
+    def results(self, prefix: str, seen: set[str]):
+        """Yield (item_id, report) for finished items of a batch not in `seen`."""
+        for path in sorted(self.results_dir.glob(f"{prefix}*.json")):
+            if path.stem in seen:
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                yield path.stem, json.load(f)
+
+    def expire(self) -> list[tuple[str, str]]:
+        """Delete leases whose heartbeat stopped; returns (item_id, worker) for each."""
+        now = self.now()
+        expired = []
+        for lease in self.leases_dir.glob("*.lease"):
+            try:
+                if now - lease.stat().st_mtime <= self.lease_timeout:
+                    continue
+                with open(lease, 'r', encoding='utf-8') as f:
+                    holder = json.load(f).get("worker", "?")
+                lease.unlink()
+            except (OSError, ValueError):
+                continue
+            expired.append((lease.name[:-len(".lease")], holder))
+        return expired
+
+    def remove(self, item_id: str):
+        """Drop a finished item and its result."""
+        for path in (self.items_dir / f"{item_id}.json", self.result_path(item_id)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def queue_settings() -> dict:
+    """
+    Process-wide pipeline settings of the coordinator (the font-artifact
+    table, --images) that its workers must share; see apply_queue_settings.
+    """
+    return {
+        "font_artifacts": dict(FONT_ARTIFACTS),
+        "fix_table_version": fix_table_version(),
+        "image_min_size": IMAGE_STORE.min_size if IMAGE_STORE is not None else None,
+    }
+
+
+def apply_queue_settings(settings: dict, cleaned_dir: str):
+    """
+    Make this worker process run with a work item's pipeline settings.
+    Raises RuntimeError if its fix tables still differ from the
+    coordinator's (a different version of this script).
+    """
+    global _ARTIFACT_TABLE
+    if FONT_ARTIFACTS != settings["font_artifacts"]:
+        FONT_ARTIFACTS.clear()
+        FONT_ARTIFACTS.update(settings["font_artifacts"])
+        _ARTIFACT_TABLE = ArtifactTable(FONT_ARTIFACTS)
+    if fix_table_version() != settings["fix_table_version"]:
+        raise RuntimeError("this worker's regex fix tables differ from the coordinator's; "
+                           "run the same version of extract_pdfs.py on every host")
+
+    min_size = settings["image_min_size"]
+    if min_size is None:
+        disable_images()
+    elif (IMAGE_STORE is None or IMAGE_STORE.min_size != min_size
+          or IMAGE_STORE.root.resolve() != (Path(cleaned_dir) / IMAGE_STORE_DIR).resolve()):
+        configure_images(cleaned_dir, min_size)
+
+
+def queue_options(file_options: dict) -> dict:
+    """The process_file options of a run, as stored in its work items."""
+    deadline = file_options.get("backend_deadline")
+    history = file_options.get("history")
+    return {
+        "cleaned_dir": file_options["cleaned_dir"],
+        "textbook_page_limit": file_options.get("textbook_page_limit", 50),
+        "page_ranges": file_options.get("page_ranges"),
+        "fallback": file_options.get("fallback", "auto"),
+        "escalate_below": file_options.get("escalate_below", PAGE_ESCALATION_SCORE),
+        "target_quality": file_options.get("target_quality", PAGE_ESCALATION_SCORE),
+        "trace": file_options.get("trace", False),
+        "backend_deadline": [deadline.seconds, deadline.per_page] if deadline else None,
+        "backend_history": history.path if history else None,
+    }
+
+
+def process_files_queue(
+    jobs: list[tuple[str, str]],
+    queue: WorkQueue,
+    on_report=None,
+    **file_options,
+) -> list[dict] | None:
+    """
+    Coordinator side of a distributed run: put `jobs` in the work queue, in
+    order (longest predicted first when the caller sorted them), and wait
+    while workers on any host (run_queue_worker) process them. As in
+    process_files_parallel, each report goes to on_report(idx, report) as
+    it arrives, or is returned in the order of `jobs` without on_report.
+
+    Expired leases are re-queued; a file whose lease expires
+    MAX_LEASE_EXPIRIES times is reported as FAILED. Item ids carry a
+    per-batch prefix, so a late report from a worker whose lease expired
+    in an earlier batch (--watch) is never taken for a current one.
+    """
+    total = len(jobs)
+    reports = [None] * total if on_report is None else None
+    options = queue_options(file_options)
+    batch = f"{time.time_ns():x}-"
+    ids = {f"{batch}{idx:06d}": idx for idx in range(total)}
+    settings = queue_settings()
+    for item_id, (fpath, cat) in zip(ids, jobs):
+        queue.put(item_id, {"file_path": fpath, "source_type": cat, "options": options,
+                            "settings": settings})
+
+    seen = set()
+    expiries = {}
+
+    def finish(item_id: str, report: dict):
+        idx = ids[item_id]
+        seen.add(item_id)
+        fpath, cat = jobs[idx]
+        print(f"[{len(seen)}/{total}] {cat}/{Path(fpath).name}"
+              + (f" ({report['worker']})" if report.get("worker") else ""))
+        print_file_result(report)
+        sys.stdout.flush()
+        if on_report is None:
+            reports[idx] = report
+        else:
+            on_report(idx, report)
+
+    while len(seen) < total:
+        for item_id, report in queue.results(batch, seen):
+            finish(item_id, report)
+        for item_id, holder in queue.expire():
+            if not item_id.startswith(batch) or item_id in seen or queue.result_path(item_id).exists():
+                continue
+            fpath, cat = jobs[ids[item_id]]
+            expiries[item_id] = expiries.get(item_id, 0) + 1
+            if expiries[item_id] >= MAX_LEASE_EXPIRIES:
+                queue.complete(item_id, crashed_worker_report(
+                    fpath, cat, f"lease expired {expiries[item_id]} times (last held by {holder})"))
+            else:
+                print(f"  Re-queued {cat}/{Path(fpath).name}: lease of {holder} expired")
+        if len(seen) < total:
+            time.sleep(QUEUE_POLL_S)
+
+    for item_id in ids:
+        queue.remove(item_id)
+    return reports
+
+
+def run_queue_worker(queue: WorkQueue, cache: ExtractionCache = None,
+                     marker_batch_pages: int = None) -> int:
+    """
+    Worker side of a distributed run (--worker): claim items, process them
+    with the options and pipeline settings the coordinator stored in them,
+    and write the reports back, until the coordinator closes the queue. Run
+    from the project directory, so the relative raw/ and cleaned/ paths in
+    the items resolve to the shared copies. With `marker_batch_pages`, a
+    Marker service is run for the worker's extractions; it is (re)started
+    once the item settings are in place, since it inherits them on start.
+    """
+    holder = worker_id()
+    print(f"Worker {holder} on {queue.path}; waiting for work\n")
+    sys.stdout.flush()
+    processed = 0
+    marker_service = None
+    service_settings = None
+    try:
+        while True:
+            item = queue.claim(holder)
+            if item is None:
+                if queue.closed:
+                    break
+                time.sleep(QUEUE_POLL_S)
+                continue
+
+            options = dict(item["options"])
+            deadline = options.pop("backend_deadline")
+            history = options.pop("backend_history")
+            print(f"[{processed + 1}] {item['source_type']}/{Path(item['file_path']).name}")
+            with queue.heartbeat(item["id"], item["lease"]):
+                try:
+                    apply_queue_settings(item["settings"], options["cleaned_dir"])
+                except RuntimeError as e:
+                    report = crashed_worker_report(item["file_path"], item["source_type"], str(e))
+                else:
+                    if (marker_batch_pages and MARKER_AVAILABLE
+                            and service_settings != os.environ.get(IMAGES_ENV)):
+                        if marker_service:
+                            marker_service.stop()
+                        marker_service = MarkerService(batch_pages=marker_batch_pages).start()
+                        service_settings = os.environ.get(IMAGES_ENV)
+                    report = process_file(
+                        item["file_path"], item["source_type"], cache=cache,
+                        backend_deadline=BackendDeadline(*deadline) if deadline else None,
+                        history=BackendHistory(history) if history else None,
+                        **options,
+                    )
+            report["worker"] = holder
+            if not queue.complete(item["id"], report, item["lease"]):
+                print("  Lease expired while processing; result dropped (the file was re-queued)")
+            print_file_result(report)
+            sys.stdout.flush()
+            processed += 1
+    finally:
+        if marker_service:
+            marker_service.stop()
+
+    print(f"Queue closed; worker {holder} processed {processed} file(s)")
+    return 0
+
+
+# ─── Batch runs and watch mode ────────────────────────────────────────
+
+RAW_CATEGORIES = ["draft", "style", "objective", "reference"]
+
+# inotify events that can mean a source appeared, changed or went away
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+                | IN_CREATE | IN_DELETE)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def scan_raw(raw_dir: Path, warn: bool = True) -> list[tuple[str, str]]:
+    """(path, category) of every .pdf/.tex source under the raw/ category directories."""
+    all_files = []
+    for cat in RAW_CATEGORIES:
         cat_dir = raw_dir / cat
         if not cat_dir.exists():
-            print(f"  Warning: {cat_dir} does not exist, skipping")
+            if warn:
+                print(f"  Warning: {cat_dir} does not exist, skipping")
             continue
 
         for f in sorted(cat_dir.iterdir()):
             if f.suffix.lower() in ('.pdf', '.tex'):
                 all_files.append((str(f), cat))
+    return all_files
 
-    print(f"Found {len(all_files)} files to process:")
-    for cat in categories:
-        count = sum(1 for _, c in all_files if c == cat)
-        if count > 0:
-            print(f"  {cat}: {count} files")
-    print()
+
+class SettingsCache:
+    """
+    pipeline_settings() of each source, kept between --watch batches. An
+    entry is recomputed when its source is among the changed paths or, for
+    .tex, when the size or mtime of one of its included files moved.
+    """
+
+    def __init__(self):
+        self.entries = {}  # path -> (settings, {included file: stat})
+
+    @staticmethod
+    def _stamps(settings: dict) -> dict:
+        return {path: _stat_or_none(path) for path in settings.get("included", {})}
+
+    def get(self, file_path: str, source_type: str, file_options: dict,
+            changed: set[str] = None) -> dict:
+        entry = self.entries.get(file_path)
+        if (entry is None or changed is None or file_path in changed
+                or entry[1] != self._stamps(entry[0])):
+            settings = pipeline_settings(file_path, source_type, file_options)
+            entry = self.entries[file_path] = (settings, self._stamps(settings))
+        # Callers annotate the settings (duplicate_of), so hand out a copy
+        return json.loads(json.dumps(entry[0]))
+
+    def retain(self, paths: set[str]):
+        for path in [p for p in self.entries if p not in paths]:
+            del self.entries[path]
+
+
+def run_batch(args, file_options: dict, services: dict, hold: set[str] = frozenset(),
+              watching: bool = False, settings_cache: SettingsCache = None,
+              changed: set[str] = None) -> int:
+    """
+    Scan raw/, process what needs processing and write the reports, the
+    manifest, the search index and the summary; returns main()'s exit
+    status. Files in `hold` (still being copied, in --watch mode) are left
+    for a later batch. A Marker service started for the batch is kept in
+    `services` for the caller to stop. With `watching`, the per-batch
+    banners are replaced by a one-line summary. With a `settings_cache`,
+    pipeline settings are only recomputed for the `changed` paths (all of
+    them when `changed` is None).
+    """
+    cleaned_dir = Path(file_options["cleaned_dir"])
+    cache = file_options["cache"]
+    history = file_options["history"]
+
+    all_files = scan_raw(Path(args.raw_dir), warn=not watching)
+    if not watching:
+        print(f"Found {len(all_files)} files to process:")
+        for cat in RAW_CATEGORIES:
+            count = sum(1 for _, c in all_files if c == cat)
+            if count > 0:
+                print(f"  {cat}: {count} files")
+        print()
 
     # Process each file
-    reports = []
     total = len(all_files)
+    manifest = load_manifest(args.manifest)
+    if settings_cache is None:
+        settings = [pipeline_settings(fpath, cat, file_options) for fpath, cat in all_files]
+    else:
+        settings = [settings_cache.get(fpath, cat, file_options, changed) for fpath, cat in all_files]
+        settings_cache.retain({fpath for fpath, _ in all_files})
+
+    # Copies of the same source are extracted once; the others are linked
+    duplicates = {}
+    if not args.no_dedup:
+        signatures = SourceSignatures(str(Path(args.manifest).with_name("source_signatures.json")))
+        duplicates = find_duplicates(all_files, settings, signatures, args.dedup_threshold)
+        signatures.save()
+        if duplicates and not watching:
+            print(f"Duplicates: {len(duplicates)} file(s) will be linked to an extracted copy")
+        for idx, duplicate in duplicates.items():
+            settings[idx]["duplicate_of"] = duplicate["source_file"]
+            if watching:
+                continue
+            (fpath, cat), (canonical, canonical_cat) = all_files[idx], all_files[duplicate["index"]]
+            match = "exact" if duplicate["match"] == "exact" else f"near, {duplicate['similarity']}"
+            print(f"  {cat}/{Path(fpath).name} = {canonical_cat}/{Path(canonical).name} ({match})")
+        if duplicates and not watching:
+            print()
+
+    if args.incremental:
+        todo, reused, reasons = plan_incremental(all_files, manifest, settings)
+        todo = [idx for idx in todo if all_files[idx][0] not in hold]
+        pruned = prune_deleted_sources(manifest, {fpath for fpath, _ in all_files})
+        if not watching:
+            print(f"Incremental: {len(reused)} unchanged, {len(todo)} to process "
+                  f"({', '.join(f'{v} {k}' for k, v in reasons.items() if v) or 'nothing new'})")
+        for out in pruned:
+            print(f"  Pruned output of deleted source: {out}")
+        if not watching:
+            print()
+    else:
+        todo, reused = list(range(total)), {}
+        manifest["files"] = {}
+
+    # A duplicate is relinked whenever its canonical copy is reprocessed
+    planned = set(todo)
+    for idx, duplicate in duplicates.items():
+        if duplicate["index"] in planned and idx not in planned:
+            todo.append(idx)
+            reused.pop(idx)
+    linked = sorted(idx for idx in todo if idx in duplicates)
+    todo = [idx for idx in todo if idx not in duplicates]
+    jobs = [all_files[i] for i in todo]
+
+    reports_file = args.reports_file or str(Path(args.quality_file).with_name("extraction_reports.jsonl"))
+    store = ReportStore(reports_file)
+    current = {fpath for fpath, _ in all_files}
+    for source_file in [src for src in store.records if src not in current]:
+        store.discard(source_file)
+
+    # Longest predicted work first; the previous run's reports give past timings
+    estimates = None
+    queue = services.get("queue")
+    if (args.workers > 1 or queue is not None) and len(jobs) > 1:
+        estimates = [estimate_job(fpath, cat, file_options, store.get(fpath), args.marker_service)
+                     for fpath, cat in jobs]
+        order = sorted(range(len(jobs)), key=lambda i: estimates[i]["seconds"], reverse=True)
+        jobs = [jobs[i] for i in order]
+        todo = [todo[i] for i in order]
+        estimates = [estimates[i] for i in order]
+        work = sum(e["seconds"] for e in estimates)
+        if queue is not None:
+            print(f"Schedule: {work:.1f}s of predicted work (longest first)\n")
+        else:
+            print(f"Schedule: {work:.1f}s of predicted work, ~{work / args.workers:.1f}s "
+                  f"on {args.workers} workers (longest first)\n")
 
-    for i, (fpath, cat) in enumerate(all_files, 1):
-        fname = Path(fpath).name
-        print(f"[{i}/{total}] {cat}/{fname}")
+    totals = ReportSummary()
+    profiles = ProfileAggregate()
+    events = []
+    for idx, report in reused.items():
+        if all_files[idx][0] not in store:
+            store.append(report)
+        totals.add(report, idx)
 
-        report = process_file(fpath, cat, str(cleaned_dir), args.textbook_page_limit)
-        reports.append(report)
+    def record_file(idx: int, report: dict):
+        events.extend(report.pop("trace_events", []))
+        store.append(report)
+        totals.add(report, idx)
+        profiles.add(report)
+        if history is not None:
+            history.add_report(report)
+        fpath, _ = all_files[idx]
+        if os.path.exists(fpath):
+            manifest["files"][fpath] = manifest_entry(fpath, settings[idx], report)
 
-        status = report.get("status", "UNKNOWN")
-        method = report.get("extraction_method", "?")
-        quality = report.get("quality", {}).get("quality_score", "N/A")
-        fixes = report.get("latex_fixes_applied", 0)
-        time_s = report.get("extraction_time_s", "?")
+    def record(job_idx: int, report: dict):
+        record_file(todo[job_idx], report)
 
-        print(f"  -> {status} | method={method} | quality={quality} | fixes={fixes} | {time_s}s")
-        if report.get("extraction_warnings"):
-            for w in report["extraction_warnings"]:
-                print(f"  ⚠  {w}")
+    if (args.marker_service and MARKER_AVAILABLE and jobs and queue is None
+            and services.get("marker_service") is None):
+        print(f"Starting Marker service (batches of up to {args.marker_batch_pages} pages)...")
+        services["marker_service"] = MarkerService(batch_pages=args.marker_batch_pages).start()
         print()
+    elif args.marker_service and not MARKER_AVAILABLE and not watching:
+        print("  Warning: --marker-service ignored, Marker-PDF is not available\n")
+
+    try:
+        if args.async_pipeline and jobs:
+            limits = {"prefetch": args.prefetch, "extract": args.workers,
+                      "fix": args.fix_workers, "write": args.writers}
+            print(f"Processing with the async pipeline (concurrency {limits})\n")
+            asyncio.run(process_files_async(jobs, limits, on_report=record, **file_options))
+        elif queue is not None and jobs:
+            print(f"Queued {len(jobs)} file(s) in {queue.path} for --worker processes\n")
+            sys.stdout.flush()
+            process_files_queue(jobs, queue, on_report=record, **file_options)
+        elif args.workers > 1 and len(jobs) > 1:
+            print(f"Processing with {args.workers} worker processes\n")
+            process_files_parallel(jobs, args.workers, on_report=record, estimates=estimates,
+                                   memory_budget_mb=args.memory_budget, shard_pages=args.shard_pages,
+                                   **file_options)
+        else:
+            for i, (fpath, cat) in enumerate(jobs):
+                fname = Path(fpath).name
+                print(f"[{i + 1}/{len(jobs)}] {cat}/{fname}")
+
+                report = process_file(fpath, cat, **file_options)
+                print_file_result(report)
+                record(i, report)
+
+        # Duplicates are written from their canonical copy's output, or
+        # extracted after all if that copy failed
+        for i, idx in enumerate(linked):
+            fpath, cat = all_files[idx]
+            duplicate = duplicates[idx]
+            print(f"[link {i + 1}/{len(linked)}] {cat}/{Path(fpath).name}")
+            canonical = store.get(duplicate["source_file"])
+            report = None
+            if canonical and canonical.get("status") == "OK":
+                try:
+                    report = link_duplicate(fpath, cat, str(cleaned_dir), canonical, duplicate)
+                except OSError as e:
+                    print(f"  Warning: could not link to {duplicate['source_file']}: {e}")
+            if report is None:
+                report = process_file(fpath, cat, **file_options)
+            print_file_result(report)
+            record_file(idx, report)
+    finally:
+        store.close()
+    save_manifest(args.manifest, manifest)
+    if history is not None:
+        history.save()
+
+    if args.trace:
+        write_trace(args.trace, events)
+        print(f"Wrote {len(events)} trace events to {args.trace}\n")
 
-    # Write quality report
-    os.makedirs(os.path.dirname(args.quality_file), exist_ok=True)
+    if not args.no_index:
+        with CleanedIndex(args.index) as index:
+            indexed, unindexed = index.sync(str(cleaned_dir))
+        print(f"Search index {args.index}: {indexed} file(s) indexed, {unindexed} removed\n")
 
+    if cache:
+        evicted = cache.evict()
+        if evicted:
+            print(f"Evicted {evicted} least-recently-used cache entries\n")
+
+    # Write the summary; per-file reports are in the report store
     summary = {
         "extraction_date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "backends": {
@@ -582,33 +5441,36 @@ def main():
             "pymupdf4llm": PYMUPDF4LLM_AVAILABLE,
             "pymupdf_raw": PYMUPDF_AVAILABLE,
         },
-        "total_files": total,
-        "successful": sum(1 for r in reports if r.get("status") == "OK"),
-        "failed": sum(1 for r in reports if r.get("status") == "FAILED"),
-        "skipped": sum(1 for r in reports if r.get("status") == "SKIPPED"),
-        "total_pages": sum(r.get("page_count", 0) for r in reports),
-        "total_words": sum(r.get("raw_word_count", 0) for r in reports),
-        "methods_used": {},
-        "quality_distribution": {
-            "excellent_90_100": sum(1 for r in reports if r.get("quality", {}).get("quality_score", 0) >= 90),
-            "good_70_89": sum(1 for r in reports if 70 <= r.get("quality", {}).get("quality_score", 0) < 90),
-            "fair_50_69": sum(1 for r in reports if 50 <= r.get("quality", {}).get("quality_score", 0) < 70),
-            "poor_below_50": sum(1 for r in reports if 0 < r.get("quality", {}).get("quality_score", 0) < 50),
-        },
-        "files_needing_review": [
-            r["filename"] for r in reports
-            if r.get("quality", {}).get("quality_score", 100) < 80
+        **totals.result(),
+        "profile": profiles.result(),
+        "reports_file": reports_file,
+        "reports_index": str(store.index_path),
+        "duplicates": [
+            {"source_file": all_files[idx][0], "duplicate_of": d["source_file"],
+             "match": d["match"], "similarity": d["similarity"]}
+            for idx, d in duplicates.items()
         ],
-        "per_file_reports": reports,
     }
+    if args.incremental:
+        summary["incremental"] = {
+            "manifest": args.manifest,
+            "unchanged": len(reused),
+            "processed": len(todo),
+            "linked": len(linked),
+            "reasons": reasons,
+            "pruned_outputs": pruned,
+        }
 
-    # Count methods
-    for r in reports:
-        m = r.get("extraction_method", "unknown")
-        summary["methods_used"][m] = summary["methods_used"].get(m, 0) + 1
-
-    with open(args.quality_file, 'w', encoding='utf-8') as f:
+    os.makedirs(os.path.dirname(args.quality_file) or ".", exist_ok=True)
+    tmp = f"{args.quality_file}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
         json.dump(summary, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, args.quality_file)
+
+    if watching:
+        print(f"Updated {args.quality_file}: {summary['successful']}/{summary['total_files']} OK, "
+              f"{len(todo)} extracted, {len(linked)} linked\n")
+        return 0 if summary["failed"] == 0 else 1
 
     # Print summary
     print("=" * 60)
@@ -621,7 +5483,14 @@ def main():
     print(f"  Total pages:   {summary['total_pages']}")
     print(f"  Total words:   {summary['total_words']}")
     print(f"  Methods used:  {summary['methods_used']}")
+    if "images" in summary:
+        print(f"  Images:        {summary['images']['linked']} linked, "
+              f"{summary['images']['stored']} new in {cleaned_dir / IMAGE_STORE_DIR}")
+    slow_stages = list(summary["profile"]["stages"].items())[:3]
+    if slow_stages:
+        print("  Slowest stages: " + ", ".join(f"{name} {s['wall_s']}s" for name, s in slow_stages))
     print(f"  Quality file:  {args.quality_file}")
+    print(f"  Reports:       {reports_file}")
 
     if summary["files_needing_review"]:
         print(f"\n  Files needing manual review (quality < 80):")
@@ -632,5 +5501,364 @@ def main():
     return 0 if summary["failed"] == 0 else 1
 
 
+class SourceWatcher:
+    """
+    Paths that changed in the `subdirs` of `root`: inotify on Linux,
+    otherwise (or if inotify cannot be set up) a comparison of directory
+    listings every `poll_interval` seconds. `root` itself is watched too, so
+    a subdirectory created later is picked up, with what it already holds.
+    """
+
+    def __init__(self, root: Path, subdirs: list[str], poll_interval: float = 2.0):
+        self.root = root
+        self.subdirs = subdirs
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.watches = {}
+        if sys.platform.startswith("linux"):
+            try:
+                self._start_inotify()
+            except (OSError, AttributeError):
+                if self.fd is not None:
+                    os.close(self.fd)
+                self.fd = None
+                self.watches = {}
+        self.snapshot = self._listing() if self.fd is None else None
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.fd is not None else f"polling every {self.poll_interval:g}s"
+
+    def _start_inotify(self):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self.fd = None
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._add_watch(self.root)
+        for d in self._dirs():
+            self._add_watch(d)
+
+    def _add_watch(self, d: Path):
+        import ctypes
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), INOTIFY_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"cannot watch {d}")
+        self.watches[wd] = d
+
+    def _dirs(self) -> list[Path]:
+        return [self.root / name for name in self.subdirs if (self.root / name).is_dir()]
+
+    def _listing(self, dirs: list[Path] = None) -> dict[str, tuple[int, int]]:
+        listing = {}
+        for d in self._dirs() if dirs is None else dirs:
+            try:
+                entries = list(os.scandir(d))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                listing[str(d / entry.name)] = (st.st_size, st.st_mtime_ns)
+        return listing
+
+    def wait(self, timeout: float = None) -> set[str]:
+        """Block up to `timeout` seconds (None = until something happens); return changed paths."""
+        if self.fd is None:
+            time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+            listing = self._listing()
+            changed = {p for p in listing.keys() | self.snapshot.keys()
+                       if listing.get(p) != self.snapshot.get(p)}
+            self.snapshot = listing
+            return changed
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, pos)
+            pos += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b"\0"))
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self._listing())
+            elif mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif not name or wd not in self.watches:
+                continue
+            elif self.watches[wd] != self.root:
+                changed.add(str(self.watches[wd] / name))
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and name in self.subdirs:
+                # Files can land in a new directory before its watch is added
+                new_dir = self.root / name
+                try:
+                    self._add_watch(new_dir)
+                except OSError:
+                    continue
+                changed.update(self._listing([new_dir]))
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _stat_or_none(path: str) -> dict | None:
+    try:
+        return source_stat(path)
+    except OSError:
+        return None
+
+
+def watch_raw(args, file_options: dict, services: dict, watcher: SourceWatcher,
+              settings_cache: SettingsCache) -> int:
+    """
+    --watch: stay resident and run an incremental batch (see run_batch)
+    whenever `watcher` sees sources in raw/ appear, change or be deleted.
+    The watcher is started before the first batch, so nothing added
+    meanwhile is missed. A source counts as settled once its size and
+    mtime have not changed for --settle seconds; sources still being
+    copied are held back for a later batch. Everything runs in this
+    process, so backends and models loaded for earlier files stay warm.
+    Stops on Ctrl-C or SIGTERM; returns the worst status of the batches.
+    """
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    print(f"Watching {args.raw_dir} ({watcher.mode}); press Ctrl-C to stop\n")
+    sys.stdout.flush()
+    pending = {}  # path -> (stat when last seen changing, monotonic time of that change)
+    status = 0
+    try:
+        while True:
+            timeout = None
+            if pending:
+                first = min(changed_at for _, changed_at in pending.values())
+                timeout = max(0.0, first + args.settle - time.monotonic())
+            for path in watcher.wait(timeout):
+                if Path(path).suffix.lower() in ('.pdf', '.tex'):
+                    pending[path] = (_stat_or_none(path), time.monotonic())
+
+            now = time.monotonic()
+            settled = []
+            for path, (stat, changed_at) in list(pending.items()):
+                if now - changed_at < args.settle:
+                    continue
+                current = _stat_or_none(path)
+                if current != stat:
+                    pending[path] = (current, now)
+                else:
+                    settled.append(path)
+                    del pending[path]
+            if settled:
+                print(f"Changed: {', '.join(sorted(settled))}")
+                status = max(status, run_batch(args, file_options, services, hold=set(pending),
+                                               watching=True, settings_cache=settings_cache,
+                                               changed=set(settled)))
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+    finally:
+        watcher.close()
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract PDFs using Marker-PDF pipeline")
+    parser.add_argument("--raw-dir", default="raw/", help="Raw input directory")
+    parser.add_argument("--cleaned-dir", default="cleaned/", help="Cleaned output directory")
+    parser.add_argument("--quality-file", default="workspace/extraction_quality.json",
+                        help="Summary quality report output")
+    parser.add_argument("--reports-file",
+                        help="Per-file reports as JSON lines, appended as each file finishes "
+                             "(default: extraction_reports.jsonl next to --quality-file)")
+    parser.add_argument("--textbook-page-limit", type=int, default=50, help="Max pages for textbooks")
+    parser.add_argument("--page-ranges", action="append", metavar="FILE=RANGES",
+                        help="Extract only these 1-based pages of a PDF, e.g. "
+                             "'reference/book.pdf=1-40,120-160' (repeatable; overrides the textbook limit)")
+    parser.add_argument("--fallback", choices=["auto", "page", "document"], default="auto",
+                        help="auto: per PDF, the cheapest of fast-only/page/document predicted to "
+                             "reach --target-quality; page: fast backends first, weak pages "
+                             "re-extracted with Marker; document: Marker first, whole-document fallback")
+    parser.add_argument("--target-quality", type=int, default=PAGE_ESCALATION_SCORE,
+                        help="Quality score --fallback auto aims for")
+    parser.add_argument("--backend-history", default="workspace/backend_history.json",
+                        help="Per-document-class backend scores and timings learned by --fallback auto")
+    parser.add_argument("--escalate-below", type=int, default=PAGE_ESCALATION_SCORE,
+                        help="Page quality score below which --fallback page escalates to Marker")
+    parser.add_argument("--backend-timeout", type=float, default=0, metavar="SECONDS",
+                        help="Kill a backend attempt that runs longer than this and fall back to the "
+                             "next backend; backends then run in a supervised process (0 = no limit)")
+    parser.add_argument("--backend-timeout-per-page", type=float, default=0, metavar="SECONDS",
+                        help="Extra --backend-timeout seconds per page being extracted")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process new, changed or invalidated files (see --manifest)")
+    parser.add_argument("--manifest", default="workspace/extraction_manifest.json",
+                        help="Per-file record of sources, settings and reports used by --incremental")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Extract every copy of duplicate sources instead of linking them to one "
+                             "(signatures are kept in source_signatures.json next to --manifest)")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Estimated text similarity of the first pages above which two PDFs "
+                             "count as near-duplicates")
+    parser.add_argument("--images", action="store_true",
+                        help="Store figures in a content-addressed store in <cleaned-dir>/_images/ "
+                             "(each image once across the corpus) and link them from the pages")
+    parser.add_argument("--image-min-size", type=int, default=IMAGE_MIN_SIZE, metavar="PIXELS",
+                        help="With --images, skip images narrower or shorter than this")
+    parser.add_argument("--font-artifacts", metavar="FILE",
+                        help="YAML/JSON mapping of extra font-encoding artifacts to their replacements")
+    parser.add_argument("--index", default="workspace/cleaned_index.sqlite",
+                        help="Search index over the cleaned markdown, updated after each run "
+                             "(query with scripts/search_cleaned.py)")
+    parser.add_argument("--no-index", action="store_true", help="Do not update the search index")
+    parser.add_argument("--watch", action="store_true",
+                        help="After the first run, keep running and process sources as they are added "
+                             "to, changed in or deleted from raw/ (implies --incremental)")
+    parser.add_argument("--settle", type=float, default=2.0, metavar="SECONDS",
+                        help="With --watch, how long a source must stay unchanged before it is processed")
+    parser.add_argument("--poll-interval", type=float, default=2.0, metavar="SECONDS",
+                        help="With --watch, how often to rescan raw/ where inotify is not available")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Write per-stage trace events: JSON lines for *.jsonl, "
+                             "otherwise Chrome trace format (chrome://tracing, Perfetto)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (1 = sequential); with --async-pipeline, "
+                             "the number of concurrent extractions")
+    parser.add_argument("--memory-budget", type=int, default=0, metavar="MB",
+                        help="Cap on the predicted memory of concurrently running extractions "
+                             "with --workers > 1, without --async-pipeline (0 = no cap)")
+    parser.add_argument("--shard-pages", type=int, default=SHARD_PAGES,
+                        help="With --workers > 1 and without --async-pipeline, split PDFs with at least "
+                             "twice this many pages to extract into page-range shards run in parallel "
+                             "(0 = never)")
+    parser.add_argument("--coordinator", metavar="QUEUE_DIR",
+                        help="Hand files out through a work queue in QUEUE_DIR (on a filesystem "
+                             "shared with the workers) instead of extracting them here")
+    parser.add_argument("--worker", metavar="QUEUE_DIR",
+                        help="Process files from the --coordinator queue in QUEUE_DIR until the "
+                             "coordinator finishes; run from the same project directory")
+    parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT_S, metavar="SECONDS",
+                        help="Re-queue a file whose worker has not sent a heartbeat for this long")
+    parser.add_argument("--async-pipeline", action="store_true",
+                        help="Overlap prefetch, extraction, fix/score and writes in a staged pipeline")
+    parser.add_argument("--fix-workers", type=int, default=1,
+                        help="Fix/score worker processes for --async-pipeline")
+    parser.add_argument("--prefetch", type=int, default=2,
+                        help="Files hashed/read ahead concurrently for --async-pipeline")
+    parser.add_argument("--writers", type=int, default=2,
+                        help="Concurrent cleaned-file writes for --async-pipeline")
+    parser.add_argument("--cache-dir", default="workspace/extraction_cache",
+                        help="Content-addressed extraction cache directory")
+    parser.add_argument("--cache-max-mb", type=int, default=4096,
+                        help="Evict least-recently-used cache entries above this size (0 = unbounded)")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the extraction cache")
+    parser.add_argument("--marker-service", action="store_true",
+                        help="Run Marker in one shared model process that batches pages across workers")
+    parser.add_argument("--marker-batch-pages", type=int, default=32,
+                        help="Pages per batched Marker conversion in --marker-service mode")
+    args = parser.parse_args()
+    if args.watch:
+        args.incremental = True
+    if args.coordinator and args.worker:
+        parser.error("--coordinator and --worker are mutually exclusive")
+
+    try:
+        page_ranges = parse_page_ranges_args(args.page_ranges)
+    except ValueError as e:
+        parser.error(f"--page-ranges: {e}")
+
+    if args.font_artifacts:
+        try:
+            loaded = load_font_artifacts(args.font_artifacts)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            parser.error(f"--font-artifacts: {e}")
+        os.environ[FONT_ARTIFACTS_ENV] = os.path.abspath(args.font_artifacts)
+        print(f"Loaded {loaded} extra font artifacts from {args.font_artifacts}")
+
+    backend_deadline = None
+    if args.backend_timeout or args.backend_timeout_per_page:
+        backend_deadline = BackendDeadline(args.backend_timeout, args.backend_timeout_per_page)
+
+    cleaned_dir = Path(args.cleaned_dir)
+    if args.images:
+        configure_images(str(cleaned_dir), args.image_min_size)
+    cache = None
+    if not args.no_cache:
+        cache = ExtractionCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+    if args.worker:
+        return run_queue_worker(WorkQueue(args.worker, args.lease_timeout), cache,
+                                args.marker_batch_pages if args.marker_service else None)
+
+    # Print available backends
+    print("=" * 60)
+    print("PDF Extraction Pipeline (adapted from ta-llm)")
+    print("=" * 60)
+    print(f"  Marker-PDF:  {'AVAILABLE' if MARKER_AVAILABLE else 'NOT AVAILABLE (fallback to pymupdf4llm)'}")
+    print(f"  pymupdf4llm: {'AVAILABLE' if PYMUPDF4LLM_AVAILABLE else 'NOT AVAILABLE'}")
+    print(f"  PyMuPDF raw: {'AVAILABLE' if PYMUPDF_AVAILABLE else 'NOT AVAILABLE'}")
+    print(f"  Textbook page limit: {args.textbook_page_limit}")
+    print(f"  Fallback: {args.fallback}"
+          + (f" (target quality {args.target_quality})" if args.fallback == "auto" else ""))
+    if args.images:
+        print(f"  Images: {cleaned_dir / IMAGE_STORE_DIR} (at least {args.image_min_size}px)")
+    if backend_deadline:
+        print(f"  Backend timeout: {args.backend_timeout:g}s"
+              + (f" + {args.backend_timeout_per_page:g}s/page" if args.backend_timeout_per_page else ""))
+    if args.coordinator:
+        print(f"  Work queue: {args.coordinator} (lease timeout {args.lease_timeout:g}s)")
+    else:
+        print(f"  Workers: {args.workers}")
+    print(f"  Cache: {'disabled' if args.no_cache else args.cache_dir}")
+    print()
+
+    history = BackendHistory(args.backend_history) if args.fallback == "auto" else None
+
+    file_options = {
+        "cleaned_dir": str(cleaned_dir),
+        "textbook_page_limit": args.textbook_page_limit,
+        "cache": cache,
+        "page_ranges": page_ranges,
+        "fallback": args.fallback,
+        "escalate_below": args.escalate_below,
+        "target_quality": args.target_quality,
+        "history": history,
+        "backend_deadline": backend_deadline,
+        "trace": bool(args.trace),
+    }
+
+    services = {"marker_service": None, "queue": None}
+    if args.coordinator:
+        services["queue"] = WorkQueue(args.coordinator, args.lease_timeout)
+        services["queue"].reset()
+    watcher = settings_cache = None
+    if args.watch:
+        watcher = SourceWatcher(Path(args.raw_dir), RAW_CATEGORIES, args.poll_interval)
+        settings_cache = SettingsCache()
+    try:
+        status = run_batch(args, file_options, services, settings_cache=settings_cache)
+        if watcher is not None:
+            status = max(status, watch_raw(args, file_options, services, watcher, settings_cache))
+    finally:
+        if services["marker_service"]:
+            services["marker_service"].stop()
+        if services["queue"]:
+            services["queue"].close()
+    return status
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Query the search index that scripts/extract_pdfs.py maintains over cleaned/.
+
+Hits are printed as file:page:offset. The offset is a character offset
+into the cleaned markdown file.
+
+Usage:
+    python scripts/search_cleaned.py words "uniform law of large numbers"
+    python scripts/search_cleaned.py equation '\\Theta_0'
+    python scripts/search_cleaned.py theorem 2.1 [--kind lemma] [--title "continuous mapping"]
+    python scripts/search_cleaned.py sync
+
+Options (after the command): [--index workspace/cleaned_index.sqlite]
+                             [--cleaned-dir cleaned/] [--limit N] [--json]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from extract_pdfs import CleanedIndex
+
+
+def format_hit(hit: dict) -> str:
+    page = hit["page"] if hit["page"] is not None else "-"
+    where = f"{hit['file']}:{page}:{hit['offset']}"
+    if "snippet" in hit:
+        return f"{where}  {hit['snippet']}"
+    if "latex" in hit:
+        return f"{where}  {hit['latex'][:160]}"
+    label = f"{hit['kind']} {hit['number'] or ''}".strip()
+    return f"{where}  {label}" + (f" ({hit['title']})" if hit["title"] else "")
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--index", default="workspace/cleaned_index.sqlite", help="Index file")
+    common.add_argument("--cleaned-dir", default="cleaned/", help="Cleaned output directory (for sync)")
+    common.add_argument("--limit", type=int, default=20, help="Maximum number of hits")
+    common.add_argument("--json", action="store_true", help="Print hits as JSON")
+
+    parser = argparse.ArgumentParser(description="Search the cleaned/ markdown index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    words = sub.add_parser("words", parents=[common],
+                           help="Full-text search (all words must occur on the page)")
+    words.add_argument("query")
+    equation = sub.add_parser("equation", parents=[common], help="Equations containing a LaTeX fragment")
+    equation.add_argument("latex")
+    theorem = sub.add_parser("theorem", parents=[common], help="Theorem/lemma/... headings")
+    theorem.add_argument("number", nargs="?", help="e.g. 2.1")
+    theorem.add_argument("--kind", help="theorem, lemma, proposition, corollary, definition, ...")
+    theorem.add_argument("--title", help="Substring of the parenthesized name")
+    sub.add_parser("sync", parents=[common], help="Re-index changed files in --cleaned-dir")
+    args = parser.parse_args()
+
+    with CleanedIndex(args.index) as index:
+        start = time.perf_counter()
+        if args.command == "sync":
+            indexed, removed = index.sync(args.cleaned_dir)
+            print(f"{indexed} file(s) indexed, {removed} removed")
+            return 0
+        if args.command == "words":
+            hits = index.search_words(args.query, args.limit)
+        elif args.command == "equation":
+            hits = index.search_equations(args.latex, args.limit)
+        else:
+            hits = index.find_headings(args.number, args.kind, args.title, args.limit)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if args.json:
+        print(json.dumps(hits, indent=2, ensure_ascii=False))
+    else:
+        for hit in hits:
+            print(format_hit(hit))
+        print(f"\n{len(hits)} hit(s) in {elapsed_ms:.1f} ms")
+    return 0 if hits else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
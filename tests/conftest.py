@@ -0,0 +1,45 @@
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# Pieces of extracted-page text that exercise the fixes and the scorer
+PAGE_PIECES = [
+    "The estimator is consistent under the stated regularity conditions.",
+    "Let α and β be fixed, with θ ∈ Θ and σ² → 0.",
+    "$\\hat\\theta_n \\to \\theta_0$ and $$\\sqrt{n}(\\hat\\theta - \\theta) \\Rightarrow N(0, V)$$",
+    "$α$ is the level; $x ≤ y$ holds; ÄÖαÜÄÖ; □□□ and ■",
+    "\\begin{equation} x = y \\end{equation}",
+    "## Section 2. Asymptotics",
+    "# Appendix",
+    "????? and ?? and ????",
+    "ctrl\x01char\x1f",
+    "ðx þ yÞ ¤ ‰ ½ ¼ ﬁ ﬂ ﬀ ﬃ ﬄ",
+    "bare \\alpha and \\frac{a}{b} and \\sum_{i=1}^n and \\mathbb{R}",
+    "Xn →d N(0,1) and Yn →p c and Zn →a.s. z, also +d and +p",
+    "```\ncode \\alpha $x$\n```",
+    "$$\nE[g] = 0\n$$",
+    "plain ASCII prose with numbers 1, 2, 3 and (parentheses).",
+    "Σ ∑ ∫ ∂ ∞ √ ≠ ≈ ⊂ ∩ ⇒ ⇔ ← ↔",
+    "$$ unterminated display",
+    "a $ b $ c $$ d $$ e $",
+]
+
+
+def make_pages(seed: int, count: int, pieces_per_page: int = 12,
+               pieces: list[str] = PAGE_PIECES) -> list[str]:
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(count):
+        parts = [rng.choice(pieces) for _ in range(pieces_per_page)]
+        pages.append(rng.choice(["\n", "\n\n", " "]).join(parts))
+    return pages
+
+
+@pytest.fixture
+def sample_pages() -> list[str]:
+    return make_pages(20240601, 200)
@@ -0,0 +1,202 @@
+"""
+Reference copies of the regex fixes and the equation scorer as they were
+before they were rewritten for speed, kept verbatim so the tests can
+check the current implementations against them.
+"""
+
+import re
+
+
+# Font encoding artifact map (common PDF extraction artifacts)
+FONT_ARTIFACTS = {
+    'ð': '(',
+    'Þ': ')',
+    'þ': '+',
+    '¤': 'ff',
+    '‰': 'ffi',
+    '½': '[',
+    '¼': '=',
+    'ﬁ': 'fi',
+    'ﬂ': 'fl',
+    'ﬀ': 'ff',
+    'ﬃ': 'ffi',
+    'ﬄ': 'ffl',
+}
+
+# LaTeX commands that should be wrapped in $...$ if found bare
+LATEX_COMMANDS = [
+    r'\\alpha', r'\\beta', r'\\gamma', r'\\delta', r'\\epsilon', r'\\varepsilon',
+    r'\\zeta', r'\\eta', r'\\theta', r'\\vartheta', r'\\iota', r'\\kappa',
+    r'\\lambda', r'\\mu', r'\\nu', r'\\xi', r'\\pi', r'\\rho', r'\\sigma',
+    r'\\tau', r'\\upsilon', r'\\phi', r'\\varphi', r'\\chi', r'\\psi', r'\\omega',
+    r'\\Gamma', r'\\Delta', r'\\Theta', r'\\Lambda', r'\\Xi', r'\\Pi',
+    r'\\Sigma', r'\\Upsilon', r'\\Phi', r'\\Psi', r'\\Omega',
+    r'\\hat', r'\\tilde', r'\\bar', r'\\vec', r'\\dot', r'\\ddot',
+    r'\\sum', r'\\prod', r'\\int', r'\\partial', r'\\nabla', r'\\infty',
+    r'\\sqrt', r'\\frac', r'\\mathbb', r'\\mathcal', r'\\mathbf', r'\\mathrm',
+    r'\\text', r'\\operatorname',
+]
+
+# Math operators that should be in math mode
+MATH_OPERATORS = [
+    r'E\s*\(', r'Var\s*\(', r'Cov\s*\(', r'Corr\s*\(',
+    r'plim', r'argmin', r'argmax', r'sup\b', r'inf\b',
+    r'log\s*\(', r'exp\s*\(', r'tr\s*\(',
+]
+
+# Convergence arrow patterns
+CONVERGENCE_PATTERNS = [
+    (r'→d\b', r'$\\xrightarrow{d}$'),
+    (r'→p\b', r'$\\xrightarrow{p}$'),
+    (r'→a\.s\.\b', r'$\\xrightarrow{a.s.}$'),
+    (r'\+d\b(?!\w)', r'$\\xrightarrow{d}$'),
+    (r'\+p\b(?!\w)', r'$\\xrightarrow{p}$'),
+]
+
+
+def is_in_math_mode(text: str, pos: int) -> bool:
+    """Check if position is inside $...$ or $$...$$ or \\[...\\]."""
+    # Count $ signs before position
+    before = text[:pos]
+
+    # Check $$...$$
+    dd_count = before.count('$$')
+    if dd_count % 2 == 1:
+        return True
+
+    # Check $...$  (but not $$)
+    # Remove $$ first, then count remaining $
+    stripped = before.replace('$$', '')
+    single_count = stripped.count('$')
+    if single_count % 2 == 1:
+        return True
+
+    # Check \[...\]
+    open_brackets = len(re.findall(r'\\\[', before))
+    close_brackets = len(re.findall(r'\\\]', before))
+    if open_brackets > close_brackets:
+        return True
+
+    return False
+
+
+def is_in_code_block(text: str, pos: int) -> bool:
+    """Check if position is inside a fenced code block."""
+    before = text[:pos]
+    fence_count = len(re.findall(r'^```', before, re.MULTILINE))
+    return fence_count % 2 == 1
+
+
+def is_in_yaml_frontmatter(text: str, pos: int) -> bool:
+    """Check if position is inside YAML frontmatter (between --- delimiters at start)."""
+    if not text.startswith('---'):
+        return False
+    end_marker = text.find('---', 3)
+    if end_marker == -1:
+        return False
+    return pos < end_marker + 3
+
+
+def apply_regex_latex_fixes(text: str) -> tuple[str, int]:
+    """
+    Apply regex-based LaTeX fixes adapted from ta-llm.
+    Returns (fixed_text, fix_count).
+    """
+    fix_count = 0
+
+    # 1. Fix font encoding artifacts
+    for artifact, replacement in FONT_ARTIFACTS.items():
+        if artifact in text:
+            count = text.count(artifact)
+            text = text.replace(artifact, replacement)
+            fix_count += count
+
+    # 2. Wrap bare LaTeX commands in $...$
+    for cmd in LATEX_COMMANDS:
+        # Match the command NOT already inside math mode
+        pattern = re.compile(r'(?<!\$)(' + cmd + r'(?:\{[^}]*\})?)(?!\$)')
+
+        for match in pattern.finditer(text):
+            pos = match.start()
+            if not is_in_math_mode(text, pos) and not is_in_code_block(text, pos) and not is_in_yaml_frontmatter(text, pos):
+                # Only wrap if not already in math
+                pass  # Complex replacement done below
+
+        # Simpler approach: find bare commands and wrap them
+        def wrap_if_bare(m):
+            nonlocal fix_count, text
+            start = m.start()
+            # Quick check: is there a $ immediately before?
+            if start > 0 and text[start-1] == '$':
+                return m.group(0)
+            if is_in_code_block(text, start):
+                return m.group(0)
+            fix_count += 1
+            return f'${m.group(0)}$'
+
+        # Reset and apply
+        text = pattern.sub(wrap_if_bare, text)
+
+    # 3. Fix convergence arrows
+    for pattern_str, replacement in CONVERGENCE_PATTERNS:
+        matches = re.findall(pattern_str, text)
+        if matches:
+            text = re.sub(pattern_str, replacement, text)
+            fix_count += len(matches)
+
+    return text, fix_count
+
+
+# ─── Equation quality scoring ──────────────────────────────────────────
+
+def score_equation_quality(text: str) -> dict:
+    """
+    Score the quality of equation extraction in the text.
+    Returns quality metrics dict.
+    """
+    # Count LaTeX equations (good)
+    display_eqs = len(re.findall(r'\$\$.+?\$\$', text, re.DOTALL))
+    inline_eqs = len(re.findall(r'(?<!\$)\$(?!\$).+?(?<!\$)\$(?!\$)', text))
+    env_eqs = len(re.findall(r'\\begin\{(equation|align|gather|multline)', text))
+    total_latex = display_eqs + inline_eqs + env_eqs
+
+    # Count garbled patterns (bad) — common PDF extraction failures
+    garbled_patterns = [
+        r'[^\x00-\x7F]{3,}',  # Long sequences of non-ASCII
+        r'(?:\?\?){2,}',  # Multiple ??
+        r'[\x00-\x08\x0b\x0c\x0e-\x1f]',  # Control characters
+        r'[□■▪▫◊◇○●]',  # Box/geometric chars (often garbled math)
+    ]
+    garbled_count = 0
+    for p in garbled_patterns:
+        garbled_count += len(re.findall(p, text))
+
+    # Count raw math patterns (mediocre — extracted but not in LaTeX)
+    raw_math_patterns = [
+        r'(?<!\$)(?:α|β|γ|δ|ε|θ|λ|μ|σ|τ|φ|ψ|ω|Γ|Δ|Θ|Λ|Σ|Φ|Ψ|Ω)(?!\$)',  # Unicode Greek not in math
+        r'(?<!\$)(?:∑|∏|∫|∂|∇|∞|√|≤|≥|≠|≈|∈|∉|⊂|⊃|∩|∪)(?!\$)',  # Unicode math operators
+        r'(?<!\$)(?:→|←|↔|⇒|⇐|⇔)(?!\$)',  # Arrows not in math
+    ]
+    raw_math_count = 0
+    for p in raw_math_patterns:
+        raw_math_count += len(re.findall(p, text))
+
+    # Score: start at 100, penalize garbled and raw
+    score = 100
+    score -= garbled_count * 5  # Heavy penalty
+    score -= raw_math_count * 2  # Light penalty
+    score = max(0, min(100, score))
+
+    # Bonus for having many proper LaTeX equations
+    if total_latex > 10:
+        score = min(100, score + 5)
+
+    return {
+        "quality_score": score,
+        "latex_equations": total_latex,
+        "display_equations": display_eqs,
+        "inline_equations": inline_eqs,
+        "environment_equations": env_eqs,
+        "garbled_patterns": garbled_count,
+        "raw_math_unicode": raw_math_count,
+    }
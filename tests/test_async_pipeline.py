@@ -0,0 +1,86 @@
+import multiprocessing
+import threading
+
+import pytest
+
+import extract_pdfs as ep
+
+
+@pytest.fixture(scope="module")
+def manager():
+    manager = multiprocessing.Manager()
+    yield manager
+    manager.shutdown()
+
+
+def fix_job(tmp_path, stream, stage=None):
+    return {"label": "reference/p.pdf", "trace": False, "ext": ".pdf",
+            "file_path": str(tmp_path / "missing.pdf"), "cache": None, "file_hash": None,
+            "body_path": str(tmp_path / "p.md.partial"), "spool_path": str(tmp_path / "p.jsonl"),
+            "stream": stream, "stage": stage}
+
+
+def expected_body(tmp_path, pages):
+    pipeline = ep.PagePipeline(tmp_path / "expected.md")
+    pipeline.begin("pymupdf4llm")
+    for idx, text in enumerate(pages):
+        pipeline.add(idx, text)
+    pipeline.finish()
+    return (tmp_path / "expected.md").read_text()
+
+
+def extract(channel, pages, fail_first=False):
+    """What extract_pdf_pages does with a sink, with a failed first backend."""
+    if fail_first:
+        channel.begin("pymupdf")
+        channel.add(0, "garbage from a backend that gave up")
+        channel.reset()
+    channel.begin("pymupdf4llm")
+    for idx, text in enumerate(pages):
+        channel.add(idx, text)
+
+
+def test_fix_stage_takes_pages_while_they_are_extracted(tmp_path, manager, sample_pages):
+    pages = sample_pages[:3 * ep.STREAM_PAGES]
+    stream, detached = manager.Queue(ep.STREAM_PAGES), manager.Event()
+    results = []
+    reader = threading.Thread(target=lambda: results.append(
+        ep.run_fix_stage(fix_job(tmp_path, stream))))
+    reader.start()
+
+    # Three times what the stream holds: this only returns if the pages are read meanwhile
+    channel = ep.PageChannel(stream, detached, tmp_path / "p.jsonl")
+    extract(channel, pages, fail_first=True)
+    channel.close()
+    stage = {"pages": None, "method": "pymupdf4llm", "variant": None, "warnings": []}
+    ep.send_page_record(stream, detached, {"end": stage})
+    reader.join(30)
+
+    assert results[0]["ok"]
+    assert (tmp_path / "p.md.partial").read_text() == expected_body(tmp_path, pages)
+
+    # A retried fix/score task replays the same pages from the spool
+    (tmp_path / "p.md.partial").unlink()
+    assert ep.run_fix_stage(fix_job(tmp_path, None, stage))["ok"]
+    assert (tmp_path / "p.md.partial").read_text() == expected_body(tmp_path, pages)
+
+
+def test_detached_stream_does_not_block_the_extraction(tmp_path, manager):
+    stream, detached = manager.Queue(2), manager.Event()
+    detached.set()
+    channel = ep.PageChannel(stream, detached, tmp_path / "p.jsonl")
+    extract(channel, ["page"] * 10)
+    channel.close()
+    assert stream.qsize() == 0
+    assert len((tmp_path / "p.jsonl").read_text().splitlines()) == 12
+
+
+def test_failed_extraction_ends_the_fix_stage(tmp_path, manager):
+    stream = manager.Queue(ep.STREAM_PAGES)
+    channel = ep.PageChannel(stream, manager.Event(), tmp_path / "p.jsonl")
+    channel.add(0, "half a document")
+    channel.close()
+    stream.put({"end": None})
+    result = ep.run_fix_stage(fix_job(tmp_path, stream))
+    assert not result["ok"]
+    assert not (tmp_path / "p.md.partial").exists()
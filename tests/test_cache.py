@@ -0,0 +1,94 @@
+import os
+
+import pymupdf
+import pytest
+
+import extract_pdfs as ep
+
+
+def make_pdf(path, count=3):
+    doc = pymupdf.open()
+    for i in range(count):
+        doc.new_page().insert_text((72, 72), f"Page {i + 1}: the estimator converges in probability. " * 3)
+    doc.save(path)
+    return str(path)
+
+
+def body(cleaned):
+    text = (cleaned / "reference" / "paper.md").read_text(encoding="utf-8")
+    return text.split("\n---\n", 1)[1]
+
+
+@pytest.fixture
+def fix_calls(monkeypatch):
+    calls = []
+    fix = ep.LatexFixer.fix
+
+    def counting_fix(self, text):
+        calls.append(text)
+        return fix(self, text)
+
+    monkeypatch.setattr(ep.LatexFixer, "fix", counting_fix)
+    return calls
+
+
+def no_backends(monkeypatch):
+    def unavailable(pdf_path, pages=None):
+        raise RuntimeError("backend ran")
+        yield
+
+    monkeypatch.setattr(ep, "backend_chain",
+                        lambda: [("pymupdf4llm", unavailable), ("pymupdf-raw", unavailable)])
+
+
+def test_cache_hit_round_trip(tmp_path, monkeypatch, fix_calls):
+    pdf = make_pdf(tmp_path / "paper.pdf")
+    cache = ep.ExtractionCache(str(tmp_path / "cache"))
+    cleaned = tmp_path / "cleaned"
+    first = ep.process_file(pdf, "reference", str(cleaned), cache=cache, fallback="fast")
+    assert first["status"] == "OK" and len(fix_calls) == 3
+    expected = body(cleaned)
+
+    # Raw pages, fixed pages and the score all come from the cache
+    no_backends(monkeypatch)
+    second = ep.process_file(pdf, "reference", str(cleaned), cache=cache, fallback="fast")
+    assert second["status"] == "OK" and len(fix_calls) == 3
+    assert body(cleaned) == expected
+    assert second["quality"] == first["quality"]
+    assert second["extraction_method"] == first["extraction_method"]
+    assert second["latex_fixes_applied"] == first["latex_fixes_applied"]
+
+
+def test_stage_versions_invalidate_their_entries(tmp_path, monkeypatch, fix_calls):
+    pdf = make_pdf(tmp_path / "paper.pdf")
+    cache = ep.ExtractionCache(str(tmp_path / "cache"))
+    cleaned = str(tmp_path / "cleaned")
+    ep.process_file(pdf, "reference", cleaned, cache=cache, fallback="fast")
+    no_backends(monkeypatch)
+
+    # New scorer: only the score is computed again, from the cached fixed pages
+    monkeypatch.setattr(ep, "SCORER_VERSION", ep.SCORER_VERSION + 1)
+    assert ep.process_file(pdf, "reference", cleaned, cache=cache, fallback="fast")["status"] == "OK"
+    assert len(fix_calls) == 3
+    assert len(list((tmp_path / "cache" / "quality").iterdir())) == 2
+
+    # New fixes: the cached raw pages are fixed again
+    monkeypatch.setattr(ep, "FIXES_VERSION", ep.FIXES_VERSION + 1)
+    assert ep.process_file(pdf, "reference", cleaned, cache=cache, fallback="fast")["status"] == "OK"
+    assert len(fix_calls) == 6
+    assert len(list((tmp_path / "cache" / "fixes").iterdir())) == 2
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ep.ExtractionCache(str(tmp_path / "cache"), max_bytes=2500)
+    for n, key in enumerate("abc"):
+        cache.put("quality", key, "x" * 1000)
+        path = tmp_path / "cache" / "quality" / f"{key}.json"
+        os.utime(path, (1000 + n, 1000 + n))
+    # A hit makes "a" the most recently used
+    assert cache.get("quality", "a") == "x" * 1000
+
+    assert cache.evict() == 1
+    assert cache.get("quality", "b") is None
+    assert cache.get("quality", "a") is not None and cache.get("quality", "c") is not None
+    assert ep.ExtractionCache(str(tmp_path / "cache")).evict() == 0
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+import extract_pdfs as ep
+
+LONG_PAGE = "A page long enough for the backend to be committed to. " * 20
+
+
+def hang(pdf_path, pages=None):
+    """A backend that produces its first page and then never finishes."""
+    yield pages[0], LONG_PAGE
+    time.sleep(600)
+
+
+def finish(pdf_path, pages=None):
+    for idx in pages:
+        yield idx, f"{LONG_PAGE} ({idx})"
+
+
+class RecordingSink(ep._PageCollector):
+    def __init__(self):
+        super().__init__()
+        self.resets = 0
+
+    def reset(self):
+        super().reset()
+        self.resets += 1
+
+
+@pytest.fixture
+def backend_worker():
+    # The worker is spawned and imports this module before the first
+    # deadline starts, so starting it does not count against one
+    list(ep.iter_pages_supervised(finish, "paper.pdf", [0], ep.BackendDeadline(120)))
+    yield
+    ep.kill_backend_worker()
+
+
+def test_hanging_backend_is_killed_and_the_worker_respawned(backend_worker):
+    process, _ = ep.get_backend_worker()
+    stream = ep.iter_pages_supervised(hang, "paper.pdf", [3], ep.BackendDeadline(1))
+    assert next(stream) == (3, LONG_PAGE)
+    started = time.monotonic()
+    with pytest.raises(ep.BackendTimeout, match="timed out after 1s"):
+        next(stream)
+    assert time.monotonic() - started < 10
+    assert ep._backend_worker is None and not process.is_alive()
+
+    pages = list(ep.iter_pages_supervised(finish, "paper.pdf", [0, 1], ep.BackendDeadline(120)))
+    assert [idx for idx, _ in pages] == [0, 1]
+    assert ep.get_backend_worker()[0].pid != process.pid
+
+
+def test_timed_out_backend_falls_back_to_the_next(backend_worker):
+    sink = RecordingSink()
+    method, warnings = ep.extract_pdf_pages(
+        "paper.pdf", sink, [0, 1], chain=[("hang", hang), ("finish", finish)],
+        deadline=ep.BackendDeadline(2),
+    )
+    assert method == "finish"
+    assert warnings == ["hang timed out after 2s and was killed, falling back"]
+    # The hanging backend's committed page was discarded
+    assert sink.resets == 1
+    assert sink.pages == [(0, f"{LONG_PAGE} (0)"), (1, f"{LONG_PAGE} (1)")]
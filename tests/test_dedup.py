@@ -0,0 +1,62 @@
+import extract_pdfs as ep
+
+WORDS = [f"w{i}" for i in range(2000)]
+
+
+def window(start: int) -> list[str]:
+    """A 1000-word sample; samples k words apart have shingle Jaccard similarity (997 - k) / (997 + k)."""
+    return WORDS[start:start + 1000]
+
+
+def signatures(tmp_path, samples: dict[str, list[str]]) -> tuple[list, ep.SourceSignatures]:
+    """Sources whose signatures are precomputed from word samples instead of read from PDFs."""
+    store = ep.SourceSignatures(str(tmp_path / "source_signatures.json"))
+    all_files = []
+    for name, words in samples.items():
+        path = tmp_path / name
+        path.write_bytes(b"%PDF " + " ".join(words[:5]).encode())
+        store.files[str(path)] = dict(ep.source_stat(str(path)), sha256=ep.hash_file(str(path)),
+                                      minhash=ep.minhash_signature(words))
+        all_files.append((str(path), "reference"))
+    return all_files, store
+
+
+def test_minhash_estimates_jaccard_similarity():
+    base = ep.minhash_signature(window(0))
+    for shift in (50, 100, 200, 400):
+        jaccard = (997 - shift) / (997 + shift)
+        assert abs(ep.minhash_similarity(base, ep.minhash_signature(window(shift))) - jaccard) < 0.15
+    assert ep.minhash_signature(WORDS[:ep.DEDUP_MIN_SHINGLES]) is None
+
+
+def test_near_copies_above_the_threshold_are_linked(tmp_path):
+    all_files, store = signatures(tmp_path, {
+        "arxiv.pdf": window(0), "journal.pdf": window(50), "sequel.pdf": window(200),
+    })
+    settings = [{}] * len(all_files)
+    duplicates = ep.find_duplicates(all_files, settings, store)
+    assert list(duplicates) == [1]
+    assert duplicates[1]["index"] == 0 and duplicates[1]["match"] == "near"
+    assert duplicates[1]["similarity"] >= ep.DEDUP_THRESHOLD
+
+    assert ep.find_duplicates(all_files, settings, store, threshold=0.99) == {}
+    assert list(ep.find_duplicates(all_files, settings, store, threshold=0.5)) == [1, 2]
+
+
+def test_exact_copies_and_settings(tmp_path):
+    all_files, store = signatures(tmp_path, {"a.pdf": window(0), "b.pdf": window(0), "c.pdf": window(0)})
+    duplicates = ep.find_duplicates(all_files, [{}, {}, {"textbook_page_limit": 20}], store)
+    # c.pdf is extracted with other settings, so it is not a copy of a.pdf
+    assert duplicates == {1: {"index": 0, "source_file": all_files[0][0],
+                              "match": "exact", "similarity": 1.0}}
+
+
+def test_near_matches_do_not_chain(tmp_path):
+    # b is close to a and c is close to b, but c is not close enough to a
+    all_files, store = signatures(tmp_path, {"a.pdf": window(0), "b.pdf": window(60), "c.pdf": window(120)})
+    sig = {name: store.files[path]["minhash"] for (path, _), name in zip(all_files, "abc")}
+    assert ep.minhash_similarity(sig["b"], sig["c"]) >= ep.DEDUP_THRESHOLD
+    assert ep.minhash_similarity(sig["a"], sig["c"]) < ep.DEDUP_THRESHOLD
+
+    duplicates = ep.find_duplicates(all_files, [{}] * 3, store)
+    assert {idx: d["index"] for idx, d in duplicates.items()} == {1: 0}
@@ -0,0 +1,65 @@
+import extract_pdfs as ep
+
+WEAK_PAGE = "x"
+MARKER_PAGE = "The Marker version of the page, long enough to score well on its own."
+
+
+def escalate(tmp_path, cache):
+    """Run one weak fast-backend page through PageEscalator into a PagePipeline."""
+    pipeline = ep.PagePipeline(tmp_path / "body.md", cache, "hash", None)
+    escalator = ep.PageEscalator(pipeline, str(tmp_path / "paper.pdf"), cache, "hash")
+    if not escalator.begin("pymupdf4llm"):
+        escalator.add(0, WEAK_PAGE)
+        escalator.finish()
+    stats = pipeline.finish()
+    return (tmp_path / "body.md").read_text(), stats, escalator.warnings
+
+
+def test_failed_escalation_is_retried_next_run(tmp_path, monkeypatch):
+    cache = ep.ExtractionCache(str(tmp_path / "cache"))
+    marker_up = False
+
+    def marker_pages(method, iter_fn, pdf, pages, cache, file_hash):
+        if not marker_up:
+            raise RuntimeError("marker crashed")
+        for idx in pages:
+            yield idx, MARKER_PAGE
+
+    monkeypatch.setattr(ep, "iter_backend_pages", marker_pages)
+    body, _, warnings = escalate(tmp_path, cache)
+    assert WEAK_PAGE in body and "failed: marker crashed" in warnings[0]
+
+    # Nothing was cached, so Marker is asked again
+    marker_up = True
+    body, stats, warnings = escalate(tmp_path, cache)
+    assert MARKER_PAGE in body and warnings == []
+    assert stats["escalated_pages"] == [0]
+
+    # A successful escalation is replayed from the cache
+    marker_up = False
+    body, stats, warnings = escalate(tmp_path, cache)
+    assert MARKER_PAGE in body and warnings == []
+    assert stats["escalated_pages"] == [0]
+
+
+def test_image_settings_are_part_of_the_escalation_key(tmp_path, monkeypatch):
+    cache = ep.ExtractionCache(str(tmp_path / "cache"))
+    calls = []
+
+    def marker_pages(method, iter_fn, pdf, pages, cache, file_hash):
+        calls.append(ep.IMAGE_STORE.variant() if ep.IMAGE_STORE else None)
+        for idx in pages:
+            yield idx, MARKER_PAGE
+
+    monkeypatch.setattr(ep, "iter_backend_pages", marker_pages)
+    try:
+        for min_size in (None, 32, 64, 32, None):
+            if min_size is None:
+                ep.disable_images()
+            else:
+                ep.configure_images(str(tmp_path / "cleaned"), min_size)
+            escalate(tmp_path, cache)
+    finally:
+        ep.disable_images()
+    # Each image setting escalated once, then replayed from the cache
+    assert calls == [None, "images:32", "images:64"]
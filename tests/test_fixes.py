@@ -0,0 +1,63 @@
+import extract_pdfs as ep
+import reference_pipeline as reference
+
+from conftest import make_pages
+
+# Page text on which the rewritten fixer must agree with the original one:
+# bare commands outside math, each on its own, no frontmatter
+FIX_PIECES = [
+    "Let \\alpha be the level and \\beta the power.",
+    "bare \\frac{a}{b} and \\sum_{i=1}^n and \\mathbb{R} and \\sqrt{n}",
+    "\\Gamma, \\Delta and \\Theta; \\varepsilon, \\epsilon and \\eta",
+    "\\hat and \\bar{x} and \\operatorname{rank} and \\text{if} (\\infty)",
+    "Xn →d N(0,1) and Yn →p c and Zn →a.s. z, also +d and +p",
+    "ðx þ yÞ ¤ ‰ ½ ¼ ﬁ ﬂ ﬀ ﬃ ﬄ",
+    "```\ncode \\alpha →d\n```",
+    "$x$ and $$y$$ with \\lambda between",
+    "\\[ x \\] then \\omega",
+    "plain ASCII prose with numbers 1, 2, 3 and (parentheses).",
+    "Σ ∑ ∫ ∂ ∞ √ ≠ ≈ ⊂ ∩ ⇒ ⇔ ← ↔",
+]
+
+
+def test_fixes_match_reference_on_sample_pages():
+    for page in make_pages(20240602, 300, pieces=FIX_PIECES) + FIX_PIECES:
+        assert ep.apply_regex_latex_fixes(page) == reference.apply_regex_latex_fixes(page), page
+
+
+# Where the rewrite deliberately differs from the original fixer
+
+def test_commands_inside_math_are_left_alone():
+    text = "$x = \\alpha + \\beta$ and $$\\sum_i w_i$$ and \\[ \\int f \\]"
+    assert ep.apply_regex_latex_fixes(text) == (text, 0)
+    assert reference.apply_regex_latex_fixes(text)[1] > 0
+
+
+def test_frontmatter_is_left_alone():
+    text = "---\ntitle: \\alpha-stable laws\n---\nbody \\alpha"
+    assert ep.apply_regex_latex_fixes(text) == (
+        "---\ntitle: \\alpha-stable laws\n---\nbody $\\alpha$", 1)
+
+
+def test_text_does_not_match_longer_commands():
+    assert ep.apply_regex_latex_fixes("\\textbf{Theorem} \\text{if}") == (
+        "\\textbf{Theorem} $\\text{if}$", 1)
+    assert reference.apply_regex_latex_fixes("\\textbf{Theorem}")[0] == "$\\text$bf{Theorem}"
+
+
+def test_nested_command_is_wrapped_once():
+    assert ep.apply_regex_latex_fixes("\\hat{\\theta} is consistent") == (
+        "$\\hat{\\theta}$ is consistent", 1)
+
+
+def test_page_by_page_matches_whole_document():
+    pages = [
+        "Intro \\alpha\n```\ncode \\beta",
+        "still code \\gamma\n```\nafter \\delta",
+        "$$\n\\sum_i x_i",
+        "\\int f\n$$\nthen \\pi and $x$ then \\rho →d",
+    ]
+    fixer = ep.LatexFixer()
+    fixed = [fixer.fix(page) for page in pages]
+    whole = ep.apply_regex_latex_fixes("\n\n".join(pages))
+    assert ("\n\n".join(text for text, _ in fixed), sum(n for _, n in fixed)) == whole
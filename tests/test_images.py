@@ -0,0 +1,76 @@
+import re
+from pathlib import Path
+
+import pymupdf
+import pytest
+
+import extract_pdfs as ep
+
+
+def png(size, rgb):
+    pixmap = pymupdf.Pixmap(pymupdf.csRGB, pymupdf.IRect(0, 0, size, size), False)
+    pixmap.set_rect(pixmap.irect, rgb)
+    return pixmap.tobytes("png")
+
+
+LOGO = png(96, (200, 30, 30))
+ICON = png(16, (30, 30, 200))
+
+
+def make_pdf(path, pages):
+    """A PDF whose page i shows the images in pages[i], each inserted separately."""
+    doc = pymupdf.open()
+    for n, images in enumerate(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {n + 1} of a paper with a logo in its header. " * 3)
+        for k, image in enumerate(images):
+            page.insert_image(pymupdf.Rect(72 + 120 * k, 100, 168 + 120 * k, 196), stream=image)
+    doc.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def cleaned(tmp_path):
+    ep.configure_images(str(tmp_path / "cleaned"), 32)
+    yield tmp_path / "cleaned"
+    ep.disable_images()
+
+
+def extract(pdf, cleaned):
+    report = ep.process_file(pdf, "reference", str(cleaned), fallback="fast")
+    assert report["status"] == "OK"
+    return report, (cleaned / "reference" / f"{Path(pdf).stem}.md").read_text()
+
+
+def test_repeated_logo_is_stored_once(tmp_path, cleaned):
+    first = make_pdf(tmp_path / "first.pdf", [[LOGO, ICON], [LOGO], []])
+    report, body = extract(first, cleaned)
+
+    stored = [p for p in (cleaned / ep.IMAGE_STORE_DIR).rglob("*") if p.is_file()]
+    assert len(stored) == 1 and stored[0].read_bytes().startswith(b"\x89PNG")
+    # The icon is below the size threshold; the logo is linked from both pages
+    assert report["images"] == {"linked": 2, "stored": 1, "too_small": 1, "missing": 0}
+
+    links = re.findall(r"!\[\]\(([^)]+)\)", body)
+    assert len(links) == 2 and len(set(links)) == 1
+    assert links[0].startswith(ep.IMAGE_LINK_PREFIX)
+    assert (cleaned / "reference" / links[0]).resolve() == stored[0].resolve()
+    pages = body.split("<!-- Page ")
+    assert [p.count("![](") for p in pages[1:]] == [1, 1, 0]
+
+    # The same logo in another file is already in the store
+    second = make_pdf(tmp_path / "second.pdf", [[LOGO]])
+    report, body = extract(second, cleaned)
+    assert report["images"]["stored"] == 0 and report["images"]["linked"] == 1
+    assert re.findall(r"!\[\]\(([^)]+)\)", body) == links[:1]
+
+
+def test_size_threshold(tmp_path, cleaned):
+    pdf = make_pdf(tmp_path / "paper.pdf", [[LOGO, ICON]])
+    ep.configure_images(str(cleaned), 8)
+    report, body = extract(pdf, cleaned)
+    assert report["images"]["stored"] == 2 and body.count("![](") == 2
+
+    ep.configure_images(str(cleaned), 128)
+    report, body = extract(pdf, cleaned)
+    assert report["images"]["too_small"] == 2 and "![](" not in body
@@ -0,0 +1,97 @@
+import json
+import os
+
+import extract_pdfs as ep
+
+OPTIONS = {"textbook_page_limit": 50, "fallback": "auto", "escalate_below": 80,
+           "target_quality": 80, "cache": None}
+
+
+def run(tmp_path, sources, options=OPTIONS, manifest=None, fail=()):
+    """Plan an incremental run and record every planned file in the manifest, as run_batch does."""
+    manifest = manifest or {"version": ep.MANIFEST_VERSION, "files": {}}
+    all_files = [(str(tmp_path / "raw" / name), "reference") for name in sources]
+    settings = [ep.pipeline_settings(fpath, cat, options) for fpath, cat in all_files]
+    todo, reused, reasons = ep.plan_incremental(all_files, manifest, settings)
+    for idx in todo:
+        fpath = all_files[idx][0]
+        out = tmp_path / "cleaned" / (os.path.basename(fpath) + ".md")
+        out.write_text("cleaned")
+        status = "FAILED" if os.path.basename(fpath) in fail else "OK"
+        report = {"source_file": fpath, "status": status, "output_file": str(out)}
+        manifest["files"][fpath] = ep.manifest_entry(fpath, settings[idx], report)
+    planned = sorted(os.path.basename(all_files[idx][0]) for idx in todo)
+    return planned, {k: v for k, v in reasons.items() if v}, manifest
+
+
+def write(tmp_path, name, content):
+    path = tmp_path / "raw" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    (tmp_path / "cleaned").mkdir(exist_ok=True)
+    return path
+
+
+def test_unchanged_and_touched_sources_are_skipped(tmp_path):
+    a = write(tmp_path, "a.pdf", b"%PDF a")
+    write(tmp_path, "b.pdf", b"%PDF b")
+    planned, reasons, manifest = run(tmp_path, ["a.pdf", "b.pdf"])
+    assert planned == ["a.pdf", "b.pdf"] and reasons == {"new": 2}
+
+    assert run(tmp_path, ["a.pdf", "b.pdf"], manifest=manifest)[:2] == ([], {})
+
+    # Same content under a new mtime: the hash decides, and the stat is refreshed
+    os.utime(a, ns=(0, 10**18))
+    assert run(tmp_path, ["a.pdf", "b.pdf"], manifest=manifest)[:2] == ([], {})
+    assert manifest["files"][str(a)]["mtime_ns"] == 10**18
+
+
+def test_changed_failed_and_missing_output_are_reprocessed(tmp_path):
+    for name in ("a.pdf", "b.pdf", "c.pdf", "d.pdf"):
+        write(tmp_path, name, f"%PDF {name}".encode())
+    manifest = run(tmp_path, ["a.pdf", "b.pdf", "c.pdf"], fail={"b.pdf"})[2]
+
+    write(tmp_path, "a.pdf", b"%PDF a, revised")
+    os.unlink(tmp_path / "cleaned" / "c.pdf.md")
+    planned, reasons, _ = run(tmp_path, ["a.pdf", "b.pdf", "c.pdf", "d.pdf"], manifest=manifest)
+    assert planned == ["a.pdf", "b.pdf", "c.pdf", "d.pdf"]
+    assert reasons == {"changed": 1, "retry": 1, "invalidated": 1, "new": 1}
+
+
+def test_settings_change_invalidates(tmp_path):
+    write(tmp_path, "a.pdf", b"%PDF a")
+    manifest = run(tmp_path, ["a.pdf"])[2]
+    # Reloaded from disk, the settings still compare equal
+    manifest = json.loads(json.dumps(manifest))
+    assert run(tmp_path, ["a.pdf"], manifest=manifest)[:2] == ([], {})
+
+    changed = dict(OPTIONS, textbook_page_limit=20)
+    assert run(tmp_path, ["a.pdf"], changed, manifest)[:2] == (["a.pdf"], {"invalidated": 1})
+
+
+def test_included_tex_file_is_part_of_the_source(tmp_path):
+    write(tmp_path, "main.tex", b"\\input{sections/intro}\nBody\n")
+    intro = write(tmp_path, "sections/intro.tex", b"Intro\n")
+    manifest = run(tmp_path, ["main.tex"])[2]
+    assert run(tmp_path, ["main.tex"], manifest=manifest)[:2] == ([], {})
+
+    intro.write_bytes(b"Intro, rewritten\n")
+    assert run(tmp_path, ["main.tex"], manifest=manifest)[:2] == (["main.tex"], {"invalidated": 1})
+
+
+def test_deleted_source_is_pruned_with_its_output(tmp_path):
+    write(tmp_path, "a.pdf", b"%PDF a")
+    write(tmp_path, "b.pdf", b"%PDF b")
+    manifest = run(tmp_path, ["a.pdf", "b.pdf"])[2]
+    out = tmp_path / "cleaned" / "b.pdf.md"
+
+    assert ep.prune_deleted_sources(manifest, {str(tmp_path / "raw" / "a.pdf")}) == [str(out)]
+    assert list(manifest["files"]) == [str(tmp_path / "raw" / "a.pdf")]
+    assert not out.exists()
+
+
+def test_manifest_of_another_version_starts_over(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"version": ep.MANIFEST_VERSION + 1, "files": {"x": {}}}))
+    assert ep.load_manifest(str(path)) == {"version": ep.MANIFEST_VERSION, "files": {}}
+    assert ep.load_manifest(str(tmp_path / "missing.json"))["files"] == {}
@@ -0,0 +1,35 @@
+import os
+import time
+from pathlib import Path
+
+import extract_pdfs as ep
+
+
+def fake_process_file(file_path, source_type, **options):
+    """slow.pdf takes a while; crash.pdf kills its worker."""
+    name = Path(file_path).name
+    if name == "crash.pdf":
+        os._exit(1)
+    if name == "slow.pdf":
+        time.sleep(1)
+    return {"source_file": file_path, "filename": name, "status": "OK"}
+
+
+def test_reports_in_job_order_and_crash_isolated(monkeypatch):
+    monkeypatch.setattr(ep, "process_file", fake_process_file)
+    names = ["slow.pdf", "a.pdf", "crash.pdf", "b.pdf"]
+    jobs = [(f"raw/reference/{name}", "reference") for name in names]
+
+    reports = ep.process_files_parallel(jobs, 2, cleaned_dir="cleaned")
+    assert [r["filename"] for r in reports] == names
+    assert [r["status"] for r in reports] == ["OK", "OK", "FAILED", "OK"]
+    assert "worker process crashed" in reports[2]["error"]
+
+
+def test_reports_go_to_on_report_as_they_finish(monkeypatch):
+    monkeypatch.setattr(ep, "process_file", fake_process_file)
+    jobs = [(f"raw/reference/{name}", "reference") for name in ("slow.pdf", "a.pdf")]
+    finished = []
+    assert ep.process_files_parallel(jobs, 2, on_report=lambda idx, r: finished.append(idx),
+                                     cleaned_dir="cleaned") is None
+    assert finished == [1, 0]
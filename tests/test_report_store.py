@@ -0,0 +1,85 @@
+import json
+
+import extract_pdfs as ep
+
+
+def report(name, **fields):
+    return {"source_file": f"raw/reference/{name}.pdf", "filename": f"{name}.pdf", **fields}
+
+
+def lines(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_records_survive_a_crash_before_close(tmp_path):
+    path = tmp_path / "reports.jsonl"
+    with ep.ReportStore(str(path)) as store:
+        store.append(report("a", status="OK"))
+
+    # Died mid-batch: one more finished record, then a torn one, no index update
+    store = ep.ReportStore(str(path))
+    store.append(report("b", status="OK"))
+    store._out.write(b'{"source_file": "raw/reference/c.pdf", "sta')
+    store._out.close()
+
+    store = ep.ReportStore(str(path))
+    assert sorted(store.records) == ["raw/reference/a.pdf", "raw/reference/b.pdf"]
+    assert store.get("raw/reference/b.pdf")["status"] == "OK"
+    assert [r["filename"] for r in lines(path)] == ["a.pdf", "b.pdf"]  # the torn line is cut off
+
+    store.append(report("c", status="OK"))
+    store.close()
+    assert [r["filename"] for r in lines(path)] == ["a.pdf", "b.pdf", "c.pdf"]
+    assert len(ep.ReportStore(str(path))) == 3
+
+
+def test_index_of_another_data_file_is_rebuilt(tmp_path):
+    path = tmp_path / "reports.jsonl"
+    with ep.ReportStore(str(path)) as store:
+        store.append(report("a", status="OK"))
+        store.append(report("b", status="OK"))
+
+    # Replaced behind the index's back, by a file longer than the one it indexed
+    replaced = [report("b", status="FAILED", error="x" * 40), report("c", status="OK")]
+    path.write_text("".join(json.dumps(r) + "\n" for r in replaced), encoding="utf-8")
+    store = ep.ReportStore(str(path))
+    assert sorted(store.records) == ["raw/reference/b.pdf", "raw/reference/c.pdf"]
+    assert store.get("raw/reference/b.pdf")["status"] == "FAILED"
+    assert [r["filename"] for r in store] == ["b.pdf", "c.pdf"]
+
+    # Truncated below what the index covers
+    path.write_text(json.dumps(report("d")) + "\n", encoding="utf-8")
+    store = ep.ReportStore(str(path))
+    assert list(store.records) == ["raw/reference/d.pdf"]
+
+
+def test_rewriting_a_source_keeps_its_latest_record(tmp_path):
+    path = tmp_path / "reports.jsonl"
+    store = ep.ReportStore(str(path))
+    store.append(report("a", status="OK"))
+    for attempt in range(4):
+        store.append(report("b", status="FAILED", attempt=attempt))
+    assert len(store) == 2
+    assert store.get("raw/reference/b.pdf")["attempt"] == 3
+    store.close()
+
+    # Superseded records outnumbered live ones, so close() compacted the file
+    assert [(r["filename"], r.get("attempt")) for r in lines(path)] == [("a.pdf", None), ("b.pdf", 3)]
+    reopened = ep.ReportStore(str(path))
+    assert reopened.get("raw/reference/b.pdf")["attempt"] == 3
+    assert reopened.stale == 0
+
+    # Without an index, a rescan also ends up at the latest record
+    reopened.index_path.unlink()
+    reopened = ep.ReportStore(str(path))
+    reopened.append(report("b", status="OK"))
+    reopened._out.close()
+    assert ep.ReportStore(str(path)).get("raw/reference/b.pdf")["status"] == "OK"
+
+
+def test_empty_store(tmp_path):
+    store = ep.ReportStore(str(tmp_path / "reports.jsonl"))
+    assert list(store) == []
+    assert store.get("raw/reference/a.pdf") is None
+    store.discard("raw/reference/a.pdf")
+    store.close()
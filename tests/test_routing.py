@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import extract_pdfs as ep
+
+# A math paper whose fast extraction scores 60 with 40% weak pages
+PROBE = SimpleNamespace(page_count=10, text_layer_pages=5, text_pages_sampled=5, sample_quality=60,
+                        weak_page_fraction=0.4, raw_math_per_page=20, unmapped_glyph_ratio=0.0)
+
+
+def page_route_report(score, seconds=10.0):
+    return {"status": "OK", "quality": {"quality_score": score},
+            "backend_route": {"doc_class": "full/math/clean", "route": "page", "pages": 10},
+            "profile": {"stages": {"extract:pymupdf4llm": {"wall_s": 1.0},
+                                   "escalate:marker-pdf": {"wall_s": seconds - 1.0}}}}
+
+
+def route(history=None):
+    return ep.route_backends(PROBE, 10, 80, history, marker=True)
+
+
+def test_prior_from_the_probe():
+    decision = route()
+    assert decision["doc_class"] == "full/math/clean"
+    assert {r: p["score"] for r, p in decision["predictions"].items()} == {
+        "fast": 60, "page": ep.ROUTE_PRIOR_MARKER_SCORE, "document": ep.ROUTE_PRIOR_MARKER_SCORE}
+    assert decision["route"] == "page"
+    assert decision["reason"].endswith("from probe")
+    assert ep.route_backends(PROBE, 10, 80, marker=False)["route"] == "fast"
+
+
+def test_history_replaces_the_prior_after_min_runs(tmp_path):
+    path = str(tmp_path / "history.json")
+    history = ep.BackendHistory(path)
+    for run in range(ep.ROUTE_MIN_RUNS):
+        assert route(history)["predictions"]["page"]["basis"] == "probe"
+        history.add_report(page_route_report(70))
+        # Files finished in this batch don't count until it ends
+        assert route(history)["predictions"]["page"]["basis"] == "probe"
+        history.save()
+
+    history = ep.BackendHistory(path)
+    decision = route(history)
+    assert decision["predictions"]["page"] == {
+        "score": 70, "seconds": 10.0, "basis": f"{ep.ROUTE_MIN_RUNS} past runs"}
+    # Page escalation no longer reaches 80 for this class; the document route does
+    assert decision["route"] == "document"
+
+
+def test_unlearnable_reports_are_ignored():
+    history = ep.BackendHistory()
+    history.add_report(dict(page_route_report(70), status="FAILED"))
+    history.add_report({"status": "OK", "quality": {"quality_score": 70}})
+    cached = page_route_report(70)
+    cached["backend_route"]["cached"] = True
+    history.add_report(cached)
+    history.add_report(cached)
+    history.save()
+    # Cached runs teach the score but not the speed
+    assert history.get("full/math/clean", "page") == {"runs": 2, "score": 70, "seconds_per_page": None}
+
+
+def test_choose_route():
+    report = {}
+    assert ep.choose_route(report, PROBE, None, "document", 80) == "document" and report == {}
+    assert ep.choose_route(report, None, None, "auto", 80) == "page" and report == {}
+
+    decision = dict(route(), route="fast")
+    assert ep.choose_route(report, PROBE, None, "auto", 80, decision=decision) == "fast"
+    assert report["backend_route"] == decision and report["backend_route"] is not decision
@@ -0,0 +1,45 @@
+import extract_pdfs as ep
+import reference_pipeline as reference
+
+from conftest import PAGE_PIECES
+
+
+def test_scorer_matches_reference_on_sample_pages(sample_pages):
+    for page in sample_pages + PAGE_PIECES:
+        result = ep.score_equation_quality(page)
+        result.pop("sections", None)
+        assert result == reference.score_equation_quality(page), page
+
+
+def test_overlapping_families_count_separately():
+    # A non-ASCII run holding Greek counts as garbled and as raw math
+    counts = ep.count_equation_patterns("ÄÖαÜÄÖ")
+    assert counts["garbled_patterns"] == 1
+    assert counts["raw_math_unicode"] == 1
+    # Box characters count singly and as a run
+    assert ep.count_equation_patterns("□□□")["garbled_patterns"] == 4
+
+
+def test_page_by_page_totals_add_up(sample_pages):
+    scorer = ep.EquationScorer()
+    for number, page in enumerate(sample_pages, 1):
+        scorer.add(page, page=number)
+    result = scorer.result()
+
+    expected = ep._empty_counts()
+    for page in sample_pages:
+        for key, value in ep.count_equation_patterns(page).items():
+            expected[key] += value
+    assert result == {**ep.quality_from_counts(expected), "pages": result["pages"],
+                      "sections": result["sections"]}
+    assert [p["page"] for p in result["pages"]] == list(range(1, len(sample_pages) + 1))
+    for key in ("garbled_patterns", "raw_math_unicode"):
+        assert sum(s[key] for s in result["sections"]) == expected[key]
+
+
+def test_sections_follow_headings():
+    result = ep.score_equation_quality("intro α\n## Proofs\nβ γ □\n# Appendix\n$x$")
+    assert [(s["heading"], s["raw_math_unicode"]) for s in result["sections"]] == [
+        (None, 1), ("Proofs", 2), ("Appendix", 0),
+    ]
+    assert result["sections"][1]["garbled_patterns"] == 1
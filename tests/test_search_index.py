@@ -0,0 +1,88 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import extract_pdfs as ep
+
+SEARCH_CLEANED = Path(__file__).resolve().parent.parent / "scripts" / "search_cleaned.py"
+
+PAPER = """---
+title: "A Paper"
+---
+
+<!-- Page 1 -->
+# Consistency
+
+The uniform law of large numbers holds.
+
+<!-- Page 2 -->
+**Theorem 2.1** (Consistency). The estimator converges:
+$$\\hat\\theta_{n} \\to \\theta_{0}$$
+and $\\sqrt{n}(\\hat\\theta - \\theta_0)$ is normal.
+"""
+
+BOOK = """---
+title: "A Book"
+---
+
+<!-- Page 1 -->
+Chapter one, with \\begin{align}\\dfrac{a}{b} &= c\\end{align}
+"""
+
+
+def cleaned_tree(tmp_path):
+    for name, text in (("reference/paper.md", PAPER), ("textbook/book.md", BOOK)):
+        path = tmp_path / "cleaned" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+    return tmp_path / "cleaned"
+
+
+def test_normalize_latex():
+    assert ep.normalize_latex(r"\left( x_{0} + \dfrac{1}{2} \right)") == r"(x_0+\frac1{2})"
+    assert ep.normalize_latex(r"\sqrt{n}\,\theta") == r"\sqrt n\theta"
+    assert ep.normalize_latex(r"\hat\theta_{n}") == ep.normalize_latex(r"\hat \theta_n")
+    assert ep.normalize_latex(r"x^{ab}") == "x^{ab}"
+
+
+def test_search_and_resync(tmp_path):
+    cleaned = cleaned_tree(tmp_path)
+    paper = str(cleaned / "reference" / "paper.md")
+    with ep.CleanedIndex(str(tmp_path / "index.sqlite")) as index:
+        assert index.sync(str(cleaned)) == (2, 0)
+        assert index.sync(str(cleaned)) == (0, 0)
+
+        hits = index.search_words("law of large numbers")
+        assert [(h["file"], h["page"]) for h in hits] == [(paper, 1)]
+        assert PAPER[hits[0]["offset"]:].startswith("law of large numbers")
+
+        # Written differently from the source, found by its normalized form
+        hits = index.search_equations(r"\hat \theta_n")
+        assert [(h["file"], h["page"], h["latex"]) for h in hits] == [
+            (paper, 2, "\\hat\\theta_{n} \\to \\theta_{0}")]
+        assert [h["page"] for h in index.search_equations(r"\sqrt{n}")] == [2]
+        assert len(index.search_equations(r"\frac{a}{b}")) == 1
+
+        headings = index.find_headings("2.1")
+        assert [(h["kind"], h["title"], h["page"]) for h in headings] == [("Theorem", "Consistency", 2)]
+
+        (cleaned / "textbook" / "book.md").unlink()
+        assert index.sync(str(cleaned)) == (0, 1)
+        assert index.search_equations(r"\frac{a}{b}") == []
+        assert index.search_words("chapter") == []
+
+
+def test_search_cleaned_script(tmp_path):
+    cleaned = cleaned_tree(tmp_path)
+    options = ["--index", str(tmp_path / "index.sqlite"), "--cleaned-dir", str(cleaned)]
+
+    def run(*args):
+        result = subprocess.run([sys.executable, str(SEARCH_CLEANED), *args, *options],
+                                capture_output=True, text=True, check=True)
+        return result.stdout
+
+    assert run("sync").startswith("2 file(s) indexed, 0 removed")
+    hits = json.loads(run("equation", r"\theta_{0}", "--json"))
+    assert [h["page"] for h in hits] == [2, 2]
+    assert "Theorem 2.1 (Consistency)" in run("theorem", "2.1")
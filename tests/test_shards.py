@@ -0,0 +1,74 @@
+import time
+
+import pymupdf
+
+import extract_pdfs as ep
+
+# A code block opened on page 1 closes on page 2: only a fixer that saw
+# page 1 leaves the code alone and wraps the prose command
+PAGES = ["intro\n```\ncode\n", "x = \\alpha + 1\n```\nprose \\alpha here",
+         "more \\beta text", "last page"]
+
+
+def make_pdf(path, count=len(PAGES)):
+    doc = pymupdf.open()
+    for i in range(count):
+        doc.new_page().insert_text((72, 72), f"page {i + 1}")
+    doc.save(path)
+    return str(path)
+
+
+def fake_backends(source, sink, route, pages=None, *args, **kwargs):
+    """A backend that fails once on the first page of each range, then extracts it."""
+    pages = pages if pages is not None else list(range(len(PAGES)))
+    sink.begin("flaky")
+    sink.add(pages[0], "garbage from a crashed attempt")
+    sink.reset()
+    sink.begin("fake")
+    for idx in pages:
+        sink.add(idx, PAGES[idx])
+    return "fake", []
+
+
+def body(path):
+    return path.read_text(encoding="utf-8").split("\n---\n", 1)[1]
+
+
+def test_sharded_output_equals_sequential_output(tmp_path, monkeypatch):
+    monkeypatch.setattr(ep, "run_backends", fake_backends)
+    pdf = make_pdf(tmp_path / "paper.pdf")
+    options = {"fallback": "page", "cache": ep.ExtractionCache(str(tmp_path / "cache"))}
+
+    sequential = ep.process_file(pdf, "reference", str(tmp_path / "sequential"), **options)
+    assert sequential["status"] == "OK"
+    expected = body(tmp_path / "sequential" / "reference" / "paper.md")
+    assert "prose $\\alpha$ here" in expected and "x = \\alpha + 1" in expected
+    assert "garbage" not in expected
+
+    cleaned = str(tmp_path / "sharded")
+    for shards in ([[0], [1, 2, 3]], [[0, 1], [2, 3]]):
+        for run in range(2):  # the second run replays the fixes cache
+            results = [ep.extract_shard(pdf, "reference", k, pages, cleaned, **options)
+                       for k, pages in enumerate(shards)]
+            report = ep.stitch_shards(pdf, "reference", cleaned, shards, results,
+                                      ep.StageProfiler("paper.pdf"), time.time(), options["cache"])
+            assert report["status"] == "OK" and report["extraction_method"] == "fake"
+            assert body(tmp_path / "sharded" / "reference" / "paper.md") == expected
+            assert report["quality"]["quality_score"] == sequential["quality"]["quality_score"]
+    assert sorted(p.name for p in (tmp_path / "sharded" / "reference").iterdir()) == ["paper.md"]
+
+
+def test_shards_share_the_document_route(tmp_path, monkeypatch):
+    routes = []
+
+    def record_route(source, sink, route, *args, **kwargs):
+        routes.append(route)
+        return fake_backends(source, sink, route, *args, **kwargs)
+
+    monkeypatch.setattr(ep, "run_backends", record_route)
+    pdf = make_pdf(tmp_path / "paper.pdf")
+    decision = {"route": "document", "doc_class": "full/prose/clean", "basis": "test"}
+    results = [ep.extract_shard(pdf, "reference", k, pages, str(tmp_path), route_decision=decision)
+               for k, pages in enumerate([[0, 1], [2, 3]])]
+    assert routes == ["document", "document"]
+    assert all(r["report"]["backend_route"]["route"] == "document" for r in results)
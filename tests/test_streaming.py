@@ -0,0 +1,38 @@
+import extract_pdfs as ep
+
+PAGE = "A page long enough for its backend to be committed to. " * 20
+
+
+def crashes_midway(pdf_path, pages=None):
+    yield 0, "CRASHED BACKEND " + PAGE
+    yield 1, "CRASHED BACKEND " + PAGE
+    raise RuntimeError("segfault-ish")
+
+
+def completes(pdf_path, pages=None):
+    for idx in range(3):
+        yield idx, f"Page {idx}: {PAGE}"
+
+
+def test_failed_backend_resets_the_streamed_body(tmp_path):
+    cache = ep.ExtractionCache(str(tmp_path / "cache"))
+    body_path = tmp_path / "paper.md.partial"
+    pipeline = ep.PagePipeline(body_path, cache, "hash")
+    method, warnings = ep.extract_pdf_pages(
+        "paper.pdf", pipeline, chain=[("crashes", crashes_midway), ("completes", completes)])
+    stats = pipeline.finish()
+
+    assert method == "completes"
+    assert warnings == ["crashes failed: segfault-ish"]
+    # Its two pages had been written to the body before it failed
+    body = body_path.read_text(encoding="utf-8")
+    assert "CRASHED" not in body
+    assert [line for line in body.splitlines() if line.startswith("<!--")] == [
+        "<!-- Page 1 -->", "<!-- Page 2 -->", "<!-- Page 3 -->"]
+    assert stats["raw_word_count"] == 3 * len(f"Page 0: {PAGE}".split())
+    assert [p["page"] for p in stats["quality"]["pages"]] == [1, 2, 3]
+
+    # Only the completed backend's output went into the fixes cache
+    assert len(list((tmp_path / "cache" / "fixes").iterdir())) == 1
+    assert cache.has_records("fixes", cache.pages_fixes_key("hash", "completes"))
+    assert not cache.has_records("fixes", cache.pages_fixes_key("hash", "crashes"))
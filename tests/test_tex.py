@@ -0,0 +1,66 @@
+import extract_pdfs as ep
+
+MAIN = r"""\documentclass{article}
+\title{A Draft}
+\author{A. Writer}
+\begin{document}
+Opening words. \input{sections/intro} Between.
+% \input{commented}
+\include{missing}
+\input{main}
+\end{document}
+"""
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_includes_are_inlined_in_place(tmp_path):
+    main = write(tmp_path, "main.tex", MAIN)
+    write(tmp_path, "sections/intro.tex", "Intro with \\input{details}.\n")
+    # Relative to the including file when not found next to the main file
+    write(tmp_path, "sections/details.tex", "The details.")
+    write(tmp_path, "commented.tex", "Never included.")
+
+    body, meta = ep.process_tex_file(str(main))
+    assert ("Opening words. \n% >>> intro.tex\nIntro with \n% >>> details.tex\nThe details."
+            "\n% <<< details.tex\n.\n\n% <<< intro.tex\n Between.") in body
+    assert "% \\input{commented}" in body and "Never included" not in body
+    assert meta["title"] == "A Draft" and meta["authors"] == "A. Writer"
+    assert meta["included_files"] == [str(tmp_path / "sections/intro.tex"),
+                                      str(tmp_path / "sections/details.tex")]
+    assert meta["extraction_warnings"] == [
+        "main.tex:7: included file 'missing' not found, left as is",
+        "main.tex:8: 'main' includes itself (cycle), left as is",
+    ]
+    # Both left as written
+    assert "\\include{missing}\n\\input{main}\n" in body
+
+
+def test_include_cycle_between_files(tmp_path):
+    a = write(tmp_path, "a.tex", "A starts \\input{b} A ends\n")
+    write(tmp_path, "b.tex", "B \\input{a}\n")
+    body, meta = ep.process_tex_file(str(a))
+    assert body.count("A starts") == 1 and "B \\input{a}" in body
+    assert meta["extraction_warnings"] == ["b.tex:1: 'a' includes itself (cycle), left as is"]
+
+
+def test_changed_include_invalidates_its_parent(tmp_path):
+    main = write(tmp_path, "main.tex", MAIN)
+    intro = write(tmp_path, "sections/intro.tex", "First intro.\n")
+    cache = ep.ExtractionCache(str(tmp_path / "cache"))
+    settings = ep.pipeline_settings(str(main), "reference", {})
+
+    body, meta = ep.process_tex_file(str(main), cache)
+    assert "First intro." in body and meta["tex_scans_cached"] == "0/2"
+    assert ep.pipeline_settings(str(main), "reference", {}) == settings
+
+    intro.write_text("Second intro.\n", encoding="utf-8")
+    assert ep.pipeline_settings(str(main), "reference", {}) != settings
+    body, meta = ep.process_tex_file(str(main), cache)
+    # Only the changed file is scanned again
+    assert "Second intro." in body and meta["tex_scans_cached"] == "1/2"
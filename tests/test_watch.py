@@ -0,0 +1,58 @@
+import os
+
+import extract_pdfs as ep
+
+
+def test_category_created_after_start_is_watched(tmp_path):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    watcher = ep.SourceWatcher(raw, ep.RAW_CATEGORIES, poll_interval=0.05)
+    try:
+        (raw / "draft").mkdir()
+        (raw / "draft" / "a.tex").write_text("first")
+        changed = watcher.wait(1.0)
+        # inotify may see the directory before the file lands in it
+        if str(raw / "draft" / "a.tex") not in changed:
+            changed |= watcher.wait(1.0)
+        assert str(raw / "draft" / "a.tex") in changed
+
+        (raw / "draft" / "b.pdf").write_text("second")
+        changed = watcher.wait(1.0)
+        assert str(raw / "draft" / "b.pdf") in changed
+        assert not any(path.startswith(str(raw / "notes")) for path in changed)
+    finally:
+        watcher.close()
+
+
+def test_settings_are_recomputed_only_for_changed_sources(tmp_path, monkeypatch):
+    draft = tmp_path / "draft"
+    draft.mkdir()
+    (draft / "main.tex").write_text("\\input{sec}\nBody\n")
+    (draft / "sec.tex").write_text("Section\n")
+    (draft / "paper.pdf").write_bytes(b"%PDF")
+    sources = [(str(draft / name), "draft") for name in ("main.tex", "paper.pdf", "sec.tex")]
+    options = {"cache": None}
+
+    computed = []
+    pipeline_settings = ep.pipeline_settings
+
+    def counting(file_path, source_type, file_options):
+        computed.append(os.path.basename(file_path))
+        return pipeline_settings(file_path, source_type, file_options)
+
+    monkeypatch.setattr(ep, "pipeline_settings", counting)
+    cache = ep.SettingsCache()
+    first = [cache.get(path, cat, options) for path, cat in sources]
+    assert sorted(computed) == ["main.tex", "paper.pdf", "sec.tex"]
+    assert str(draft / "sec.tex") in first[0]["included"]
+
+    computed.clear()
+    assert [cache.get(path, cat, options, set()) for path, cat in sources] == first
+    assert computed == []
+
+    # The included file changed: the including source is recomputed as well
+    (draft / "sec.tex").write_text("Section, longer now\n")
+    changed = {str(draft / "sec.tex")}
+    again = [cache.get(path, cat, options, changed) for path, cat in sources]
+    assert sorted(computed) == ["main.tex", "sec.tex"]
+    assert again[0]["included"] != first[0]["included"]
@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+import extract_pdfs as ep
+
+
+def make_queue(tmp_path, lease_timeout=60):
+    queue = ep.WorkQueue(str(tmp_path / "queue"), lease_timeout)
+    queue.reset()
+    for i in range(2):
+        queue.put(f"b-{i:06d}", {"file_path": f"raw/reference/p{i}.pdf", "source_type": "reference"})
+    return queue
+
+
+def age_lease(queue, item_id, seconds):
+    lease = queue.lease_path(item_id)
+    past = queue.now() - seconds
+    os.utime(lease, (past, past))
+
+
+def test_each_item_is_claimed_once(tmp_path):
+    queue = make_queue(tmp_path)
+    first, second = queue.claim("w1"), queue.claim("w2")
+    assert {first["id"], second["id"]} == {"b-000000", "b-000001"}
+    assert first["lease"] != second["lease"]
+    assert queue.claim("w3") is None
+
+
+def test_expired_lease_is_requeued_and_reclaimed(tmp_path):
+    queue = make_queue(tmp_path, lease_timeout=5)
+    item = queue.claim("w1")
+    assert queue.expire() == []
+
+    age_lease(queue, item["id"], 10)
+    assert queue.expire() == [(item["id"], "w1")]
+    reclaimed = queue.claim("w2")
+    assert reclaimed["id"] == item["id"]
+    assert reclaimed["lease"] != item["lease"]
+
+
+def test_stale_worker_cannot_complete_a_reclaimed_item(tmp_path):
+    queue = make_queue(tmp_path, lease_timeout=5)
+    stale = queue.claim("w1")
+    age_lease(queue, stale["id"], 10)
+    queue.expire()
+    fresh = queue.claim("w2")
+
+    assert not queue.complete(stale["id"], {"worker": "w1"}, stale["lease"])
+    assert not queue.result_path(stale["id"]).exists()
+    assert queue.holds(fresh["id"], fresh["lease"])  # the stale worker left the new lease alone
+
+    assert queue.complete(fresh["id"], {"worker": "w2"}, fresh["lease"])
+    assert dict(queue.results("b-", set())) == {fresh["id"]: {"worker": "w2"}}
+    assert not queue.lease_path(fresh["id"]).exists()
+
+
+def test_heartbeat_renews_only_its_own_lease(tmp_path):
+    queue = make_queue(tmp_path, lease_timeout=0.2)
+    item = queue.claim("w1")
+    with queue.heartbeat(item["id"], item["lease"]):
+        age_lease(queue, item["id"], 10)
+        time.sleep(0.15)
+        assert queue.now() - queue.lease_path(item["id"]).stat().st_mtime < 1
+
+    # Expired and taken by another worker: the old holder's heartbeat stops
+    queue.lease_path(item["id"]).unlink()
+    assert queue.claim("w2")["id"] == item["id"]
+    age_lease(queue, item["id"], 10)
+    with queue.heartbeat(item["id"], item["lease"]):
+        time.sleep(0.15)
+    assert queue.now() - queue.lease_path(item["id"]).stat().st_mtime > 5
+
+
+def test_worker_applies_the_coordinators_pipeline_settings(tmp_path):
+    builtin, builtin_version = dict(ep.FONT_ARTIFACTS), ep.fix_table_version()
+    ep.FONT_ARTIFACTS["Ł"] = "L"  # the coordinator loaded --font-artifacts
+    coordinator = dict(ep.queue_settings(), image_min_size=32)
+    ep.FONT_ARTIFACTS.pop("Ł")
+    try:
+        ep.apply_queue_settings(coordinator, str(tmp_path / "cleaned"))
+        assert ep.apply_regex_latex_fixes("Łemma")[0] == "Lemma"
+        assert ep.IMAGE_STORE.min_size == 32
+        assert ep.IMAGE_STORE.root == tmp_path / "cleaned" / ep.IMAGE_STORE_DIR
+        with pytest.raises(RuntimeError):
+            ep.apply_queue_settings(dict(coordinator, fix_table_version="other"), str(tmp_path))
+    finally:
+        ep.apply_queue_settings({"font_artifacts": builtin, "fix_table_version": builtin_version,
+                                 "image_min_size": None}, str(tmp_path))
+    assert ep.IMAGE_STORE is None
+    assert ep.apply_regex_latex_fixes("Łemma")[0] == "Łemma"